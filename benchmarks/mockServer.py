@@ -0,0 +1,152 @@
+#	lspJump - a gedit plugin to browse code using the LSP protocol
+#	Copyright (C) 2020  Florian Evaldsson
+
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+A language server that knows nothing about any language, it answers
+every request with generated data of a configurable size after a
+configurable delay. Used by run.py, it may also be set as lsp_bin of a
+profile to try the plugin against slow or chatty servers.
+"""
+
+import argparse
+import json
+import sys
+import time
+import threading
+
+def make_location(i):
+	return {"uri":"file:///mock/file%d.c" % (i % 100), "range":{"start":{"line":i, "character":4}, "end":{"line":i, "character":12}}}
+
+def make_symbol(i):
+	return {"name":"symbol_%d" % i, "kind":12, "containerName":"container_%d" % (i % 10), "location":make_location(i)}
+
+def make_document_symbol(i):
+	symbol_range = {"start":{"line":i * 10, "character":0}, "end":{"line":i * 10 + 9, "character":1}}
+	child_range = {"start":{"line":i * 10 + 1, "character":4}, "end":{"line":i * 10 + 1, "character":12}}
+	return {"name":"function_%d" % i, "kind":12, "range":symbol_range, "selectionRange":symbol_range, "children":[{"name":"local_%d" % i, "kind":13, "range":child_range, "selectionRange":child_range}]}
+
+def make_completion_item(i):
+	return {"label":"symbol_%d" % i, "kind":3, "detail":"int symbol_%d(void)" % i, "insertText":"symbol_%d" % i}
+
+class MockServer:
+	def __init__(self, args):
+		self.args = args
+		self.stdin = sys.stdin.buffer
+		self.stdout = sys.stdout.buffer
+		# answers are the same every time, build them once
+		self.results = {
+			"textDocument/definition": [make_location(i) for i in range(args.definitions)],
+			"textDocument/typeDefinition": [make_location(i + 1) for i in range(args.definitions)],
+			"textDocument/references": [make_location(i) for i in range(args.references)],
+			"textDocument/hover": {"contents":{"kind":"markdown", "value":"x" * args.hover_size}},
+			"textDocument/completion": {"isIncomplete":False, "items":[make_completion_item(i) for i in range(args.completions)]},
+			"textDocument/documentSymbol": [make_document_symbol(i) for i in range(args.document_symbols)],
+			"workspace/symbol": [make_symbol(i) for i in range(args.symbols)],
+			"shutdown": None
+		}
+		self.opened = {}
+		self.send_lock = threading.Lock()
+
+	def send(self, message):
+		body = json.dumps(message).encode("utf-8")
+		with self.send_lock:
+			self.stdout.write(b"Content-Length: %d\r\n\r\n" % len(body))
+			self.stdout.write(body)
+			self.stdout.flush()
+
+	def receive(self):
+		size = None
+		while True:
+			line = self.stdin.readline()
+			if not line:
+				return None
+			if line == b"\r\n":
+				break
+			if line.startswith(b"Content-Length:"):
+				size = int(line.split(b":")[1])
+		return json.loads(self.stdin.read(size))
+
+	def handle(self, message):
+		method = message.get("method")
+		if "id" not in message:
+			if method == "textDocument/didOpen":
+				document = message["params"]["textDocument"]
+				self.opened[document["uri"]] = len(document["text"])
+			elif method == "exit":
+				sys.exit(0)
+			return
+		if self.args.latency:
+			time.sleep(self.args.latency / 1000.0)
+		if method == "initialize":
+			result = {"capabilities":{"textDocumentSync":2, "hoverProvider":True, "definitionProvider":True, "typeDefinitionProvider":True, "referencesProvider":True, "completionProvider":{"triggerCharacters":["."], "resolveProvider":True}, "documentSymbolProvider":True, "workspaceSymbolProvider":True, "workspace":{"workspaceFolders":{"supported":True, "changeNotifications":True}}}}
+		elif method == "completionItem/resolve":
+			result = dict(message["params"], documentation={"kind":"plaintext", "value":"x" * self.args.hover_size})
+		elif method == "mock/opened":
+			# lets the harness wait until a didOpen has been read
+			result = len(self.opened)
+		else:
+			result = self.results.get(method)
+			params = message.get("params") or {}
+			if self.args.partial_batch and isinstance(result, list) and params.get("partialResultToken") is not None:
+				self.stream(params, result)
+				result = []
+		self.send({"jsonrpc":"2.0", "id":message["id"], "result":result})
+
+	def stream(self, params, result):
+		"""
+		Sends result as $/progress batches of --partial-batch items, with work
+		done progress if asked for.
+		"""
+		progress_token = params.get("workDoneToken")
+		if progress_token is not None:
+			self.send({"jsonrpc":"2.0", "method":"$/progress", "params":{"token":progress_token, "value":{"kind":"begin", "title":"Searching", "percentage":0}}})
+		size = self.args.partial_batch
+		for start in range(0, len(result), size):
+			self.send({"jsonrpc":"2.0", "method":"$/progress", "params":{"token":params["partialResultToken"], "value":result[start:start+size]}})
+			if progress_token is not None:
+				self.send({"jsonrpc":"2.0", "method":"$/progress", "params":{"token":progress_token, "value":{"kind":"report", "message":"%d found" % min(len(result), start+size), "percentage":100*min(len(result), start+size)//len(result)}}})
+			if self.args.batch_latency:
+				time.sleep(self.args.batch_latency / 1000.0)
+		if progress_token is not None:
+			self.send({"jsonrpc":"2.0", "method":"$/progress", "params":{"token":progress_token, "value":{"kind":"end"}}})
+
+	def run(self):
+		while True:
+			message = self.receive()
+			if message is None:
+				return
+			if self.args.parallel and "id" in message and message.get("method") != "initialize":
+				# like a server with a thread pool, the latencies overlap
+				threading.Thread(target=self.handle, args=(message,), daemon=True).start()
+			else:
+				self.handle(message)
+
+def parse_args(argv=None):
+	parser = argparse.ArgumentParser(description="Mock language server for benchmarks")
+	parser.add_argument("--latency", type=float, default=0, help="milliseconds to wait before every answer")
+	parser.add_argument("--definitions", type=int, default=1, help="locations in a definition answer")
+	parser.add_argument("--references", type=int, default=100, help="locations in a references answer")
+	parser.add_argument("--completions", type=int, default=100, help="items in a completion answer")
+	parser.add_argument("--symbols", type=int, default=100, help="symbols in a workspace/symbol answer")
+	parser.add_argument("--document-symbols", type=int, default=20, help="functions in a documentSymbol answer")
+	parser.add_argument("--hover-size", type=int, default=200, help="characters in a hover answer")
+	parser.add_argument("--partial-batch", type=int, default=0, help="stream list answers in batches of this many items if the client asks for it")
+	parser.add_argument("--parallel", action="store_true", help="answer requests concurrently instead of one after another")
+	parser.add_argument("--batch-latency", type=float, default=0, help="milliseconds to wait after every batch")
+	return parser.parse_args(argv)
+
+if __name__ == "__main__":
+	MockServer(parse_args()).run()
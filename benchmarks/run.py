@@ -0,0 +1,379 @@
+#	lspJump - a gedit plugin to browse code using the LSP protocol
+#	Copyright (C) 2020  Florian Evaldsson
+
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Times the protocol code of the plugin against mockServer.py, without gedit.
+
+	python3 benchmarks/run.py --references 10000 --open-size 5 --output before.json
+
+Every scenario is written to the JSON output as milliseconds per iteration
+(min, mean, p50, p95, max), compare two files to spot regressions.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+# lspJump/__init__.py is the gedit plugin and needs gi, the modules timed
+# here do not. Register the package without running it.
+package = types.ModuleType("lspJump")
+package.__path__ = [os.path.join(REPO_DIR, "lspJump")]
+sys.modules.setdefault("lspJump", package)
+
+from lspJump import settings
+from lspJump.LspNavigator import JsonRpcEndpoint, LspEndpoint, LspNavigator, orjson
+from lspJump.metrics import percentile
+from lspJump.lineCache import LineCache, EXECUTOR
+from lspJump.fuzzy import CompletionIndex
+from lspJump.symbolIndex import SymbolIndex
+
+class Location:
+	def __init__(self, path):
+		self.path = path
+
+	def get_path(self):
+		return self.path
+
+	def get_location(self):
+		return self
+
+class Language:
+	def __init__(self, name):
+		self.name = name
+
+	def get_name(self):
+		return self.name
+
+class Position:
+	"""
+	Enough of a GtkTextIter for the navigator.
+	"""
+	def __init__(self, line, offset):
+		self.line = line
+		self.offset = offset
+
+	def get_line(self):
+		return self.line
+
+	def get_line_offset(self):
+		return self.offset
+
+	def get_line_index(self):
+		# the text is ASCII
+		return self.offset
+
+class Document:
+	"""
+	Enough of a GeditDocument for the navigator, the text never changes.
+	"""
+	def __init__(self, path, text, language="C"):
+		self.file = Location(path)
+		self.language = Language(language)
+		self.text = text
+		self.handlers = {}
+
+	def get_file(self):
+		return self.file
+
+	def get_language(self):
+		return self.language
+
+	def get_start_iter(self):
+		return Position(0, 0)
+
+	def get_end_iter(self):
+		return Position(0, 0)
+
+	def get_text(self, start, end, include_hidden_chars):
+		return self.text
+
+	def connect(self, signal, handler):
+		handler_id = len(self.handlers) + 1
+		self.handlers[handler_id] = (signal, handler)
+		return handler_id
+
+	def disconnect(self, handler_id):
+		del self.handlers[handler_id]
+
+def summarize(times, **extra):
+	times = sorted(times)
+	def ms(value):
+		return round(value * 1000.0, 4)
+	result = {
+		"iterations": len(times),
+		"min_ms": ms(times[0]),
+		"mean_ms": ms(sum(times) / len(times)),
+		"p50_ms": ms(percentile(times, 0.50)),
+		"p95_ms": ms(percentile(times, 0.95)),
+		"max_ms": ms(times[-1])
+	}
+	result.update(extra)
+	return result
+
+def measure(iterations, function):
+	times = []
+	for i in range(iterations):
+		start = time.perf_counter()
+		function(i)
+		times.append(time.perf_counter() - start)
+	return times
+
+def mock_command(args):
+	command = [sys.executable, os.path.join(BENCH_DIR, "mockServer.py"),
+		"--latency", str(args.latency),
+		"--references", str(args.references),
+		"--completions", str(args.completions),
+		"--symbols", str(args.workspace_symbols),
+		"--hover-size", str(args.hover_size),
+		"--partial-batch", str(args.partial_batch)]
+	if args.parallel:
+		command.append("--parallel")
+	return command
+
+def bench_framing(args):
+	"""
+	JsonRpcEndpoint only: encoding a references answer and reading it back
+	through a pipe.
+	"""
+	items = [{"uri":"file:///mock/file%d.c" % (i % 100), "range":{"start":{"line":i, "character":4}, "end":{"line":i, "character":12}}} for i in range(args.references)]
+	message = {"jsonrpc":"2.0", "id":1, "result":items}
+	results = {}
+
+	class Sink:
+		def write(self, data):
+			pass
+		def flush(self):
+			pass
+	writer = JsonRpcEndpoint(Sink(), None)
+	size = writer.send_request(message)
+	results["framing_encode"] = summarize(measure(args.iterations, lambda i: writer.send_request(message)), bytes=size)
+
+	read_fd, write_fd = os.pipe()
+	read_file = os.fdopen(read_fd, "rb")
+	write_file = os.fdopen(write_fd, "wb")
+	def feed():
+		feeder = JsonRpcEndpoint(write_file, None)
+		for i in range(args.iterations):
+			feeder.send_request(message)
+		write_file.close()
+	thread = threading.Thread(target=feed, daemon=True)
+	thread.start()
+	reader = JsonRpcEndpoint(None, read_file)
+	results["framing_decode"] = summarize(measure(args.iterations, lambda i: reader.recv_response()), bytes=size)
+	thread.join()
+	read_file.close()
+	return results
+
+def bench_round_trip(args):
+	"""
+	LspEndpoint.call_method against the mock server, no conversion of the
+	answers.
+	"""
+	process = subprocess.Popen(mock_command(args), stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+	lsp_endpoint = LspEndpoint(None)
+	lsp_endpoint.attach(JsonRpcEndpoint(process.stdin, process.stdout))
+	lsp_endpoint.initialize(os.getpid(), None, None, None, {}, "off", [])
+	lsp_endpoint.set_ready()
+	params = {"textDocument":{"uri":"file:///mock/bench.c"}, "position":{"line":0, "character":0}}
+	results = {}
+	for name, method in (("call_definition", "textDocument/definition"), ("call_references", "textDocument/references")):
+		results[name] = summarize(measure(args.iterations, lambda i: lsp_endpoint.call_method(method, **params)))
+	lsp_endpoint.shutdown()
+	lsp_endpoint.send_notification("exit")
+	process.wait()
+	return results
+
+def bench_navigator(args):
+	"""
+	The LspNavigator requests the plugin makes, including document sync and
+	the conversion of the answers.
+	"""
+	profile = settings.LspProfile("bench", "C", mock_command(args)[0], " ".join(mock_command(args)[1:]), "", "{}")
+	navigator = LspNavigator(profile)
+	if not navigator.wait_ready(30):
+		raise RuntimeError("the mock server did not start")
+	doc = Document("/mock/bench.c", "int main(void)\n{\n\treturn 0;\n}\n")
+	results = {}
+	# a new position every time, the result cache would answer the same one
+	results["navigator_definition"] = summarize(measure(args.iterations, lambda i: navigator.getDefinitions(doc, Position(i, 4))))
+	results["navigator_definition_cached"] = summarize(measure(args.iterations, lambda i: navigator.getDefinitions(doc, Position(0, 4))))
+	results["navigator_references"] = summarize(measure(args.iterations, lambda i: navigator.getReferences(doc, Position(i, 4))), items=args.references)
+	if args.partial_batch:
+		# time until the first streamed batch arrives
+		times = []
+		for i in range(args.iterations):
+			got_batch = threading.Event()
+			start = time.perf_counter()
+			future = navigator.getReferencesAsync(doc, Position(i, 8), lambda batch: got_batch.set())
+			got_batch.wait(settings.requesttimeout)
+			times.append(time.perf_counter() - start)
+			future.result(settings.requesttimeout)
+		results["navigator_references_first_batch"] = summarize(times, items=args.references, batch=args.partial_batch)
+	results["navigator_hover"] = summarize(measure(args.iterations, lambda i: navigator.getHover(doc, Position(i, 4))), size=args.hover_size)
+	results["navigator_completion"] = summarize(measure(args.iterations, lambda i: navigator.getSuggestions(doc, Position(i, 4))), items=args.completions)
+	item = navigator.getSuggestions(doc, Position(0, 4))["items"][0]
+	results["navigator_completion_resolve"] = summarize(measure(args.iterations, lambda i: navigator.resolveCompletionItemAsync(item).result(settings.requesttimeout)))
+	# definition, type definition, hover and references of one position, new positions every time
+	def peek_sequential(i):
+		position = Position(10000 + i, 4)
+		navigator.getDefinitions(doc, position)
+		navigator.lsp_endpoint.wait_for(navigator.getTypeDefinitionsAsync(doc, position), settings.requesttimeout)
+		navigator.lsp_endpoint.wait_for(navigator.getHoverAsync(doc, position, False), settings.requesttimeout)
+		navigator.getReferences(doc, position)
+	results["navigator_peek_sequential"] = summarize(measure(args.iterations, peek_sequential), references=args.references)
+	results["navigator_peek"] = summarize(measure(args.iterations, lambda i: navigator.peekAsync(doc, Position(20000 + i, 4)).result(settings.requesttimeout)), references=args.references)
+	results["navigator_workspace_symbol"] = summarize(measure(args.iterations, lambda i: navigator.getWorkspaceSymbolsAsync("symbol_%d" % i).result(settings.requesttimeout)), items=args.workspace_symbols)
+
+	text = "x" * (args.open_size * 1024 * 1024)
+	def open_document(i):
+		big_doc = Document("/mock/big%d.c" % i, text)
+		navigator.documents.open(big_doc, "C")
+		# answered once the server has read the didOpen
+		navigator.lsp_endpoint.call_method("mock/opened")
+		navigator.closeDocument(big_doc)
+	results["navigator_did_open"] = summarize(measure(args.iterations, open_document), bytes=len(text))
+	results["navigator_metrics"] = navigator.lsp_endpoint.metrics.snapshot()["methods"]
+	navigator.shutdown()
+	return results
+
+def bench_line_cache(args):
+	"""
+	Preview lines of --references hits spread over --files files, read on
+	the thread pool like the results window does. Cold builds the line
+	indexes, warm reuses them.
+	"""
+	results = {}
+	with tempfile.TemporaryDirectory() as directory:
+		paths = []
+		for i in range(args.files):
+			path = os.path.join(directory, "file%d.c" % i)
+			with open(path, "w") as f:
+				f.write("".join("\tint variable_%d = function_%d(%d);\n" % (line, line, line) for line in range(args.file_lines)))
+			paths.append(path)
+		hits = {}
+		for i in range(args.references):
+			hits.setdefault(paths[i % len(paths)], []).append(1 + (i * 7919) % args.file_lines)
+		line_cache = LineCache(maxfiles=args.files)
+		def read_all(i):
+			futures = [EXECUTOR.submit(line_cache.get_lines, path, lines) for path, lines in hits.items()]
+			for future in futures:
+				future.result()
+		results["line_cache_cold"] = summarize(measure(1, read_all), files=args.files, references=args.references)
+		results["line_cache_warm"] = summarize(measure(args.iterations, read_all), files=args.files, references=args.references)
+	return results
+
+def bench_completion_filter(args):
+	"""
+	Narrowing a completion answer locally while a word is typed, one
+	keystroke at a time, instead of asking the server again.
+	"""
+	words = ["get", "set", "value", "buffer", "line", "text", "iter", "view", "document", "index"]
+	items = [{"label":"%s_%s%d" % (words[i % len(words)], words[(i // len(words)) % len(words)], i), "sortText":"%08d" % i} for i in range(args.completions)]
+	typed = "get_val"
+	def type_word(i):
+		index = CompletionIndex(items)
+		for end in range(len(typed) + 1):
+			index.filter(typed[:end], settings.completionmax)
+	return {"completion_filter_word": summarize(measure(args.iterations, type_word), items=args.completions, keystrokes=len(typed) + 1)}
+
+def bench_symbol_search(args):
+	"""
+	Searches of the symbol index, as typed into the symbol search window,
+	over --symbols symbols in --files files.
+	"""
+	words = ["get", "set", "value", "buffer", "line", "text", "iter", "view", "document", "index"]
+	rows = []
+	for i in range(args.symbols):
+		name = "%s_%s%d" % (words[i % len(words)], words[(i // len(words)) % len(words)], i)
+		rows.append((name, name.lower(), 12, None, "file:///mock/file%d.c" % (i % args.files), i, 4, i, 4 + len(name)))
+	results = {}
+	with tempfile.TemporaryDirectory() as directory:
+		index = SymbolIndex(os.path.join(directory, "symbols.sqlite"))
+		start = time.perf_counter()
+		index.add_symbols(rows)
+		results["symbol_index_fill"] = summarize([time.perf_counter() - start], symbols=args.symbols)
+		for name, query in (("prefix", "get_val"), ("fuzzy", "gvd")):
+			results["symbol_search_"+name] = summarize(measure(args.iterations, lambda i: index.search(query)), symbols=args.symbols)
+		index.close()
+	return results
+
+SCENARIOS = {
+	"completion_filter": bench_completion_filter,
+	"framing": bench_framing,
+	"line_cache": bench_line_cache,
+	"round_trip": bench_round_trip,
+	"navigator": bench_navigator,
+	"symbol_search": bench_symbol_search
+}
+
+def get_commit():
+	try:
+		return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, stderr=subprocess.DEVNULL).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="lspJump protocol benchmarks")
+	parser.add_argument("--iterations", type=int, default=50)
+	parser.add_argument("--latency", type=float, default=0, help="milliseconds the mock server waits before answering")
+	parser.add_argument("--references", type=int, default=10000, help="locations in a references answer")
+	parser.add_argument("--completions", type=int, default=1000, help="items in a completion answer")
+	parser.add_argument("--workspace-symbols", type=int, default=1000, help="symbols in a workspace/symbol answer")
+	parser.add_argument("--symbols", type=int, default=100000, help="symbols in the index of the symbol search scenario")
+	parser.add_argument("--hover-size", type=int, default=2000, help="characters in a hover answer")
+	parser.add_argument("--parallel", action="store_true", help="let the mock server answer requests concurrently")
+	parser.add_argument("--partial-batch", type=int, default=0, help="let the mock server stream references in batches of this size")
+	parser.add_argument("--files", type=int, default=3000, help="files the references of the line cache scenario are spread over")
+	parser.add_argument("--file-lines", type=int, default=500, help="lines in each of those files")
+	parser.add_argument("--open-size", type=int, default=5, help="MiB of text in a didOpen")
+	parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="run only these, may be repeated")
+	parser.add_argument("--output", help="write the JSON here instead of to stdout")
+	args = parser.parse_args(argv)
+
+	settings.DEBUG = False
+	# the navigator keeps a symbol index per profile, not in the user's cache
+	cache_directory = tempfile.TemporaryDirectory()
+	os.environ["XDG_CACHE_HOME"] = cache_directory.name
+	report = {
+		"commit": get_commit(),
+		"time": time.time(),
+		"python": platform.python_version(),
+		"orjson": orjson is not None,
+		"parameters": {key: value for key, value in vars(args).items() if key not in ("output", "scenario")},
+		"results": {}
+	}
+	for name in args.scenario or sorted(SCENARIOS):
+		report["results"].update(SCENARIOS[name](args))
+
+	if args.output:
+		with open(args.output, "w") as f:
+			json.dump(report, f, indent=1, sort_keys=True)
+	else:
+		json.dump(report, sys.stdout, indent=1, sort_keys=True)
+		sys.stdout.write("\n")
+
+if __name__ == "__main__":
+	main()
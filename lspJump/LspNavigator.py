@@ -16,18 +16,35 @@
 
 import os
 import re
+import socket
 import subprocess
 
 import threading
+import concurrent.futures
 import json
 import time
 import enum
-import urllib.parse
+try:
+	import orjson
+except ImportError:
+	orjson = None
 from lspJump import settings
+from lspJump import documentSync
+from lspJump.documentSync import DocumentSync, uri_to_path
+from lspJump.cache import HoverCache, ResultCache, MISSING, open_persistent_cache
+from lspJump.metrics import ProtocolMetrics
+from lspJump.symbolIndex import INDEX_EXECUTOR, open_index, symbol_information_row
+from lspJump.outline import Outline
+from lspJump.serverStatus import ServerStatus
+from lspJump import daemon
 
-JSON_RPC_REQ_FORMAT = "Content-Length: {json_string_len}\r\n\r\n{json_string}"
-LEN_HEADER = "Content-Length: "
-TYPE_HEADER = "Content-Type: "
+JSON_RPC_HEADER_FORMAT = b"Content-Length: %d\r\n\r\n"
+LEN_HEADER = b"Content-Length: "
+TYPE_HEADER = b"Content-Type: "
+READ_CHUNK_SIZE = 65536
+# may be sent before the server is initialized, everything else waits
+STARTUP_METHODS = ("initialize", "initialized", "shutdown", "exit")
+DOCUMENT_SYNC_METHODS = ("textDocument/didOpen", "textDocument/didChange", "textDocument/didClose", "textDocument/didSave")
 
 class SymbolKind(enum.Enum):
 	File = 1
@@ -57,6 +74,22 @@ class SymbolKind(enum.Enum):
 	Operator = 25
 	TypeParameter = 26
 
+# peek kind -> (LspNavigator method, server capability)
+PEEK_REQUESTS = {
+	"definition": ("getDefinitionsAsync", "definitionProvider"),
+	"typeDefinition": ("getTypeDefinitionsAsync", "typeDefinitionProvider"),
+	"hover": ("_peek_hover", "hoverProvider"),
+	"references": ("getReferencesAsync", "referencesProvider")
+}
+PEEK_KINDS = ("definition", "typeDefinition", "hover", "references")
+
+class ServerState(enum.Enum):
+	Starting = 1
+	Ready = 2
+	Failed = 3
+	Stopping = 4
+	Stopped = 5
+
 class ErrorCodes(enum.Enum):
 	# Defined by JSON RPC
 	ParseError = -32700
@@ -77,60 +110,95 @@ class MyEncoder(json.JSONEncoder):
 	def default(self, o): # pylint: disable=E0202
 		return o.__dict__ 
 
+if orjson is not None:
+	def json_dumps(message):
+		return orjson.dumps(message, default=lambda o: o.__dict__)
+	json_loads = orjson.loads
+else:
+	def json_dumps(message):
+		return json.dumps(message, cls=MyEncoder).encode("utf-8")
+	# takes bytes and bytearrays as well
+	json_loads = json.loads
+
 class JsonRpcEndpoint(object):
 	def __init__(self, stdin, stdout):
 		self.stdin = stdin
 		self.stdout = stdout
 		self.read_lock = threading.Lock() 
 		self.write_lock = threading.Lock() 
-
-	@staticmethod
-	def __add_header(json_string):
-		return JSON_RPC_REQ_FORMAT.format(json_string_len=len(json_string), json_string=json_string)
+		# bytes read from stdout but not yet consumed, reused between messages
+		self.buffer = bytearray()
+		# size of the body returned by the last recv_response
+		self.last_message_size = 0
 
 	def send_request(self, message):
-		json_string = json.dumps(message, cls=MyEncoder)
-		jsonrpc_req = self.__add_header(json_string)
+		json_data = json_dumps(message)
+		header = JSON_RPC_HEADER_FORMAT % len(json_data)
 		with self.write_lock:
-			write_data=jsonrpc_req.encode()
-			settings.debugprint("OUT::"+str(write_data))
-			self.stdin.write(write_data)
+			settings.debugprint("OUT::%s%s", header, json_data)
+			self.stdin.write(header)
+			self.stdin.write(json_data)
 			self.stdin.flush()
+		return len(header) + len(json_data)
+
+	def __fill_buffer(self):
+		chunk = self.stdout.read1(READ_CHUNK_SIZE)
+		if not chunk:
+			return False
+		self.buffer += chunk
+		return True
+
+	def __parse_headers(self, header_data):
+		message_size = None
+		for line in header_data.split(b"\r\n"):
+			if line.startswith(LEN_HEADER):
+				line = line[len(LEN_HEADER):].strip()
+				if not line.isdigit():
+					raise ResponseError(ErrorCodes.ParseError, "Bad header: size is not int")
+				message_size = int(line)
+			elif line.startswith(TYPE_HEADER):
+				# nothing todo with type for now.
+				pass
+			else:
+				raise ResponseError(ErrorCodes.ParseError, "Bad header: unkown header")
+		if not message_size:
+			raise ResponseError(ErrorCodes.ParseError, "Bad header: missing size")
+		return message_size
 
 	def recv_response(self):
 		with self.read_lock:
-			message_size = None
+			#read header
 			while True:
-				#read header
-				line = self.stdout.readline()
-				if not line:
+				header_end = self.buffer.find(b"\r\n\r\n")
+				if header_end >= 0:
+					break
+				if not self.__fill_buffer():
 					# server quit
 					return None
-				line = line.decode("utf-8")
-				if not line.endswith("\r\n"):
-					raise ResponseError(ErrorCodes.ParseError, "Bad header: missing newline")
-				#remove the "\r\n"
-				line = line[:-2]
-				if line == "":
-					# done with the headers
-					break
-				elif line.startswith(LEN_HEADER):
-					line = line[len(LEN_HEADER):]
-					if not line.isdigit():
-						raise ResponseError(ErrorCodes.ParseError, "Bad header: size is not int")
-					message_size = int(line)
-				elif line.startswith(TYPE_HEADER):
-					# nothing todo with type for now.
-					pass
-				else:
-					raise ResponseError(ErrorCodes.ParseError, "Bad header: unkown header")
-			if not message_size:
-				raise ResponseError(ErrorCodes.ParseError, "Bad header: missing size")
+			message_size = self.__parse_headers(bytes(self.buffer[:header_end]))
+			del self.buffer[:header_end+4]
 
-			jsonrpc_res = self.stdout.read(message_size).decode("utf-8")
+			if len(self.buffer) >= message_size:
+				body = self.buffer[:message_size]
+				del self.buffer[:message_size]
+			else:
+				# read the rest straight into the body, the read may come back short
+				body = bytearray(message_size)
+				view = memoryview(body)
+				received = len(self.buffer)
+				view[:received] = self.buffer
+				self.buffer.clear()
+				while received < message_size:
+					count = self.stdout.readinto(view[received:])
+					if not count:
+						view.release()
+						return None
+					received += count
+				view.release()
 			
-			settings.debugprint("IN::"+jsonrpc_res)
-			return json.loads(jsonrpc_res)
+			self.last_message_size = message_size
+			settings.debugprint("IN::%s", body)
+			return json_loads(body)
 
 def to_type(o, new_type):
 	if new_type == type(o):
@@ -145,34 +213,122 @@ class ResponseError(Exception):
 		if data:
 			self.data = data
 
-class LspEndpoint(threading.Thread):
+class LspEndpoint(object):
 	def __init__(self, json_rpc_endpoint, method_callbacks={}, notify_callbacks={}):
-		threading.Thread.__init__(self)
 		self.json_rpc_endpoint = json_rpc_endpoint
 		self.notify_callbacks = notify_callbacks
 		self.method_callbacks = method_callbacks
-		self.event_dict = {}
-		self.response_dict = {}
+		self.pending = {}
+		self.id_lock = threading.Lock()
 		self.next_id = 0
 		self.shutdown_flag = False
+		self.metrics = ProtocolMetrics()
+		# messages are held back until the server has been initialized
+		self.ready = False
+		self.queue = []
+		self.queue_lock = threading.Lock()
+		# set when there is no server to talk to, new requests fail right away
+		self.closed_error = None
+		# called without arguments from the reader thread when the server is gone
+		self.on_disconnect = None
+		# $/progress token -> handler(value), see call_method_streaming
+		self.progress_handlers = {}
+		self.next_token = 0
+		threading.Thread(target=self.__expire_requests, daemon=True).start()
+
+	def attach(self, json_rpc_endpoint):
+		"""
+		Connects to a (new) server once it has been spawned and starts a
+		reader thread for it.
+		"""
+		with self.queue_lock:
+			self.ready = False
+			self.closed_error = None
+		self.json_rpc_endpoint = json_rpc_endpoint
+		threading.Thread(target=self.run, args=(json_rpc_endpoint,), daemon=True).start()
+
+	def set_ready(self, replay=None):
+		"""
+		Called when initialize has been answered, sends everything that has
+		been queued up in the meantime.
+
+		replay is a list of (method, params) notifications restoring the
+		document state after a restart, they are sent first. The document
+		notifications they replace have to be dropped with drop_queued when
+		the replay is built.
+		"""
+		with self.queue_lock:
+			if replay is not None:
+				for method_name, params in replay:
+					self.metrics.notification_sent(method_name, self.json_rpc_endpoint.send_request({"jsonrpc":"2.0", "method":method_name, "params":params}))
+			for message_dict in self.queue:
+				self.metrics.bytes_sent(message_dict["method"], self.json_rpc_endpoint.send_request(message_dict))
+			self.queue = []
+			self.ready = True
+		# the queued requests have only been sent now
+		deadline = time.monotonic() + settings.requesttimeout
+		for future in list(self.pending.values()):
+			future.deadline = deadline
+
+	def drop_queued(self, methods):
+		"""
+		Forgets the queued notifications of methods, they have not been sent
+		yet.
+		"""
+		with self.queue_lock:
+			self.queue = [message_dict for message_dict in self.queue if message_dict["method"] not in methods]
+
+	def fail_pending(self, error, close=False):
+		"""
+		Fails all requests waiting for an answer, for when there will be none.
+		With close set the requests made later fail as well, otherwise they
+		are queued until the next set_ready.
+		"""
+		with self.queue_lock:
+			self.ready = False
+			self.queue = []
+			if close:
+				self.closed_error = error
+		pending = self.pending
+		self.pending = {}
+		for future in pending.values():
+			self.metrics.request_failed(future.method)
+			try:
+				future.set_exception(error)
+			except concurrent.futures.InvalidStateError:
+				pass
 
 	def handle_result(self, rpc_id, result, error):
 		if rpc_id is not None:
-			self.response_dict[rpc_id] = (result, error)
-			cond = self.event_dict[rpc_id]
-			cond.acquire()
-			cond.notify()
-			cond.release()
+			future = self.pending.pop(rpc_id, None)
+			if future is None:
+				# cancelled or unknown
+				return
+			self.metrics.response_received(future.method, self.json_rpc_endpoint.last_message_size, time.monotonic() - future.sent_at, error)
+			try:
+				if error:
+					future.set_exception(ResponseError(error.get("code"), error.get("message"), error.get("data")))
+				else:
+					future.set_result(result)
+			except concurrent.futures.InvalidStateError:
+				# cancelled while the answer was on its way
+				pass
 
 	def stop(self):
 		self.shutdown_flag = True
 
-	def run(self):
+	def run(self, json_rpc_endpoint):
 		while not self.shutdown_flag:
 			try:
-				jsonrpc_message = self.json_rpc_endpoint.recv_response()
+				try:
+					jsonrpc_message = json_rpc_endpoint.recv_response()
+				except (OSError, ValueError) as e:
+					settings.debugprint("read failed: %s", e)
+					jsonrpc_message = None
 				if jsonrpc_message is None:
 					settings.debugprint("server quit")
+					if not self.shutdown_flag and self.on_disconnect is not None:
+						self.on_disconnect()
 					break
 				method = jsonrpc_message.get("method")
 				result = jsonrpc_message.get("result")
@@ -181,7 +337,8 @@ class LspEndpoint(threading.Thread):
 				params = jsonrpc_message.get("params")
 
 				if method:
-					if rpc_id:
+					self.metrics.notification_received(method, self.json_rpc_endpoint.last_message_size)
+					if rpc_id is not None:
 						# a call for method
 						if method not in self.method_callbacks:
 							raise ResponseError(ErrorCodes.MethodNotFound, "Method not found: {method}".format(method=method))
@@ -189,9 +346,12 @@ class LspEndpoint(threading.Thread):
 						self.send_response(rpc_id, result, None)
 					else:
 						# a call for notify
-						if method not in self.notify_callbacks:
+						handler = self.progress_handlers.get(params.get("token")) if method == "$/progress" and params else None
+						if handler is not None:
+							handler(params.get("value"))
+						elif method not in self.notify_callbacks:
 							# Have nothing to do with this.
-							settings.debugprint("Notify method not found: {method}.".format(method=method))
+							settings.debugprint("Notify method not found: %s.", method)
 						else:
 							self.notify_callbacks[method](params)
 				else:
@@ -203,10 +363,11 @@ class LspEndpoint(threading.Thread):
 		message_dict = {}
 		message_dict["jsonrpc"] = "2.0"
 		message_dict["id"] = id
-		if result:
-			message_dict["result"] = result
 		if error:
 			message_dict["error"] = error
+		else:
+			# null is an answer too, it may not be left out
+			message_dict["result"] = result
 		self.json_rpc_endpoint.send_request(message_dict)
 
 	def send_message(self, method_name, params, id = None):
@@ -216,35 +377,171 @@ class LspEndpoint(threading.Thread):
 			message_dict["id"] = id
 		message_dict["method"] = method_name
 		message_dict["params"] = params
-		self.json_rpc_endpoint.send_request(message_dict)
+		if not self.ready and method_name not in STARTUP_METHODS:
+			with self.queue_lock:
+				if self.closed_error is not None:
+					return 0
+				if not self.ready:
+					self.queue.append(message_dict)
+					return 0
+		try:
+			return self.json_rpc_endpoint.send_request(message_dict)
+		except (OSError, ValueError) as e:
+			# the server is gone, the reader thread notices and takes care of it
+			settings.debugprint("write failed: %s", e)
+			return 0
 
-	def call_method(self, method_name, **kwargs):
-		current_id = self.next_id
-		self.next_id += 1
-		cond = threading.Condition()
-		self.event_dict[current_id] = cond
+	def __remove_queued(self, rpc_id):
+		with self.queue_lock:
+			for i, message_dict in enumerate(self.queue):
+				if message_dict.get("id") == rpc_id:
+					del self.queue[i]
+					return True
+		return False
 
-		cond.acquire()
-		self.send_message(method_name, kwargs, current_id)
-		if self.shutdown_flag:
-			return None
+	def call_method_async(self, method_name, **kwargs):
+		"""
+		Sends a request without waiting for the answer. Returns a
+		concurrent.futures.Future which is resolved from the reader thread.
+		"""
+		with self.id_lock:
+			current_id = self.next_id
+			self.next_id += 1
+		future = concurrent.futures.Future()
+		future.rpc_id = current_id
+		future.method = method_name
+		future.lsp_endpoint = self
+		future.sent_at = time.monotonic()
+		future.deadline = future.sent_at + settings.requesttimeout
+		if self.closed_error is not None:
+			future.set_exception(self.closed_error)
+			return future
+		self.pending[current_id] = future
+		self.metrics.request_sent(method_name)
+		self.metrics.bytes_sent(method_name, self.send_message(method_name, kwargs, current_id))
+		return future
 
-		cond.wait()
-		cond.release()
+	def call_method_streaming(self, method_name, on_partial_result, on_progress=None, **kwargs):
+		"""
+		Like call_method_async, but the server may send the answer in batches.
+		on_partial_result(value) is called from the reader thread for every
+		batch and on_progress(value) for the work done begin/report/end
+		notifications, all of them before the future is resolved. The result
+		of the future is only what has not been sent as a batch.
+		"""
+		with self.id_lock:
+			token = self.next_token
+			self.next_token += 1
+		# the request is alive as long as batches come in, see __expire_requests
+		sent = []
+		def keep_alive(handler):
+			def handle(value):
+				if sent:
+					sent[0].deadline = time.monotonic() + settings.requesttimeout
+				handler(value)
+			return handle
+		partial_token = "lspJump-partial-%d" % token
+		self.progress_handlers[partial_token] = keep_alive(on_partial_result)
+		tokens = [partial_token]
+		kwargs["partialResultToken"] = partial_token
+		if on_progress is not None:
+			progress_token = "lspJump-progress-%d" % token
+			self.progress_handlers[progress_token] = keep_alive(on_progress)
+			tokens.append(progress_token)
+			kwargs["workDoneToken"] = progress_token
+		future = self.call_method_async(method_name, **kwargs)
+		sent.append(future)
+		def forget(f):
+			for token in tokens:
+				self.progress_handlers.pop(token, None)
+		future.add_done_callback(forget)
+		return future
 
-		self.event_dict.pop(current_id)
-		result, error = self.response_dict.pop(current_id)
-		if error:
-			raise ResponseError(error.get("code"), error.get("message"), error.get("data"))
-		return result
+	def cancel_request(self, future):
+		"""
+		Cancels a request made with call_method_async (or a future chained to
+		it), the server is told with $/cancelRequest if it is still pending.
+		A request shared by several callers (ResultCache) is only cancelled
+		by the last of them.
+		"""
+		source = future
+		while hasattr(source, "source"):
+			release = getattr(source, "release", None)
+			if release is not None and not release():
+				# others still wait for the answer
+				source.cancel()
+				future.cancel()
+				return
+			source = source.source
+		rpc_id = getattr(source, "rpc_id", None)
+		if self.pending.pop(rpc_id, None) is not None:
+			self.metrics.request_cancelled(source.method)
+			if not self.__remove_queued(rpc_id):
+				self.send_notification("$/cancelRequest", id=rpc_id)
+		source.cancel()
+		future.cancel()
+		for part in getattr(future, "parts", ()):
+			# a combined future of several requests
+			self.cancel_request(part)
+
+	def __time_out(self, future):
+		"""
+		Gives up on the request of future, it fails with TimeoutError.
+		"""
+		rpc_id = getattr(future, "rpc_id", None)
+		if self.pending.pop(rpc_id, None) is None:
+			return
+		self.metrics.request_timed_out(future.method)
+		if not self.__remove_queued(rpc_id):
+			self.send_notification("$/cancelRequest", id=rpc_id)
+		try:
+			future.set_exception(concurrent.futures.TimeoutError(future.method+" timed out"))
+		except concurrent.futures.InvalidStateError:
+			pass
+
+	def __expire_requests(self):
+		"""
+		Times out the requests that have been waiting for longer than
+		settings.requesttimeout, hung requests would never be answered.
+		"""
+		while not self.shutdown_flag:
+			time.sleep(1)
+			if not self.ready:
+				# queued requests wait for the server to start
+				continue
+			now = time.monotonic()
+			for future in [future for future in list(self.pending.values()) if future.deadline < now]:
+				settings.debugprint("%s %s timed out", future.method, future.rpc_id)
+				self.__time_out(future)
+
+	def wait_for(self, future, timeout=None):
+		"""
+		Blocks until future is done, a request that takes longer than
+		timeout seconds is cancelled and counted as timed out.
+		"""
+		try:
+			return future.result(timeout)
+		except concurrent.futures.TimeoutError:
+			source = future
+			while hasattr(source, "source"):
+				source = source.source
+			self.__time_out(source)
+			self.cancel_request(future)
+			raise
+
+	def call_method(self, method_name, timeout=None, **kwargs):
+		future = self.call_method_async(method_name, **kwargs)
+		if self.shutdown_flag:
+			if self.pending.pop(future.rpc_id, None) is not None:
+				self.metrics.request_cancelled(method_name)
+			return None
+		return self.wait_for(future, timeout)
 
 	def send_notification(self, method_name, **kwargs):
-		self.send_message(method_name, kwargs)
+		self.metrics.notification_sent(method_name, self.send_message(method_name, kwargs))
 		
 	def initialize(self, processId, rootPath, rootUri, initializationOptions, capabilities, trace, workspaceFolders):
-		if self.native_id is None:
-			self.start()
-		return self.call_method("initialize", processId=processId, rootPath=rootPath, rootUri=rootUri, initializationOptions=initializationOptions, capabilities=capabilities, trace=trace, workspaceFolders=workspaceFolders)
+		return self.call_method("initialize", settings.initializetimeout, processId=processId, rootPath=rootPath, rootUri=rootUri, initializationOptions=initializationOptions, capabilities=capabilities, trace=trace, workspaceFolders=workspaceFolders)
 	
 	def shutdown(self):
 		self.stop()
@@ -261,147 +558,711 @@ class ReadPipe(threading.Thread):
 			settings.debugprint(line)
 			line = self.pipe.readline().decode('utf-8')
 
+def chain_future(future, convert, executor=None):
+	"""
+	Returns a new future with convert(result) of future, errors are passed on.
+	convert runs on executor if given, else in the thread completing future.
+	"""
+	new_future = concurrent.futures.Future()
+	new_future.source = future
+	def done(f):
+		if executor is not None:
+			executor.submit(finish, f)
+		else:
+			finish(f)
+	def finish(f):
+		if f.cancelled():
+			new_future.cancel()
+			return
+		try:
+			error = f.exception()
+			if error is None:
+				new_future.set_result(convert(f.result()))
+			else:
+				new_future.set_exception(error)
+		except concurrent.futures.InvalidStateError:
+			# new_future has been cancelled
+			pass
+		except Exception as e:
+			new_future.set_exception(e)
+	future.add_done_callback(done)
+	return new_future
+
+def completed_future(result):
+	future = concurrent.futures.Future()
+	future.set_result(result)
+	return future
+
+def get_process_rss(pid):
+	"""
+	Resident memory of pid in KiB, None where /proc is not available.
+	"""
+	try:
+		with open("/proc/"+str(pid)+"/status") as f:
+			for line in f:
+				if line.startswith("VmRSS:"):
+					return int(line.split()[1])
+	except (OSError, ValueError, IndexError):
+		pass
+	return None
+
 def workspace_configuration_function(params):
 	settings.debugprint(params)
 
 class LspNavigator:
-	def __init__(self):
-		bin_arr=settings.LSP_BIN.strip().split(" ")
-		args_arr=settings.LSP_BIN_ARGS.strip().split(" ")
+	def __init__(self, profile=None):
+		if profile is None:
+			profile = settings.get_current_profile()
+		self.profile = profile
+		self.process = None
+		# the connection to lspJump.daemon instead of process with settings.daemon
+		self.sock = None
+		self.state = ServerState.Starting
+		self.state_lock = threading.Lock()
+		self.ready_event = threading.Event()
+		# called as listener(navigator) from the starting thread once the server is ready or failed
+		self.ready_listeners = []
+		
+		# what the server reports doing on its own, indexing mostly
+		self.status = ServerStatus()
+		method_callbacks={"workspace_configuration":workspace_configuration_function,"workspace/configuration":workspace_configuration_function,"window/workDoneProgress/create":self.status.on_create}
+		notify_callbacks={"$/progress":self.status.on_progress}
+
+		# requests made before the server is ready are queued by the endpoint
+		self.lsp_endpoint = LspEndpoint(None,method_callbacks,notify_callbacks)
+		self.documents = DocumentSync(self.lsp_endpoint)
+		self.hover_cache = HoverCache()
+		self.result_cache = ResultCache()
+		# Outline per (uri, version), kept over saves unlike result_cache
+		self.outline_cache = ResultCache(64)
+		self.documents.change_listeners.append(self._on_document_changed)
+		# a save may change what the server knows about any other file too
+		self.documents.save_listeners.append(lambda open_doc: self.result_cache.clear())
+		self.server_capabilities = {}
+		self.workspace_folders = list(settings.get_project_paths())
+		self.symbol_index = open_index(self.profile.name, self.workspace_folders)
+		# definitions and references from earlier sessions, by content hash
+		self.persistent_cache = open_persistent_cache(self.profile.name)
+		self.documents.open_listeners.append(self._index_document)
+		self.documents.save_listeners.append(self._index_document)
+		self.ready_listeners.append(lambda navigator: self._refresh_symbol_index())
+
+		self.started_at = time.monotonic()
+		self.restart_count = 0
+		self.lsp_endpoint.on_disconnect = self._on_disconnect
+
+		# spawning and initializing may take a while, never do it on the GTK thread
+		threading.Thread(target=self._start_server, daemon=True).start()
+		# the daemon owns a shared server, restarting it is not up to one gedit
+		if settings.servermaxrss > 0 and not settings.daemon:
+			threading.Thread(target=self._watch_memory, daemon=True).start()
+
+	def _get_command(self):
+		bin_arr=self.profile.bin.strip().split(" ")
+		args_arr=self.profile.bin_args.strip().split(" ")
 		if len(args_arr[0])>0:
 			final_arr=bin_arr+args_arr
 		else:
 			final_arr=bin_arr
-		settings.debugprint(final_arr)
-		
-		self.process = subprocess.Popen(final_arr, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-		read_pipe = ReadPipe(self.process.stderr)
-		read_pipe.start()
-		json_rpc_endpoint = JsonRpcEndpoint(self.process.stdin, self.process.stdout)
-		# To work with socket: sock_fd = sock.makefile()
-		method_callbacks={"workspace_configuration":workspace_configuration_function,"workspace/configuration":workspace_configuration_function,"window/workDoneProgress/create":workspace_configuration_function}
-		notify_callbacks={"$/progress":workspace_configuration_function}
+		return final_arr
 
-		self.lsp_endpoint = LspEndpoint(json_rpc_endpoint,method_callbacks,notify_callbacks)
+	def _start_server(self, restart=False):
+		try:
+			final_arr=self._get_command()
+			settings.debugprint(final_arr)
+			if settings.daemon:
+				# one server for every gedit working on this project
+				root = self.workspace_folders[0] if self.workspace_folders else os.getcwd()
+				self.sock = daemon.connect(final_arr, root, idle_timeout=settings.daemonidletimeout)
+				self.lsp_endpoint.attach(JsonRpcEndpoint(self.sock.makefile("wb"), self.sock.makefile("rb")))
+			else:
+				self.process = subprocess.Popen(final_arr, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+				read_pipe = ReadPipe(self.process.stderr)
+				read_pipe.start()
+				self.lsp_endpoint.attach(JsonRpcEndpoint(self.process.stdin, self.process.stdout))
+			self._initialize_project_path(self.workspace_folders)
+			# a restarted server gets every open document again before anything else
+			replay = self._get_replay() if restart else None
+		except Exception as e:
+			if isinstance(e, concurrent.futures.TimeoutError):
+				e = ResponseError(ErrorCodes.InternalError, "No answer to initialize in "+str(settings.initializetimeout)+" s")
+				# it runs but hangs, another try may well work
+				restart = True
+			print("Could not start the language server of profile \""+str(self.profile.name)+"\":", e)
+			with self.state_lock:
+				stopping = self.state == ServerState.Stopping
+				retry = restart and not stopping
+				if not retry:
+					self.state = ServerState.Failed
+			if retry:
+				# it has worked before or hangs, keep trying
+				self.lsp_endpoint.fail_pending(e)
+				self._schedule_restart()
+				return
+			self.lsp_endpoint.fail_pending(e, True)
+			if stopping and self.process is not None:
+				self.process.kill()
+			self._close_socket()
+		else:
+			with self.state_lock:
+				stopping = self.state == ServerState.Stopping
+				if not stopping:
+					self.state = ServerState.Ready
+			self.started_at = time.monotonic()
+			if restart:
+				self.hover_cache.clear()
+				self.result_cache.clear()
+				self.outline_cache.clear()
+			self.lsp_endpoint.set_ready(replay)
+			if stopping:
+				# shut down while starting
+				self._stop_server()
+		self.ready_event.set()
+		for listener in list(self.ready_listeners):
+			listener(self)
 
-		# file_path = "/home/flev/dev/c++/qsound/sound.cpp"
-		
-	#	ugly
-		time.sleep(0.1)
-	#	self.lsp_endpoint.shutdown()
-	#	self.lsp_endpoint.send_notification("exit")
-		
-		self._initialize_project_path(settings.PROJECT_PATH)
+	def _get_replay(self):
+		"""
+		Returns the didOpen notifications of the open documents for
+		set_ready. Their text is read on the GTK thread, the document
+		notifications queued until then are dropped as it includes them.
+		"""
+		def build():
+			with self.documents.lock:
+				self.lsp_endpoint.drop_queued(DOCUMENT_SYNC_METHODS)
+				return self.documents.get_replay_messages()
+		return documentSync.run_on_main_loop(build)
+
+	def _on_disconnect(self):
+		"""
+		Called from the reader thread when the server went away without
+		being asked to.
+		"""
+		with self.state_lock:
+			state = self.state
+			if state not in (ServerState.Ready, ServerState.Starting):
+				return
+			self.state = ServerState.Starting
+		print("The language server of profile \""+str(self.profile.name)+"\" quit")
+		# nobody is going to answer these
+		self.lsp_endpoint.fail_pending(ResponseError(ErrorCodes.InternalError, "The language server quit"))
+		self.status.clear()
+		if state == ServerState.Ready:
+			self.ready_event.clear()
+			self._schedule_restart()
+		# while starting, _start_server sees initialize fail and decides
+
+	def _schedule_restart(self):
+		if time.monotonic() - self.started_at > settings.restartdelaymax:
+			# it had been running fine for a while
+			self.restart_count = 0
+		delay = min(settings.restartdelaymax, settings.restartdelay * (2 ** self.restart_count))
+		self.restart_count += 1
+		settings.debugprint("Restarting %s in %s s", self.profile.name, delay)
+		timer = threading.Timer(delay, self._restart)
+		timer.daemon = True
+		timer.start()
+
+	def _restart(self):
+		with self.state_lock:
+			if self.state == ServerState.Stopping:
+				self.state = ServerState.Stopped
+			if self.state != ServerState.Starting:
+				return
+		self._close_socket()
+		process = self.process
+		if process is not None and process.poll() is None:
+			process.kill()
+		if process is not None:
+			try:
+				process.wait(5)
+			except subprocess.TimeoutExpired:
+				pass
+		self._start_server(True)
+
+	def _close_socket(self):
+		sock = self.sock
+		self.sock = None
+		if sock is not None:
+			try:
+				sock.shutdown(socket.SHUT_RDWR)
+			except OSError:
+				pass
+			sock.close()
+
+	def _watch_memory(self):
+		"""
+		Recycles the server when it grows past settings.servermaxrss MiB,
+		killing it makes the reader restart it.
+		"""
+		while self.state not in (ServerState.Stopped, ServerState.Failed):
+			time.sleep(settings.rsscheckinterval)
+			process = self.process
+			if self.state != ServerState.Ready or process is None:
+				continue
+			rss = get_process_rss(process.pid)
+			if rss is not None and rss > settings.servermaxrss * 1024:
+				print("The language server of profile \""+str(self.profile.name)+"\" uses "+str(rss//1024)+" MiB, restarting it")
+				process.kill()
+
+	def is_ready(self):
+		return self.state == ServerState.Ready
+
+	def wait_ready(self, timeout=None):
+		self.ready_event.wait(timeout)
+		return self.is_ready()
 		
-	def getDefinitions(self, doc, identifier):
-		doctype=settings.get_document_programming_language_type(doc)
-		is_supported=settings.get_if_supported_language_type(doctype,True)
-		if is_supported:
-			doc_uri = doc.get_file().get_location().get_path()
-			
-			doc_curr_line=identifier.get_line()
-			doc_curr_offset=identifier.get_line_offset()
-			
-			settings.debugprint("DOC1::")
-			settings.debugprint(doc)
-			settings.debugprint("identifier::")
-			settings.debugprint(identifier)
-			settings.debugprint("Line::"+str(doc_curr_line)+" Offset::"+str(doc_curr_offset)+" File:"+doc_uri)
-	#		yield from self._call_global(doc, identifier, '-x')
-
-			uri = "file://" + doc_uri
-			text = open(doc_uri, "r").read()
-			languageId = doctype
-			version = 1
-			
-			text_doc={"uri":uri, "languageId":languageId, "version":version, "text":text}
-			result=self.lsp_endpoint.send_notification("textDocument/didOpen", textDocument=text_doc)
+	@staticmethod
+	def _convert_definitions(def_s):
+		try:
+			#{"jsonrpc": "2.0", "id": 10, "method": "textDocument/definition", "params": {"textDocument": {"uri": "file:///path.something"}, "position": {"line": 26, "character": 25}}}
+			#{"id":2,"jsonrpc":"2.0","result":[{"range":{"end":{"character":38,"line":575},"start":{"character":20,"line":575}},"uri":"file:///path.something"}]}
+			uri_path=""
+			find_line=0
+			find_char=0
+			find_end_line=0
+			find_end_char=0
+			found=False
 			
-			def_s=self.lsp_endpoint.call_method("textDocument/definition", textDocument={"uri":"file://"+doc_uri}, position={"line":doc_curr_line,"character":doc_curr_offset})
+			settings.debugprint(def_s)
 			
-			try:
-				#{"jsonrpc": "2.0", "id": 10, "method": "textDocument/definition", "params": {"textDocument": {"uri": "file:///path.something"}, "position": {"line": 26, "character": 25}}}
-				#{"id":2,"jsonrpc":"2.0","result":[{"range":{"end":{"character":38,"line":575},"start":{"character":20,"line":575}},"uri":"file:///path.something"}]}
-				uri_path=""
-				find_line=0
-				find_char=0
-				find_end_line=0
-				find_end_char=0
-				found=False
-				
-				settings.debugprint(def_s)
-				
-				if type(def_s) == list:
-					uri_path=def_s[0]['uri']
-					find_line=int(def_s[0]['range']['start']['line'])+1
-					find_char=int(def_s[0]['range']['start']['character'])+1
-					find_end_line=int(def_s[0]['range']['end']['line'])+1
-					find_end_char=int(def_s[0]['range']['end']['character'])+1
-					found=True
-				else:
-					uri_path=def_s['uri']
-					find_line=int(def_s['range']['start']['line'])+1
-					find_char=int(def_s['range']['start']['character'])+1
-					find_end_line=int(def_s['range']['end']['line'])+1
-					find_end_char=int(def_s['range']['end']['character'])+1
-					found=True
-				
-				if found:
-					urlp = urllib.parse.urlparse(uri_path)
-					urlps = urllib.parse.unquote(os.path.abspath(os.path.join(urlp.netloc, urlp.path)))
-					settings.debugprint("File:"+urlps+" From[Line:"+str(find_line)+" Character:"+str(find_char)+"]"+" To[Line:"+str(find_end_line)+" Character:"+str(find_end_char)+"]")
-					return [[urlps, find_line, find_char, uri_path]]
-				else:
-					return None
-			except IndexError:
+			if def_s is None:
 				return None
-		return None
-	def getReferences(self, doc, identifier):
-		doctype=settings.get_document_programming_language_type(doc)
-		is_supported=settings.get_if_supported_language_type(doctype,True)
-		retval=[]
-		if is_supported:
-			doc_uri = doc.get_file().get_location().get_path()
+			elif type(def_s) == list:
+				uri_path=def_s[0]['uri']
+				find_line=int(def_s[0]['range']['start']['line'])+1
+				find_char=int(def_s[0]['range']['start']['character'])+1
+				find_end_line=int(def_s[0]['range']['end']['line'])+1
+				find_end_char=int(def_s[0]['range']['end']['character'])+1
+				found=True
+			else:
+				uri_path=def_s['uri']
+				find_line=int(def_s['range']['start']['line'])+1
+				find_char=int(def_s['range']['start']['character'])+1
+				find_end_line=int(def_s['range']['end']['line'])+1
+				find_end_char=int(def_s['range']['end']['character'])+1
+				found=True
 			
-			doc_curr_line=identifier.get_line()
-			doc_curr_offset=identifier.get_line_offset()
+			if found:
+				urlps = uri_to_path(uri_path)
+				settings.debugprint("File:%s From[Line:%d Character:%d] To[Line:%d Character:%d]", urlps, find_line, find_char, find_end_line, find_end_char)
+				return [[urlps, find_line, find_char, uri_path]]
+			else:
+				return None
+		except IndexError:
+			return None
 
-			uri = "file://" + doc_uri
-			text = open(doc_uri, "r").read()
-			languageId = doctype
-			version = 1
-			
-			text_doc={"uri":uri, "languageId":languageId, "version":version, "text":text}
-			result=self.lsp_endpoint.send_notification("textDocument/didOpen", textDocument=text_doc)
-			
-			def_s=self.lsp_endpoint.call_method("textDocument/references", textDocument={"uri":"file://"+doc_uri}, position={"line":doc_curr_line,"character":doc_curr_offset})
-			
-			for def_itr in def_s:
-				urlp = urllib.parse.urlparse(def_itr['uri'])
-				urlps = urllib.parse.unquote(os.path.abspath(os.path.join(urlp.netloc, urlp.path)))
-				# settings.debugprint(def_s)
-				# settings.debugprint("File:"+urlps+" From[Line:"+str(def_s[0]['range']['start']['line']+1)+" Character:"+str(def_s[0]['range']['start']['character'])+"]"+" To[Line:"+str(def_s[0]['range']['end']['line']+1)+" Character:"+str(def_s[0]['range']['end']['character'])+"]")
-				retval.append([urlps, int(def_itr['range']['start']['line'])+1, int(def_itr['range']['start']['character']), def_itr['uri']])
-			
+	@staticmethod
+	def _convert_references(def_s):
+		retval=[]
+		if def_s is None:
+			return retval
+		for def_itr in def_s:
+			urlps = uri_to_path(def_itr['uri'])
+			retval.append([urlps, int(def_itr['range']['start']['line'])+1, int(def_itr['range']['start']['character']), def_itr['uri']])
 		return retval
-		
-	def getHover(self, doc, identifier):
+
+	def _open(self, doc, print_on_fail=True):
+		"""
+		Syncs doc with the server, returns the OpenDocument or None if the
+		document can not be handled by this server.
+		"""
 		doctype=settings.get_document_programming_language_type(doc)
-		doc_uri = doc.get_file().get_location().get_path()
-		
-		doc_curr_line=identifier.get_line()
-		doc_curr_offset=identifier.get_line_offset()
+		if print_on_fail is not None and not self.profile.supports(doctype,print_on_fail):
+			return None
+		return self.documents.open(doc, doctype)
 
-		uri = "file://" + doc_uri
-		text = open(doc_uri, "r").read()
-		languageId = doctype
-		version = 1
-		
-		text_doc={"uri":uri, "languageId":languageId, "version":version, "text":text}
-		result=self.lsp_endpoint.send_notification("textDocument/didOpen", textDocument=text_doc)
+	def _open_at(self, doc, identifier, print_on_fail=True):
+		"""
+		Like _open, returns (OpenDocument, position) or (None, None).
+		"""
+		open_doc = self._open(doc, print_on_fail)
+		if open_doc is None:
+			return None, None
+		return open_doc, self.documents.get_position(identifier)
+
+	def _request_at(self, method_name, open_doc, position, on_partial_result=None, on_progress=None, **params):
+		settings.debugprint("%s::Line::%d Offset::%d File:%s", method_name, position[0], position[1], open_doc.path)
+		if on_partial_result is not None:
+			return self.lsp_endpoint.call_method_streaming(method_name, on_partial_result, on_progress, textDocument={"uri":open_doc.uri}, position={"line":position[0],"character":position[1]}, **params)
+		return self.lsp_endpoint.call_method_async(method_name, textDocument={"uri":open_doc.uri}, position={"line":position[0],"character":position[1]}, **params)
+
+	def getDefinitionsAsync(self, doc, identifier):
+		return self._get_definitions(doc, identifier, True)
+
+	def prefetchDefinitionsAsync(self, doc, identifier):
+		"""
+		Like getDefinitionsAsync but an answer stored by an earlier session
+		is not taken, the future is done when the server has answered. Lets
+		the caller limit how many requests are on their way.
+		"""
+		return self._get_definitions(doc, identifier, False)
+
+	def _get_definitions(self, doc, identifier, take_stored):
+		open_doc, position = self._open_at(doc, identifier)
+		if open_doc is None:
+			return completed_future(None)
+		return self._persistent_request("textDocument/definition", open_doc, position, lambda wanted: chain_future(self._request_at("textDocument/definition", open_doc, position), self._convert_definitions), take_stored)
+
+	def getReferencesAsync(self, doc, identifier, on_partial=None, on_progress=None):
+		"""
+		The future resolves to all references. With on_partial set the server
+		is asked to stream them and on_partial(references) is called from the
+		reader thread for every batch converted so far, on_progress(value) gets
+		the work done progress. Neither is called for a cached answer.
+		"""
+		open_doc, position = self._open_at(doc, identifier)
+		if open_doc is None:
+			return completed_future([])
+		# nothing more is streamed once answered from disk, the check runs quietly
+		return self._persistent_request("textDocument/references", open_doc, position, lambda wanted: self._request_references(open_doc, position, on_partial, on_progress, wanted))
+
+	def _peek_hover(self, doc, identifier):
+		# asked for by the user, not held back
+		return self.getHoverAsync(doc, identifier, False)
+
+	def getTypeDefinitionsAsync(self, doc, identifier):
+		open_doc, position = self._open_at(doc, identifier)
+		if open_doc is None:
+			return completed_future(None)
+		key = ("textDocument/typeDefinition", open_doc.uri, open_doc.version, position)
+		return self.result_cache.request(key, lambda: chain_future(self._request_at("textDocument/typeDefinition", open_doc, position), self._convert_definitions))
+
+	def _persistent_request(self, method_name, open_doc, position, make_request, take_stored=True):
+		"""
+		Answers from result_cache, or else from persistent_cache if an
+		earlier session had an answer for the same content of the document.
+		The server is asked in any case unless result_cache had it, its
+		answer replaces the stored one. make_request(wanted) starts the
+		request, wanted() tells whether the caller still wants batches, it
+		does not once it got the stored answer.
+
+		Hashing the document and the lookup run on INDEX_EXECUTOR, whichever
+		answer comes first is taken.
+		"""
+		key = (method_name, open_doc.uri, open_doc.version, position)
+		result = self.result_cache.get(key, MISSING)
+		if result is not MISSING:
+			return completed_future(result)
+		lock = threading.Lock()
+		# "disk" once answered from there, "server" once a batch went out
+		answered_by = []
+		def wanted():
+			with lock:
+				if not answered_by:
+					answered_by.append("server")
+				return answered_by[0] == "server"
+		future = self.result_cache.request(key, lambda: make_request(wanted))
+		answer = concurrent.futures.Future()
+		# see LspEndpoint.cancel_request
+		answer.source = future
+		def server_done(f):
+			try:
+				if f.cancelled():
+					answer.cancel()
+				elif f.exception() is not None:
+					answer.set_exception(f.exception())
+				else:
+					answer.set_result(f.result())
+			except concurrent.futures.InvalidStateError:
+				# answered from disk or cancelled
+				pass
+		future.add_done_callback(server_done)
+		version, text = self.documents.get_text_to_hash(open_doc)
+		def look_up():
+			content_hash = self.documents.get_content_hash(open_doc, version, text)
+			stored = self.persistent_cache.get(method_name, open_doc.uri, content_hash, position) if take_stored else None
+			return content_hash, stored
+		def looked_up(f):
+			if f.exception() is not None:
+				settings.debugprint("persistent cache lookup failed: %s", f.exception())
+				return
+			content_hash, stored = f.result()
+			if stored is not None and not future.done():
+				with lock:
+					if not answered_by:
+						answered_by.append("disk")
+				if answered_by[0] == "disk":
+					settings.debugprint("%s answered from the persistent cache", method_name)
+					try:
+						answer.set_result(stored)
+					except concurrent.futures.InvalidStateError:
+						pass
+			def store(f):
+				# an empty answer may just mean that the server is still indexing
+				if not f.cancelled() and f.exception() is None and f.result():
+					INDEX_EXECUTOR.submit(self.persistent_cache.store, method_name, open_doc.uri, content_hash, position, f.result())
+			future.add_done_callback(store)
+		INDEX_EXECUTOR.submit(look_up).add_done_callback(looked_up)
+		return answer
+
+	def _request_references(self, open_doc, position, on_partial, on_progress, wanted):
+		if on_partial is None:
+			return chain_future(self._request_at("textDocument/references", open_doc, position), self._convert_references)
+		received = []
+		def partial(value):
+			batch = self._convert_references(value)
+			received.extend(batch)
+			if wanted():
+				on_partial(batch)
+		def progress(value):
+			if wanted():
+				on_progress(value)
+		future = self._request_at("textDocument/references", open_doc, position, partial, progress if on_progress is not None else None)
+		# the final answer only has what was not streamed
+		return chain_future(future, lambda result: received + self._convert_references(result))
+
+	def lookupHover(self, doc, identifier):
+		"""
+		Returns the cached HoverEntry covering identifier or None, never
+		talks to the server.
+		"""
+		open_doc = self.documents.get(doc)
+		if open_doc is None:
+			return None
+		return self.hover_cache.lookup(open_doc.uri, open_doc.version, self.documents.get_position(identifier))
+
+	def getHoverAsync(self, doc, identifier, background=True):
+		"""
+		background hovers (the pointer resting somewhere) are held back
+		while the server is indexing.
+		"""
+		open_doc, position = self._open_at(doc, identifier, None)
+		if open_doc is None:
+			return completed_future(None)
+		entry = self.hover_cache.lookup(open_doc.uri, open_doc.version, position)
+		if entry is not None:
+			return completed_future(entry.result)
+		if background and not self.status.admit_background():
+			settings.debugprint("hover held back, the server is busy: %s", self.status.describe())
+			return completed_future(None)
+		uri = open_doc.uri
+		version = open_doc.version
+		def store(result):
+			self.hover_cache.store(uri, version, position, result)
+			return result
+		return chain_future(self._request_at("textDocument/hover", open_doc, position), store)
+
+	@staticmethod
+	def _convert_completion(result):
+		# the server may answer with the bare item list
+		if result is None:
+			return {"isIncomplete":False, "items":[]}
+		if type(result) == list:
+			return {"isIncomplete":False, "items":result}
+		return {"isIncomplete":bool(result.get("isIncomplete", False)), "items":result.get("items") or []}
+
+	def getCompletionTriggerCharacters(self):
+		provider = self.server_capabilities.get("completionProvider") or {}
+		return provider.get("triggerCharacters") or []
+
+	def getSuggestionsAsync(self, doc, identifier, context=None):
+		"""
+		The future resolves to a CompletionList, context is the LSP
+		CompletionContext (triggerKind, triggerCharacter).
+		"""
+		open_doc, position = self._open_at(doc, identifier, None)
+		if open_doc is None:
+			return completed_future(None)
+		params = {}
+		if context is not None:
+			params["context"] = context
+		return chain_future(self._request_at("textDocument/completion", open_doc, position, **params), self._convert_completion)
+
+	def supportsCompletionResolve(self):
+		provider = self.server_capabilities.get("completionProvider") or {}
+		return bool(provider.get("resolveProvider", False))
+
+	def resolveCompletionItemAsync(self, item):
+		"""
+		Asks for the details (documentation, edits) the server left out of a
+		completion item, the future resolves to the complete item.
+		"""
+		if not self.supportsCompletionResolve():
+			return completed_future(item)
+		return self.lsp_endpoint.call_method_async("completionItem/resolve", **item)
+
+	def supportsDocumentSymbols(self):
+		return bool(self.server_capabilities.get("documentSymbolProvider", False))
+
+	def supportsWorkspaceSymbols(self):
+		return bool(self.server_capabilities.get("workspaceSymbolProvider", False))
+
+	def getDocumentSymbolsAsync(self, uri):
+		"""
+		The future resolves to the documentSymbol answer for uri, DocumentSymbol
+		trees or SymbolInformation.
+		"""
+		if self.is_ready() and not self.supportsDocumentSymbols():
+			return completed_future(None)
+		return self.lsp_endpoint.call_method_async("textDocument/documentSymbol", textDocument={"uri":uri})
+
+	def _request_outline(self, open_doc):
+		key = ("textDocument/documentSymbol", open_doc.uri, open_doc.version)
+		return self.outline_cache.request(key, lambda: chain_future(self.getDocumentSymbolsAsync(open_doc.uri), Outline))
+
+	def getOutlineAsync(self, doc):
+		"""
+		The future resolves to the lspJump.outline.Outline of the current
+		version of doc, or None if this server does not handle doc.
+		"""
+		open_doc = self._open(doc, None)
+		if open_doc is None:
+			return completed_future(None)
+		return self._request_outline(open_doc)
+
+	def lookupOutline(self, doc):
+		"""
+		Returns the Outline of the current version of doc if it is known,
+		never talks to the server.
+		"""
+		open_doc = self.documents.get(doc)
+		if open_doc is None:
+			return None
+		return self.outline_cache.get(("textDocument/documentSymbol", open_doc.uri, open_doc.version))
+
+	def _index_document(self, open_doc, forget_on_error=False):
+		if not self.supportsDocumentSymbols():
+			return
+		if isinstance(open_doc, str):
+			uri = open_doc
+			future = chain_future(self.getDocumentSymbolsAsync(uri), Outline)
+		else:
+			uri = open_doc.uri
+			# the same answer as the outline of that version
+			future = self._request_outline(open_doc)
+		future.add_done_callback(lambda f: INDEX_EXECUTOR.submit(self._store_document_symbols, uri, f, forget_on_error))
+
+	def _store_document_symbols(self, uri, future, forget_on_error):
+		if future.cancelled() or future.exception() is not None:
+			if forget_on_error:
+				# most likely gone or no longer part of the project
+				self.symbol_index.remove_file(uri)
+			return
+		self.symbol_index.replace_file(uri, future.result().get_rows(uri))
+
+	def _refresh_symbol_index(self):
+		"""
+		Fills the index in the background once the server is ready: every
+		symbol the server tells about, then the indexed files that changed on
+		disk since the last session and the open documents again.
+		"""
+		if not self.is_ready():
+			return
+		if self.supportsWorkspaceSymbols():
+			chain_future(self.lsp_endpoint.call_method_async("workspace/symbol", query=""), self._store_workspace_symbols, INDEX_EXECUTOR)
+		with self.documents.lock:
+			# opened before the capabilities were known
+			open_docs = list(self.documents.documents.values())
+		open_uris = set(open_doc.uri for open_doc in open_docs)
+		for open_doc in open_docs:
+			self._index_document(open_doc)
+		def refresh_changed():
+			changed = [uri for uri in self.symbol_index.get_changed_files(self.workspace_folders) if uri not in open_uris]
+			def request():
+				for uri in changed:
+					self._index_document(uri, True)
+			# nobody is waiting for these, the indexer goes first
+			self._when_idle(request)
+		INDEX_EXECUTOR.submit(refresh_changed)
+
+	def _when_idle(self, callback):
+		"""
+		Calls callback now or, while the server is indexing, from the reader
+		thread once it is done.
+		"""
+		if not self.status.is_indexing():
+			callback()
+			return
+		def listener(status):
+			if not status.is_indexing() and listener in status.listeners:
+				status.listeners.remove(listener)
+				callback()
+		self.status.listeners.append(listener)
+
+	def _store_workspace_symbols(self, result):
+		rows = [symbol_information_row(symbol) for symbol in result or [] if "location" in symbol]
+		self.symbol_index.add_symbols(rows)
+		return len(rows)
+
+	def searchSymbols(self, query, limit=200):
+		"""
+		Searches the local symbol index, never talks to the server. Returns
+		rows (name, kind, container, uri, line, character).
+		"""
+		return self.symbol_index.search(query, limit)
+
+	def getWorkspaceSymbolsAsync(self, query):
+		"""
+		Asks the server for the symbols matching query and merges them into
+		the local index, the future resolves to their number once they can be
+		found with searchSymbols.
+		"""
+		if not self.supportsWorkspaceSymbols():
+			return completed_future(0)
+		future = self.lsp_endpoint.call_method_async("workspace/symbol", query=query)
+		return chain_future(future, self._store_workspace_symbols, INDEX_EXECUTOR)
+
+	def peekAsync(self, doc, identifier, kinds=PEEK_KINDS, on_part=None):
+		"""
+		Sends the requests of kinds (see PEEK_REQUESTS) for one position back
+		to back, they are all on their way before the first answer arrives.
+		The future resolves to {kind: result} once all are answered, a kind
+		that failed or that the server does not support is None.
+		on_part(kind, result) is called as the answers come in, from the
+		reader thread. Cancelling the future cancels every request.
+		"""
+		parts = {}
+		for kind in kinds:
+			method_name, capability = PEEK_REQUESTS[kind]
+			if self.is_ready() and not self.server_capabilities.get(capability):
+				continue
+			parts[kind] = getattr(self, method_name)(doc, identifier)
+		combined = concurrent.futures.Future()
+		# see LspEndpoint.cancel_request
+		combined.parts = list(parts.values())
+		combined.lsp_endpoint = self.lsp_endpoint
+		results = dict.fromkeys(kinds)
+		remaining = set(parts)
+		lock = threading.Lock()
+		def done(kind, f):
+			if f.cancelled():
+				result = None
+			elif f.exception() is not None:
+				settings.debugprint("peek %s failed: %s", kind, f.exception())
+				result = None
+			else:
+				result = f.result()
+			if on_part is not None and not f.cancelled():
+				on_part(kind, result)
+			with lock:
+				results[kind] = result
+				remaining.discard(kind)
+				if remaining:
+					return
+			try:
+				combined.set_result(results)
+			except concurrent.futures.InvalidStateError:
+				# cancelled
+				pass
+		if not parts:
+			combined.set_result(results)
+		for kind, future in parts.items():
+			future.add_done_callback(lambda f, kind=kind: done(kind, f))
+		return combined
+
+	def cancelRequest(self, future):
+		self.lsp_endpoint.cancel_request(future)
+
+	def getDefinitions(self, doc, identifier):
+		return self.lsp_endpoint.wait_for(self.getDefinitionsAsync(doc, identifier), settings.requesttimeout)
+
+	def getReferences(self, doc, identifier):
+		return self.lsp_endpoint.wait_for(self.getReferencesAsync(doc, identifier), settings.requesttimeout)
 		
+	def getHover(self, doc, identifier):
 		try:
-			def_s=self.lsp_endpoint.call_method("textDocument/hover", textDocument={"uri":"file://"+doc_uri}, position={"line":doc_curr_line,"character":doc_curr_offset})
+			def_s=self.lsp_endpoint.wait_for(self.getHoverAsync(doc, identifier), settings.requesttimeout)
 		except Exception as e:
 			print("An error occurred:", e)
 			def_s=None
@@ -409,33 +1270,85 @@ class LspNavigator:
 		return def_s
 	
 	def getSuggestions(self, doc, identifier):
-		doctype=settings.get_document_programming_language_type(doc)
-		is_supported=settings.get_if_supported_language_type(doctype,True)
-		if is_supported:
-			doc_uri = doc.get_file().get_location().get_path()
-			
-			doc_curr_line=identifier.get_line()
-			doc_curr_offset=identifier.get_line_offset()
+		return self.lsp_endpoint.wait_for(self.getSuggestionsAsync(doc, identifier), settings.requesttimeout)
 
-			uri = "file://" + doc_uri
-			text = open(doc_uri, "r").read()
-			languageId = doctype
-			version = 1
-			
-			text_doc={"uri":uri, "languageId":languageId, "version":version, "text":text}
-			result=self.lsp_endpoint.send_notification("textDocument/didOpen", textDocument=text_doc)
-			
-			# print("line:"+str(doc_curr_line)+" character:"+str(doc_curr_offset))
-			
-			def_s=self.lsp_endpoint.call_method("textDocument/completion", textDocument={"uri":"file://"+doc_uri}, position={"line":doc_curr_line,"character":doc_curr_offset})
-			
-			return def_s
-		return None
+	@staticmethod
+	def _workspace_folder(path):
+		return {"name": os.path.basename(os.path.normpath(path)) or path, "uri": "file://"+path}
 
-	def _initialize_project_path(self, path):
-		capabilities = json.loads(settings.LSP_SETTINGS)
-		root_uri="file://"+path
+	def _initialize_project_path(self, paths):
+		capabilities = json.loads(self.profile.settings)
+		# settings files from before progress was shown do not have it
+		capabilities.setdefault("window", {}).setdefault("workDoneProgress", True)
+		# gedit counts code points, utf-16 offsets need the text of the line
+		capabilities.setdefault("general", {}).setdefault("positionEncodings", ["utf-32", "utf-16"])
+		if paths:
+			root_uri="file://"+paths[0]
+		else:
+			root_uri=None
 		# root_uri = 'file:///home/flev/dev/c++/qsound/'
-		workspace_folders = [{'name': 'python-lsp', 'uri': root_uri}]
-		self.lsp_endpoint.initialize(self.process.pid, None, root_uri, None, capabilities, "off", workspace_folders)
+		workspace_folders = [self._workspace_folder(path) for path in paths]
+		result = self.lsp_endpoint.initialize(os.getpid(), None, root_uri, None, capabilities, "off", workspace_folders)
+		if result is not None:
+			self.server_capabilities = result.get("capabilities", {})
+			self.documents.set_capabilities(self.server_capabilities)
 		self.lsp_endpoint.send_notification("initialized")
+
+	def supportsWorkspaceFolders(self):
+		workspace = self.server_capabilities.get("workspace", {})
+		folders = workspace.get("workspaceFolders", {})
+		return bool(folders.get("supported")) and bool(folders.get("changeNotifications"))
+
+	def setWorkspaceFolders(self, paths):
+		"""
+		Tells the running server about added and removed project folders.
+		Returns False if the server can not do that and has to be restarted.
+		"""
+		added = [path for path in paths if path not in self.workspace_folders]
+		removed = [path for path in self.workspace_folders if path not in paths]
+		if not added and not removed:
+			return True
+		if not self.supportsWorkspaceFolders():
+			return False
+		self.lsp_endpoint.send_notification("workspace/didChangeWorkspaceFolders", event={"added":[self._workspace_folder(path) for path in added], "removed":[self._workspace_folder(path) for path in removed]})
+		self.workspace_folders = list(paths)
+		self.result_cache.clear()
+		# symbols of the other project are of no use here
+		old_index = self.symbol_index
+		self.symbol_index = open_index(self.profile.name, self.workspace_folders)
+		INDEX_EXECUTOR.submit(old_index.close)
+		self._refresh_symbol_index()
+		return True
+
+	def _on_document_changed(self, open_doc):
+		self.hover_cache.invalidate(open_doc.uri)
+		self.result_cache.invalidate(open_doc.uri)
+		self.outline_cache.invalidate(open_doc.uri)
+
+	def closeDocument(self, doc):
+		open_doc = self.documents.get(doc)
+		if open_doc is not None:
+			self._on_document_changed(open_doc)
+		self.documents.close(doc)
+
+	def _stop_server(self):
+		with self.state_lock:
+			self.state = ServerState.Stopped
+		self.lsp_endpoint.shutdown()
+		self.lsp_endpoint.send_notification("exit")
+		# a shared server keeps running, this gedit leaves the daemon
+		self._close_socket()
+
+	def shutdown(self):
+		self.documents.detach_all()
+		# after the writes still queued
+		INDEX_EXECUTOR.submit(self.symbol_index.close)
+		INDEX_EXECUTOR.submit(self.persistent_cache.close)
+		with self.state_lock:
+			if self.state == ServerState.Starting:
+				# the starting thread stops it once it is up
+				self.state = ServerState.Stopping
+				return
+			if self.state != ServerState.Ready:
+				return
+		self._stop_server()
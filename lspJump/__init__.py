@@ -17,21 +17,94 @@
 from collections import deque
 from subprocess import CalledProcessError
 import os
+import threading
 
-from gi.repository import GObject, Gedit, Gio, Gtk, Gdk
+from gi.repository import GObject, Gedit, Gio, Gtk, Gdk, GLib
 from gi.repository import PeasGtk
 
-from lspJump import selectWindow, settings
+from lspJump import selectWindow, settings, serverManager, documentSync
+from lspJump.completion import LspCompletionProvider, add_provider, remove_provider, get_word_start, is_word_char
+from lspJump.prefetch import DefinitionPrefetcher
+from lspJump.outline import FUNCTION_KINDS
 
 def getCurrentIdentifier(doc):
 	return doc.get_iter_at_mark(doc.get_insert())
 
+def call_on_main_loop(future, callback):
+	"""
+	Calls callback(future) from the GLib main loop once the future is done,
+	the server answers are received on the reader thread.
+	"""
+	def deliver():
+		callback(future)
+		return False
+	future.add_done_callback(lambda f: GLib.idle_add(deliver))
+
+def run_on_main_loop(function):
+	"""
+	Returns function() run from the GLib main loop, for the threads of the
+	navigators that have to read the buffers.
+	"""
+	done = threading.Event()
+	lock = threading.Lock()
+	outcome = []
+	def run():
+		with lock:
+			if not done.is_set():
+				try:
+					outcome.append((True, function()))
+				except Exception as e:
+					outcome.append((False, e))
+				done.set()
+		return False
+	GLib.idle_add(run)
+	if not done.wait(settings.requesttimeout):
+		with lock:
+			if not done.is_set():
+				# it must not run any more, nobody is waiting for it
+				done.set()
+				raise RuntimeError("The main loop did not run within "+str(settings.requesttimeout)+" s")
+	ok, value = outcome[0]
+	if not ok:
+		raise value
+	return value
+
+documentSync.run_on_main_loop = run_on_main_loop
+
+def get_future_result(future, default=None):
+	if future.cancelled():
+		return default
+	error = future.exception()
+	if error is not None:
+		print("An error occurred:", error)
+		return default
+	return future.result()
+
+def hover_to_text(hover_refs):
+	additional=""
+	if hover_refs and "contents" in hover_refs:
+		contents=hover_refs["contents"]
+		if type(contents) != list:
+			contents=[contents]
+		for c_obj in contents:
+			if len(additional)>0:
+				additional=additional+"\n======\n"
+			if type(c_obj) == str:
+				additional= additional+c_obj
+			else:
+				additional= additional+c_obj["value"]
+	return additional
+
 ACTION_DEFS = [
 	("lspJumpDef", "Go to definition", settings.keyJumpDef),
 	("lspJumpRef", "Go to reference", settings.keyJumpRef),
+	("lspJumpSymbol", "Go to symbol in workspace", settings.keySymbolSearch),
+	("lspJumpEnclosing", "Go to enclosing function", settings.keyJumpEnclosing),
+	("lspJumpPeek", "Peek definition and references", settings.keyPeek),
 	("lspJumpBack", "lspJump undo", settings.keyJumpBack),
 	("lspJumpNext", "lspJump redo", settings.keyJumpNext),
-	("lspJumpProjDir", "lspJump settings", settings.keyProjDir)
+	("lspJumpProjDir", "lspJump settings", settings.keyProjDir),
+	("lspJumpMetrics", "lspJump protocol metrics", settings.keyMetrics)
 ]
 
 class lspJumpAppActivatable(GObject.Object, Gedit.AppActivatable):
@@ -61,25 +134,52 @@ class lspJumpWindowActivatable(GObject.Object, Gedit.WindowActivatable, PeasGtk.
 	nextstack = deque()
 	
 	prev_buffer_coords = [0,0]
-	hover_refs = ""
+	hover_future = None
+	hover_timeout = None
+	jump_future = None
+	# (doc, position, future, window) of the references being streamed
+	ref_search = None
+	completion_provider = None
+	outline_panel = None
+	prefetcher = None
 
 	def do_activate(self):
 		slots = {
 			"lspJumpDef": self.__jump_def,
 			"lspJumpRef": self.__jump_ref,
+			"lspJumpSymbol": self.__symbols,
+			"lspJumpEnclosing": self.__jump_enclosing,
+			"lspJumpPeek": self.__peek,
 			"lspJumpBack": self.__back,
 			"lspJumpNext": self.__next,
-			"lspJumpProjDir": self.__projdir
+			"lspJumpProjDir": self.__projdir,
+			"lspJumpMetrics": self.__metrics
 		}
 		for name, title, key in ACTION_DEFS:
 			action = Gio.SimpleAction(name=name)
 			action.connect('activate', slots[name])
 			self.window.add_action(action)
 		self.window.connect('active-tab-changed', self.on_tab_changed)
+		self.window.connect('tab-removed', self.on_tab_removed)
+		self.completion_provider = LspCompletionProvider(self)
+		serverManager.status_listeners.append(self.on_status_changed)
+		if settings.prefetch:
+			self.prefetcher = DefinitionPrefetcher(self)
+		self.outline_panel = selectWindow.OutlinePanel(self)
+		self.outline_panel.show_all()
+		self.window.get_side_panel().add_titled(self.outline_panel, "lspJumpOutline", "Outline")
 	
 	def do_deactivate(self):
 		for name, title, key in ACTION_DEFS:
 			self.window.remove_action(name)
+		self.outline_panel.set_document(None)
+		self.window.get_side_panel().remove(self.outline_panel)
+		serverManager.status_listeners.remove(self.on_status_changed)
+		if self.prefetcher is not None:
+			self.prefetcher.set_view(None)
+		for view in self.window.get_views():
+			remove_provider(view, self.completion_provider)
+		self.completion_provider.cancel()
 
 	def do_update_state(self):
 		pass
@@ -92,107 +192,54 @@ class lspJumpWindowActivatable(GObject.Object, Gedit.WindowActivatable, PeasGtk.
 			text_view.connect('query-tooltip', self.on_motion_notify_event_first)
 			text_view.connect('key-press-event', self.on_tab_added)
 			text_view.set_has_tooltip(True)
+			add_provider(text_view, self.completion_provider)
+		self.outline_panel.set_document(self.window.get_active_document())
+		if self.prefetcher is not None:
+			self.prefetcher.set_view(text_view)
 			# text_view.set_tooltip_text("Tooltip")
 
+	def on_status_changed(self, navigator):
+		GLib.idle_add(self.show_status, navigator)
+
+	def show_status(self, navigator):
+		statusbar = self.window.get_statusbar()
+		context_id = statusbar.get_context_id("lspJump "+str(navigator.profile.name))
+		statusbar.remove_all(context_id)
+		text = navigator.status.describe()
+		if text:
+			statusbar.push(context_id, str(navigator.profile.name)+": "+text)
+		return False
+
+	def get_navigator(self, doc, start=True):
+		if settings.LSP_MANAGER is None:
+			return None
+		return settings.LSP_MANAGER.navigator_for(doc, start)
+
+	def cancel_request(self, future):
+		if settings.LSP_MANAGER is not None:
+			settings.LSP_MANAGER.cancelRequest(future)
+		else:
+			future.cancel()
+
+	def on_tab_removed(self, window, tab):
+		if tab.get_document() is self.outline_panel.doc:
+			self.outline_panel.set_document(None)
+		if settings.LSP_MANAGER is not None:
+			settings.LSP_MANAGER.closeDocument(tab.get_document())
+
 	def on_tab_added(self, widget, event):
 		if event.state & Gdk.ModifierType.CONTROL_MASK and event.keyval == Gdk.KEY_e:
 			text_view = self.window.get_active_view()
-			doc = self.window.get_active_document()
-			buffer = text_view.get_buffer()
-			mark = buffer.get_insert()
-			identifier = buffer.get_iter_at_mark(mark)
-			marked_char=identifier.get_char()
-			if marked_char!=' ' and marked_char!='\t':
-				refs = settings.LSP_NAVIGATOR.getSuggestions(doc, identifier)
-				items=refs['items']
-				if len(items)>0:
-					return self.show_suggestions(items,text_view)
+			if self.get_navigator(text_view.get_buffer()) is not None:
+				# populated asynchronously by the completion provider
+				text_view.emit("show-completion")
+				return True
 		return False
 	
-	def show_suggestions(self, suggestions, text_view):
-		# Logic to display suggestions
-		dialog = Gtk.Dialog("Suggestions",self.window.get_toplevel(),0,(Gtk.STOCK_CANCEL,Gtk.ResponseType.CANCEL,Gtk.STOCK_OK,Gtk.ResponseType.OK))
-		dialog.set_default_size(600, 400)
-		# box = dialog.get_content_area()
-		
-		scrolled_window = Gtk.ScrolledWindow()
-		scrolled_window.set_border_width(10)
-		# box.add(scrolled_window)
-		dialog.vbox.pack_start(scrolled_window, True, True, 0)
-		
-		listbox = Gtk.ListBox()
-		scrolled_window.add(listbox)
-		
-		for suggestion in suggestions:
-			print(suggestion)
-			if "filterText" in suggestion:
-				suggestion_btn = Gtk.Button(label=suggestion["filterText"])
-				tooltip_text=""
-				if "label" in suggestion:
-					tooltip_text=suggestion["label"]
-				if "documentation" in suggestion:
-					if len(tooltip_text)>0:
-						tooltip_text=tooltip_text+"\n=====\n"
-					tooltip_text=tooltip_text+str(suggestion["documentation"])
-				if "textEdit" in suggestion and "newText" in suggestion["textEdit"]:
-					if len(tooltip_text)>0:
-						tooltip_text=tooltip_text+"\n=====\n"
-					tooltip_text=tooltip_text+suggestion["textEdit"]["newText"]
-				suggestion_btn.set_tooltip_text(tooltip_text)
-				suggestion_btn.suggestion=suggestion
-				suggestion_btn.text_view=text_view
-				suggestion_btn.dialog=dialog
-				suggestion_btn.connect("clicked", self.change_to_suggestion)
-				listbox.add(suggestion_btn)
-		dialog.show_all()
-		
-		# dialog.format_secondary_text("\n".join(suggestions))
-		dialog.run()
-		dialog.destroy()
-		return True
-	
-	def replace_text(self, textview, start_line, start_column, end_line, end_column, new_text):
-		#needs improvement, work like the snippet extension and jump around in the inserted text with tab?
-		if new_text.endswith("$0"):
-			new_text=new_text[:-2]
-		
-		buffer = textview.get_buffer()
-		start_iter = buffer.get_iter_at_line_index(start_line, start_column)
-		end_iter = buffer.get_iter_at_line_index(end_line, end_column)
-		text = buffer.get_text(start_iter, end_iter, False)
-		min_length = min(len(text), len(new_text))
-		
-		first_diff_char=len(text)
-		found_diff=False
-		
-		for i in range(min_length):
-			if text[i] != new_text[i]:
-				first_diff_char=i
-				found_diff=True
-		
-		if found_diff:
-			buffer.delete(start_iter, end_iter)
-			buffer.insert(start_iter, new_text)
-		else:
-			buffer.insert(end_iter, new_text[first_diff_char:])
-	
-	def change_to_suggestion(self, widget):
-		suggestion=widget.suggestion
-		text_view=widget.text_view
-		# print("SUGGESTION")
-		# print(suggestion)
-		start_line=suggestion["textEdit"]["range"]["start"]["line"]
-		start_character=suggestion["textEdit"]["range"]["start"]["character"]
-		end_line=suggestion["textEdit"]["range"]["end"]["line"]
-		#add one for the added tab
-		end_character=suggestion["textEdit"]["range"]["end"]["character"]
-		text_replacement=suggestion["textEdit"]["newText"]
-		self.replace_text(text_view,start_line, start_character, end_line, end_character, text_replacement)
-		widget.dialog.destroy()
 	def on_motion_notify_event_first(self, textview, x, y, keyboard_mode, tooltip):
 		textview.disconnect_by_func(self.on_motion_notify_event_first)
 		doctype=settings.get_window_programming_language_type(self.window)
-		is_supported=settings.get_if_supported_language_type(doctype,False)
+		is_supported=settings.get_profile_for_language(doctype) is not None
 		
 		if is_supported:
 			textview.connect('query-tooltip', self.on_motion_notify_event)
@@ -206,50 +253,233 @@ class lspJumpWindowActivatable(GObject.Object, Gedit.WindowActivatable, PeasGtk.
 	
 	def on_motion_notify_event(self, textview, x, y, keyboard_mode, tooltip):
 		additional=""
-		if settings.LSP_NAVIGATOR is not None:
-			doc = self.window.get_active_document()
+		navigator = self.get_navigator(textview.get_buffer(), False)
+		if navigator is not None:
 			buffer_coords = textview.window_to_buffer_coords(Gtk.TextWindowType.WIDGET, x, y)
 			[obj,identifier] = textview.get_iter_at_location(buffer_coords[0], buffer_coords[1])
 			marked_char=identifier.get_char()
+			moved=self.is_not_inside_prev_buff_range(self.prev_buffer_coords,buffer_coords)
+			if moved:
+				# the pointer moved on, whatever is pending is outdated
+				self.cancel_hover()
+				self.prev_buffer_coords=buffer_coords
 			if marked_char!=' ' and marked_char!='\t':
-				if self.is_not_inside_prev_buff_range(self.prev_buffer_coords,buffer_coords):
+				entry = navigator.lookupHover(textview.get_buffer(), identifier)
+				if entry is not None:
+					additional = self.get_hover_text(entry)
+				elif moved:
 					# print("GET NEW")
-					self.hover_refs = settings.LSP_NAVIGATOR.getHover(doc, identifier)
-					self.prev_buffer_coords=buffer_coords
-				if self.hover_refs is None:
-					#"query-tooltip"
-					textview.disconnect_by_func(self.on_motion_notify_event)
-				if self.hover_refs and "contents" in self.hover_refs:
-					for c_obj in self.hover_refs["contents"]:
-						if len(additional)>0:
-							additional=additional+"\n======\n"
-						if type(c_obj) == str:
-							additional= additional+c_obj
-						else:
-							additional= additional+c_obj["value"]
+					self.schedule_hover(textview, buffer_coords)
 		if len(additional)>0:
 			tooltip.set_text(additional)
 			return True
 		else:
 			return False
-		
+
+	def get_hover_text(self, entry):
+		if entry.text is None:
+			entry.text=hover_to_text(entry.result)
+		return entry.text
 	
+	def schedule_hover(self, textview, buffer_coords):
+		"""
+		Waits settings.hoverdelay milliseconds before asking the server, so
+		sweeping the pointer over the text does not send a request per word.
+		"""
+		def on_timeout():
+			self.hover_timeout = None
+			navigator = self.get_navigator(textview.get_buffer(), False)
+			if navigator is not None:
+				[obj,identifier] = textview.get_iter_at_location(buffer_coords[0], buffer_coords[1])
+				self.request_hover(navigator, textview, textview.get_buffer(), identifier)
+			return False
+		self.hover_timeout = GLib.timeout_add(settings.hoverdelay, on_timeout)
+
+	def cancel_hover(self):
+		if self.hover_timeout is not None:
+			GLib.source_remove(self.hover_timeout)
+			self.hover_timeout = None
+		if self.hover_future is not None:
+			self.cancel_request(self.hover_future)
+			self.hover_future = None
+
+	def request_hover(self, navigator, textview, doc, identifier):
+		future = navigator.getHoverAsync(doc, identifier)
+		self.hover_future = future
+		def on_hover(future):
+			if future is not self.hover_future:
+				# the pointer has moved on
+				return
+			self.hover_future = None
+			if not future.cancelled() and future.exception() is not None:
+				# timed out, failed by a restart or refused: no tooltip this time
+				settings.debugprint("hover failed: %s", future.exception())
+				return
+			if get_future_result(future):
+				# now answered from the hover cache
+				textview.trigger_tooltip_query()
+		call_on_main_loop(future, on_hover)
+
 	def do_create_configure_widget(self):
 		return selectWindow.SettingsWindow(self);
 
 	def __jump(self, navi_method):
-		if settings.LSP_NAVIGATOR is not None:
-			doc = self.window.get_active_document()
-			identifier = getCurrentIdentifier(doc)
-			refs = navi_method(settings.LSP_NAVIGATOR)(doc, identifier)
-			self.add_history(self.backstack)
-			self.jump(refs, identifier)
+		doc = self.window.get_active_document()
+		navigator = self.get_navigator(doc)
+		if navigator is not None:
+			# anywhere in a word is asked for at its start, where the prefetcher asked
+			identifier = get_word_start(getCurrentIdentifier(doc))
+			# remember where we were when the jump was requested
+			history = self.get_history_entry()
+			future = navi_method(navigator)(doc, identifier)
+			self.jump_future = future
+			def on_locations(future):
+				if future is not self.jump_future:
+					# a newer jump has been requested
+					return
+				self.jump_future = None
+				refs = get_future_result(future)
+				self.add_history(self.backstack, history)
+				self.jump(refs, None)
+			call_on_main_loop(future, on_locations)
 	
 	def __jump_def(self, action, dummy):
-		self.__jump(lambda navi: navi.getDefinitions)
+		self.__jump(lambda navi: navi.getDefinitionsAsync)
 	
 	def __jump_ref(self, action, dummy):
-		self.__jump(lambda navi: navi.getReferences)
+		doc = self.window.get_active_document()
+		navigator = self.get_navigator(doc)
+		if navigator is None:
+			return
+		# at the start of the word like F3, so they share the cached answers
+		identifier = get_word_start(getCurrentIdentifier(doc))
+		def get_position():
+			# the same place in the same text
+			open_doc = navigator.documents.get(doc)
+			return identifier.get_line(), identifier.get_line_offset(), open_doc.version if open_doc is not None else None
+		search = self.ref_search
+		if search is not None and search[0] is doc and search[1] == get_position() and search[2] is self.jump_future:
+			# still streaming, the window of the first F4 shows them
+			if search[3] is not None:
+				search[3].present()
+			return
+		history = self.get_history_entry()
+		# filled in as the batches arrive, the window opens with the first one
+		window = None
+		shown = 0
+		def on_cancel():
+			if self.jump_future is future:
+				self.jump_future = None
+				self.cancel_request(future)
+		def on_batch(batch):
+			nonlocal window, shown
+			if future is not self.jump_future or not batch:
+				return False
+			if window is None:
+				self.add_history(self.backstack, history)
+				window = selectWindow.SelectWindow(self, "Item selection", batch, self.open_jump_location, on_cancel)
+				window.show_all()
+				self.ref_search = (doc, position, future, window)
+			else:
+				window.append_records(batch)
+			shown += len(batch)
+			return False
+		def on_progress(value):
+			if window is not None and future is self.jump_future and value and value.get("message"):
+				window.set_title("Item selection: "+value["message"])
+			return False
+		future = navigator.getReferencesAsync(doc, identifier, lambda batch: GLib.idle_add(on_batch, batch), lambda value: GLib.idle_add(on_progress, value))
+		self.jump_future = future
+		position = get_position()
+		self.ref_search = (doc, position, future, None)
+		def on_locations(future):
+			if future is not self.jump_future:
+				# a newer jump has been requested or the search was stopped
+				return
+			self.jump_future = None
+			refs = get_future_result(future)
+			if window is None:
+				self.add_history(self.backstack, history)
+				self.jump(refs, None)
+			else:
+				window.append_records((refs or [])[shown:])
+				window.set_complete()
+		call_on_main_loop(future, on_locations)
+	
+	def __peek(self, action, dummy):
+		doc = self.window.get_active_document()
+		navigator = self.get_navigator(doc)
+		if navigator is None:
+			return
+		identifier = get_word_start(getCurrentIdentifier(doc))
+		word_end = identifier.copy()
+		while is_word_char(word_end.get_char()) and word_end.forward_char():
+			pass
+		history = self.get_history_entry()
+		def opener(location):
+			self.add_history(self.backstack, history)
+			self.open_jump_location(location)
+		def on_cancel():
+			if self.jump_future is future:
+				self.jump_future = None
+				self.cancel_request(future)
+		window = selectWindow.PeekWindow(self, doc.get_text(identifier, word_end, False), opener, on_cancel)
+		def show(kind, result):
+			if kind == "hover":
+				result = hover_to_text(result)
+			window.set_part(kind, result)
+			return False
+		# everything is sent at once, the answers are shown as they come
+		future = navigator.peekAsync(doc, identifier, on_part=lambda kind, result: GLib.idle_add(show, kind, result))
+		self.jump_future = future
+		def on_done(future):
+			if self.jump_future is future:
+				self.jump_future = None
+			window.set_complete()
+		call_on_main_loop(future, on_done)
+		window.show_all()
+	
+	def __jump_enclosing(self, action, dummy):
+		doc = self.window.get_active_document()
+		navigator = self.get_navigator(doc)
+		if navigator is None:
+			return
+		cursor = doc.get_iter_at_mark(doc.get_insert())
+		position = (cursor.get_line(), cursor.get_line_offset())
+		history = self.get_history_entry()
+		future = navigator.getOutlineAsync(doc)
+		self.jump_future = future
+		def on_outline(future):
+			if future is not self.jump_future:
+				return
+			self.jump_future = None
+			outline = get_future_result(future)
+			if not outline:
+				return
+			index = outline.enclosing(position[0], position[1], FUNCTION_KINDS)
+			if index >= 0 and outline.get_selection(index) == position:
+				# already on its name, go on to the function around it
+				index = outline.enclosing_from(outline.parents[index], None, FUNCTION_KINDS)
+			if index < 0:
+				return
+			line, character = outline.get_selection(index)
+			self.add_history(self.backstack, history)
+			self.open_location(doc.get_file().get_location(), line + 1, character + 1)
+		call_on_main_loop(future, on_outline)
+	
+	def __symbols(self, action, dummy):
+		navigator = None
+		doc = self.window.get_active_document()
+		if doc is not None:
+			navigator = self.get_navigator(doc)
+		if navigator is None and settings.LSP_MANAGER is not None:
+			# no document of a known language open, any running server will do
+			navigators = settings.LSP_MANAGER.get_navigators()
+			navigator = navigators[0] if navigators else None
+		if navigator is None:
+			return
+		window = selectWindow.SymbolSearchWindow(self, navigator, self.open_jump_location)
+		window.show_all()
 	
 	def __back(self, action, dummy):
 		try:
@@ -273,6 +503,10 @@ class lspJumpWindowActivatable(GObject.Object, Gedit.WindowActivatable, PeasGtk.
 		window = selectWindow.ProjectDir(self)
 		window.show_all()
 	
+	def __metrics(self, action, dummy):
+		window = selectWindow.MetricsWindow(self)
+		window.show_all()
+	
 	def jump(self, locations, identifier):
 		"""
 		locations: [(Gio.File, int)] or [(str, int), ...]
@@ -281,30 +515,35 @@ class lspJumpWindowActivatable(GObject.Object, Gedit.WindowActivatable, PeasGtk.
 		if not locations:
 			return
 	
-		def location_opener(location):
-			path, line, code, doc_path = location
-			if isinstance(path, Gio.File):
-				gio_file = path
-			else:
-				dirname = os.path.dirname(doc_path)
-				newpath = os.path.normpath(os.path.join(dirname, path))
-				gio_file = Gio.File.new_for_path(newpath)
-			self.open_location(gio_file, line, code)
-	
 		if len(locations) == 1:
-			location_opener(locations[0])
+			self.open_jump_location(locations[0])
 		else:
-			locations.sort()
-			window = selectWindow.SelectWindow(self,"Item selection",locations,location_opener)
+			# sorted by the window, per file
+			window = selectWindow.SelectWindow(self,"Item selection",locations,self.open_jump_location)
 			window.show_all()
 
-	def add_history(self, stack):
+	def open_jump_location(self, location):
+		path, line, code, doc_path = location
+		if isinstance(path, Gio.File):
+			gio_file = path
+		else:
+			dirname = os.path.dirname(doc_path)
+			newpath = os.path.normpath(os.path.join(dirname, path))
+			gio_file = Gio.File.new_for_path(newpath)
+		self.open_location(gio_file, line, code)
+
+	def get_history_entry(self):
 		doc = self.window.get_active_document()
-		stack.append((
+		return (
 			doc.get_file(),
 			doc.get_iter_at_mark(doc.get_insert()).get_line() + 1,
 			doc.get_iter_at_mark(doc.get_insert()).get_line_offset() + 1
-		))
+		)
+
+	def add_history(self, stack, entry=None):
+		if entry is None:
+			entry = self.get_history_entry()
+		stack.append(entry)
 		if len(stack) == settings.historymax:
 			stack.popleft()
 
@@ -0,0 +1,313 @@
+#	lspJump - a gedit plugin to browse code using the LSP protocol
+#	Copyright (C) 2020  Florian Evaldsson
+
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import concurrent.futures
+from collections import OrderedDict
+
+MISSING = object()
+
+def position_key(position):
+	return (position["line"], position["character"])
+
+def get_cache_dir():
+	cache_home = os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+	return os.path.join(cache_home, "lspJump")
+
+def get_cache_path(kind, profile_name, roots=None):
+	"""
+	The SQLite file for kind of the profile, in the user's cache directory.
+	With roots it is one per set of project folders as well.
+	"""
+	key = str(profile_name)
+	if roots:
+		key += "\0" + "\0".join(sorted(roots))
+	digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+	return os.path.join(get_cache_dir(), kind+"-"+digest+".sqlite")
+
+class LruCache:
+	def __init__(self, maxsize, on_evict=None):
+		self.maxsize = maxsize
+		self.on_evict = on_evict
+		self.data = OrderedDict()
+		self.lock = threading.RLock()
+
+	def get(self, key, default=None):
+		with self.lock:
+			try:
+				self.data.move_to_end(key)
+			except KeyError:
+				return default
+			return self.data[key]
+
+	def put(self, key, value):
+		with self.lock:
+			self.data[key] = value
+			self.data.move_to_end(key)
+			while len(self.data) > self.maxsize:
+				old_key, old_value = self.data.popitem(last=False)
+				if self.on_evict is not None:
+					self.on_evict(old_key, old_value)
+
+	def pop(self, key, default=None):
+		with self.lock:
+			return self.data.pop(key, default)
+
+	def clear(self):
+		with self.lock:
+			self.data.clear()
+
+	def __len__(self):
+		return len(self.data)
+
+class HoverEntry:
+	def __init__(self, start, end, result):
+		self.start = start
+		self.end = end
+		self.result = result
+		# the rendered tooltip, filled in by whoever shows it
+		self.text = None
+
+	def contains(self, position):
+		if self.start == self.end:
+			return position == self.start
+		return self.start <= position < self.end
+
+class HoverCache:
+	"""
+	Hover answers per (uri, version), any position inside the range of an
+	earlier answer is a hit. Answers without a range only cover the position
+	they were asked for.
+	"""
+	def __init__(self, maxsize=512):
+		self.entries = LruCache(maxsize, self._on_evict)
+		# (uri, version) -> [key, ...]
+		self.by_document = {}
+		self.lock = threading.RLock()
+
+	def _on_evict(self, key, entry):
+		keys = self.by_document.get(key[:2])
+		if keys is not None:
+			keys.remove(key)
+			if not keys:
+				del self.by_document[key[:2]]
+
+	def lookup(self, uri, version, position):
+		with self.lock:
+			for key in self.by_document.get((uri, version), ()):
+				entry = self.entries.data[key]
+				if entry.contains(position):
+					self.entries.get(key)
+					return entry
+		return None
+
+	def store(self, uri, version, position, result):
+		start = end = position
+		if result and "range" in result:
+			start = position_key(result["range"]["start"])
+			end = position_key(result["range"]["end"])
+			if not start <= position <= end:
+				# the server answered for some other range, only trust the position
+				start = end = position
+		key = (uri, version, start, end)
+		entry = HoverEntry(start, end, result)
+		with self.lock:
+			if key not in self.entries.data:
+				self.by_document.setdefault((uri, version), []).append(key)
+			self.entries.put(key, entry)
+		return entry
+
+	def invalidate(self, uri):
+		with self.lock:
+			for doc_key in [k for k in self.by_document if k[0] == uri]:
+				for key in self.by_document.pop(doc_key):
+					self.entries.pop(key)
+
+	def clear(self):
+		with self.lock:
+			self.by_document.clear()
+			self.entries.clear()
+
+class Flight:
+	"""
+	A request of ResultCache on its way and how many callers wait for it.
+	"""
+	def __init__(self, future):
+		self.future = future
+		self.consumers = 0
+
+class ResultCache:
+	"""
+	Converted answers of position requests keyed by
+	(method, uri, version, position). While a request is on its way, asking
+	again for the same key joins it instead of making a new request. Every
+	caller gets a future of its own, the request is only cancelled once
+	all of them are (see LspEndpoint.cancel_request).
+	"""
+	def __init__(self, maxsize=256):
+		self.results = LruCache(maxsize)
+		# key -> Flight
+		self.in_flight = {}
+		# bumped on clear and per uri on invalidation, answers of older requests are not stored
+		self.generation = 0
+		self.generations = {}
+		self.lock = threading.RLock()
+
+	def _get_generation(self, uri):
+		return self.generation, self.generations.get(uri, 0)
+
+	def request(self, key, make_request):
+		with self.lock:
+			result = self.results.get(key, MISSING)
+			if result is not MISSING:
+				future = concurrent.futures.Future()
+				future.set_result(result)
+				return future
+			flight = self.in_flight.get(key)
+			if flight is None or flight.future.cancelled():
+				flight = self.in_flight[key] = Flight(make_request())
+				self._store_when_done(key, flight)
+			flight.consumers += 1
+		return self._consume(key, flight)
+
+	def _store_when_done(self, key, flight):
+		generation = self._get_generation(key[1])
+		def done(f):
+			with self.lock:
+				if self.in_flight.get(key) is flight:
+					del self.in_flight[key]
+				if generation == self._get_generation(key[1]) and not f.cancelled() and f.exception() is None:
+					self.results.put(key, f.result())
+		flight.future.add_done_callback(done)
+
+	def _consume(self, key, flight):
+		future = concurrent.futures.Future()
+		future.source = flight.future
+		released = []
+		def release():
+			"""
+			Called when this caller gives up, returns whether it was the
+			last one waiting so that the request may be cancelled.
+			"""
+			with self.lock:
+				if released:
+					return False
+				released.append(True)
+				flight.consumers -= 1
+				if flight.consumers > 0:
+					return False
+				if self.in_flight.get(key) is flight:
+					del self.in_flight[key]
+				return True
+		future.release = release
+		def done(f):
+			try:
+				if f.cancelled():
+					future.cancel()
+				elif f.exception() is not None:
+					future.set_exception(f.exception())
+				else:
+					future.set_result(f.result())
+			except concurrent.futures.InvalidStateError:
+				# this caller cancelled
+				pass
+		flight.future.add_done_callback(done)
+		return future
+
+	def get(self, key, default=None):
+		"""
+		Returns the stored answer for key, never starts a request.
+		"""
+		return self.results.get(key, default)
+
+	def invalidate(self, uri):
+		with self.lock:
+			self.generations[uri] = self.generations.get(uri, 0) + 1
+			for key in [k for k in self.results.data if k[1] == uri]:
+				self.results.pop(key)
+			for key in [k for k in self.in_flight if k[1] == uri]:
+				del self.in_flight[key]
+
+	def clear(self):
+		with self.lock:
+			self.generation += 1
+			self.generations.clear()
+			self.results.clear()
+			self.in_flight.clear()
+
+PERSISTENT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+	method TEXT NOT NULL,
+	uri TEXT NOT NULL,
+	hash TEXT NOT NULL,
+	line INTEGER,
+	character INTEGER,
+	result TEXT,
+	stored REAL,
+	PRIMARY KEY (method, uri, hash, line, character)
+);
+CREATE INDEX IF NOT EXISTS results_uri ON results (uri);
+CREATE INDEX IF NOT EXISTS results_stored ON results (stored);
+"""
+
+class PersistentResultCache:
+	"""
+	Converted answers on disk keyed by (method, uri, content hash,
+	position), so that they can be given right away in the next session
+	while the server is still starting or indexing. Only answers for the
+	current content of a document are kept.
+	"""
+	def __init__(self, path, maxsize=20000):
+		self.path = path
+		self.maxsize = maxsize
+		if path != ":memory:":
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+		self.lock = threading.Lock()
+		self.connection = sqlite3.connect(path, check_same_thread=False)
+		self.connection.executescript(PERSISTENT_SCHEMA)
+		self.stores = 0
+
+	def get(self, method, uri, content_hash, position):
+		with self.lock:
+			row = self.connection.execute("SELECT result FROM results WHERE method = ? AND uri = ? AND hash = ? AND line = ? AND character = ?", (method, uri, content_hash) + tuple(position)).fetchone()
+		if row is None:
+			return None
+		return json.loads(row[0])
+
+	def store(self, method, uri, content_hash, position, result):
+		with self.lock, self.connection:
+			# answers for older content of uri are stale now
+			self.connection.execute("DELETE FROM results WHERE uri = ? AND hash <> ?", (uri, content_hash))
+			self.connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)", (method, uri, content_hash) + tuple(position) + (json.dumps(result), time.time()))
+			self.stores += 1
+			if self.stores % 100 == 0:
+				self.connection.execute("DELETE FROM results WHERE rowid IN (SELECT rowid FROM results ORDER BY stored DESC LIMIT -1 OFFSET ?)", (self.maxsize,))
+
+	def close(self):
+		with self.lock:
+			self.connection.close()
+
+def open_persistent_cache(profile_name):
+	try:
+		return PersistentResultCache(get_cache_path("results", profile_name))
+	except (OSError, sqlite3.Error) as e:
+		print("Could not open the result cache, keeping it in memory:", e)
+		return PersistentResultCache(":memory:")
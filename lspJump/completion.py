@@ -0,0 +1,278 @@
+#	lspJump - a gedit plugin to browse code using the LSP protocol
+#	Copyright (C) 2020  Florian Evaldsson
+
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import re
+
+from gi.repository import GObject, GLib, Gtk, GtkSource
+
+from lspJump import settings
+from lspJump.cache import LruCache
+from lspJump.fuzzy import CompletionIndex
+
+# LSP CompletionTriggerKind
+TRIGGER_INVOKED = 1
+TRIGGER_CHARACTER = 2
+TRIGGER_INCOMPLETE = 3
+
+# InsertTextFormat.Snippet
+SNIPPET_FORMAT = 2
+
+SNIPPET_FIELD = re.compile(r"\$\{\d+(?::([^}]*)|\|([^,|}]*)[^}]*)?\}|\$\d+")
+
+def snippet_to_text(snippet):
+	"""
+	Plain text of a snippet, placeholders keep their default text.
+	"""
+	return SNIPPET_FIELD.sub(lambda m: m.group(1) or m.group(2) or "", snippet).replace("\\$", "$")
+
+def is_word_char(char):
+	return char.isalnum() or char == "_"
+
+def get_word_start(text_iter):
+	start = text_iter.copy()
+	while not start.starts_line():
+		previous = start.copy()
+		previous.backward_char()
+		if not is_word_char(previous.get_char()):
+			break
+		start = previous
+	return start
+
+def get_context_iter(context):
+	# GtkSource 4 returns (valid, iter), GtkSource 3 the iter
+	result = context.get_iter()
+	if isinstance(result, tuple):
+		return result[1] if result[0] else None
+	return result
+
+def get_documentation_text(item):
+	documentation = item.get("documentation")
+	if isinstance(documentation, dict):
+		documentation = documentation.get("value")
+	parts = [part for part in (item.get("detail"), documentation) if part]
+	return "\n\n".join(parts) or None
+
+class LspProposal(GObject.Object, GtkSource.CompletionProposal):
+	"""
+	Wraps one LSP CompletionItem, nothing is computed until the row is shown.
+	"""
+	def __init__(self, item):
+		GObject.Object.__init__(self)
+		self.item = item
+
+	def do_get_label(self):
+		return self.item.get("label", "")
+
+	def do_get_text(self):
+		return self.item.get("insertText") or self.item.get("label", "")
+
+	def do_get_info(self):
+		return get_documentation_text(self.item)
+
+class LspCompletionProvider(GObject.Object, GtkSource.CompletionProvider):
+	"""
+	Completion from the language server of the document. Populated
+	asynchronously, interactive after identifier and trigger characters.
+	"""
+	def __init__(self, plugin):
+		GObject.Object.__init__(self)
+		self.plugin = plugin
+		self.future = None
+		# CompletionIndex per word, see do_populate
+		self.indexes = LruCache(16)
+		# id(item) -> (item, resolved item)
+		self.resolved = LruCache(256)
+		self.resolve_future = None
+		self.info_label = None
+
+	def do_get_name(self):
+		return "lspJump"
+
+	def do_get_priority(self):
+		return 1
+
+	def do_get_activation(self):
+		return GtkSource.CompletionActivation.INTERACTIVE | GtkSource.CompletionActivation.USER_REQUESTED
+
+	def _get_navigator(self, context):
+		text_iter = get_context_iter(context)
+		if text_iter is None:
+			return None, None, None
+		doc = text_iter.get_buffer()
+		return self.plugin.get_navigator(doc, False), doc, text_iter
+
+	def do_match(self, context):
+		navigator, doc, text_iter = self._get_navigator(context)
+		if navigator is None or not navigator.is_ready():
+			return False
+		if context.get_activation() & GtkSource.CompletionActivation.USER_REQUESTED:
+			return True
+		if text_iter.starts_line():
+			return False
+		previous = text_iter.copy()
+		previous.backward_char()
+		char = previous.get_char()
+		return is_word_char(char) or char in navigator.getCompletionTriggerCharacters()
+
+	def do_populate(self, context):
+		navigator, doc, text_iter = self._get_navigator(context)
+		if navigator is None:
+			context.add_proposals(self, [], True)
+			return
+		word_start = get_word_start(text_iter)
+		prefix = doc.get_text(word_start, text_iter, False)
+		line_start = word_start.copy()
+		line_start.set_line_offset(0)
+		# the text in front of the word tells whether it is still the same word
+		key = (doc, word_start.get_line(), word_start.get_line_offset(), doc.get_text(line_start, word_start, False))
+		self.cancel()
+
+		index = self.indexes.get(key)
+		if index is not None and index.covers(prefix):
+			# the server already sent everything this word can complete to
+			context.add_proposals(self, self._proposals(index, prefix), True)
+			return
+
+		completion_context = {"triggerKind":TRIGGER_INVOKED}
+		if index is not None and index.incomplete:
+			completion_context = {"triggerKind":TRIGGER_INCOMPLETE}
+		elif not prefix and not word_start.starts_line():
+			previous = word_start.copy()
+			previous.backward_char()
+			if previous.get_char() in navigator.getCompletionTriggerCharacters():
+				completion_context = {"triggerKind":TRIGGER_CHARACTER, "triggerCharacter":previous.get_char()}
+
+		future = navigator.getSuggestionsAsync(doc, text_iter, completion_context)
+		self.future = future
+		cancelled_id = context.connect("cancelled", lambda c: self.cancel(future))
+		def deliver():
+			context.disconnect(cancelled_id)
+			if future is not self.future:
+				return False
+			self.future = None
+			result = None
+			if not future.cancelled() and future.exception() is None:
+				result = future.result()
+			elif not future.cancelled():
+				settings.debugprint("completion failed: %s", future.exception())
+			if result is None:
+				context.add_proposals(self, [], True)
+				return False
+			index = CompletionIndex(result["items"], result["isIncomplete"], prefix)
+			self.indexes.put(key, index)
+			context.add_proposals(self, self._proposals(index, prefix), True)
+			return False
+		future.add_done_callback(lambda f: GLib.idle_add(deliver))
+
+	def _proposals(self, index, prefix):
+		return [LspProposal(item) for item in index.filter(prefix, settings.completionmax)]
+
+	def cancel(self, future=None):
+		if future is None:
+			future = self.future
+		if future is None or future is not self.future:
+			return
+		self.future = None
+		self.plugin.cancel_request(future)
+
+	def get_resolved(self, item):
+		entry = self.resolved.get(id(item))
+		if entry is not None and entry[0] is item:
+			return entry[1]
+		return None
+
+	def do_get_info_widget(self, proposal):
+		if self.info_label is None:
+			self.info_label = Gtk.Label()
+			self.info_label.set_line_wrap(True)
+			self.info_label.set_max_width_chars(80)
+			self.info_label.set_xalign(0)
+			self.info_label.show()
+		return self.info_label
+
+	def do_update_info(self, proposal, info):
+		"""
+		Shows the details of the selected proposal, asking the server for
+		them the first time.
+		"""
+		if self.resolve_future is not None:
+			# the selection moved on
+			self.plugin.cancel_request(self.resolve_future)
+			self.resolve_future = None
+		item = proposal.item
+		resolved = self.get_resolved(item)
+		self.info_label.set_text(get_documentation_text(resolved or item) or "")
+		if resolved is not None:
+			return
+		navigator = self.plugin.get_navigator(self.plugin.window.get_active_document(), False)
+		if navigator is None or not navigator.supportsCompletionResolve():
+			return
+		future = navigator.resolveCompletionItemAsync(item)
+		self.resolve_future = future
+		def deliver():
+			if future is not self.resolve_future:
+				return False
+			self.resolve_future = None
+			if future.cancelled() or future.exception() is not None:
+				return False
+			self.resolved.put(id(item), (item, future.result()))
+			if info.get_visible():
+				self.info_label.set_text(get_documentation_text(future.result()) or "")
+			return False
+		future.add_done_callback(lambda f: GLib.idle_add(deliver))
+
+	def do_activate_proposal(self, proposal, text_iter):
+		# resolving may have added edits
+		item = self.get_resolved(proposal.item) or proposal.item
+		buffer = text_iter.get_buffer()
+		edit = item.get("textEdit")
+		text = item.get("insertText") or item.get("label", "")
+		if edit is not None:
+			text = edit["newText"]
+			# InsertReplaceEdit has insert and replace instead of range
+			edit_range = edit.get("range") or edit.get("replace")
+			start = (edit_range["start"]["line"], edit_range["start"]["character"])
+			end = (edit_range["end"]["line"], edit_range["end"]["character"])
+		else:
+			word_start = get_word_start(text_iter)
+			start = end = (word_start.get_line(), word_start.get_line_offset())
+		if item.get("insertTextFormat") == SNIPPET_FORMAT:
+			text = snippet_to_text(text)
+		# the range was computed when the request was sent, the user may have typed on since
+		end = max(end, (text_iter.get_line(), text_iter.get_line_offset()))
+		edits = [(start, end, text)]
+		for extra in item.get("additionalTextEdits") or []:
+			edits.append(((extra["range"]["start"]["line"], extra["range"]["start"]["character"]), (extra["range"]["end"]["line"], extra["range"]["end"]["character"]), extra["newText"]))
+		# from the end of the document, earlier positions stay valid
+		edits.sort(reverse=True)
+		buffer.begin_user_action()
+		for (start_line, start_char), (end_line, end_char), new_text in edits:
+			start_iter = buffer.get_iter_at_line_offset(start_line, start_char)
+			end_iter = buffer.get_iter_at_line_offset(end_line, end_char)
+			buffer.delete(start_iter, end_iter)
+			buffer.insert(start_iter, new_text)
+		buffer.end_user_action()
+		return True
+
+def add_provider(view, provider):
+	completion = view.get_completion()
+	if provider not in completion.get_providers():
+		completion.add_provider(provider)
+
+def remove_provider(view, provider):
+	completion = view.get_completion()
+	if provider in completion.get_providers():
+		completion.remove_provider(provider)
@@ -0,0 +1,572 @@
+#	lspJump - a gedit plugin to browse code using the LSP protocol
+#	Copyright (C) 2020  Florian Evaldsson
+
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+One language server shared by every gedit on the machine. The daemon
+owns the server process and listens on a Unix socket, each editor is a
+client speaking plain LSP over it. The server is initialized once, the
+index is built once.
+
+	python3 daemon.py --socket PATH [--idle-timeout SECONDS] -- COMMAND...
+
+Started by connect() when no daemon is listening yet, it quits once no
+client has been connected for --idle-timeout seconds or when the server
+quits. Only the standard library is used, it runs outside of gedit.
+"""
+
+import os
+import sys
+import stat
+import json
+import time
+import fcntl
+import queue
+import socket
+import hashlib
+import argparse
+import threading
+import subprocess
+
+LEN_HEADER = b"Content-Length: "
+METHOD_NOT_FOUND = -32601
+
+def read_message(stream):
+	"""
+	Returns the next message from stream or None at the end.
+	"""
+	size = None
+	while True:
+		line = stream.readline()
+		if not line:
+			return None
+		if line == b"\r\n":
+			break
+		if line.startswith(LEN_HEADER):
+			size = int(line[len(LEN_HEADER):])
+	if size is None:
+		return None
+	body = stream.read(size)
+	if len(body) < size:
+		return None
+	return json.loads(body)
+
+def write_message(stream, message):
+	body = json.dumps(message).encode("utf-8")
+	stream.write(LEN_HEADER + str(len(body)).encode("ascii") + b"\r\n\r\n" + body)
+	stream.flush()
+
+def get_runtime_dir():
+	runtime_dir = os.getenv("XDG_RUNTIME_DIR") or "/tmp"
+	return os.path.join(runtime_dir, "lspJump-"+str(os.getuid()))
+
+def make_runtime_dir(path):
+	"""
+	Creates the directory of the sockets, refusing one somebody else could
+	have put there (/tmp is shared).
+	"""
+	os.makedirs(path, mode=0o700, exist_ok=True)
+	info = os.lstat(path)
+	if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or stat.S_IMODE(info.st_mode) != 0o700:
+		raise PermissionError(path+" must be a directory of this user with mode 0700")
+
+def get_socket_path(command, root):
+	"""
+	One daemon per server command and project root.
+	"""
+	key = json.dumps([command, root]).encode("utf-8")
+	return os.path.join(get_runtime_dir(), hashlib.sha1(key).hexdigest()[:16]+".sock")
+
+def connect(command, root, timeout=10, idle_timeout=600):
+	"""
+	Returns a socket connected to the daemon running command for root,
+	starting the daemon if none is listening.
+	"""
+	path = get_socket_path(command, root)
+	make_runtime_dir(os.path.dirname(path))
+	started = None
+	deadline = time.monotonic() + timeout
+	while True:
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			sock.connect(path)
+			return sock
+		except OSError:
+			sock.close()
+			if time.monotonic() > deadline:
+				raise
+		# again if it did not come up, a quitting daemon may still have held the lock
+		if started is None or time.monotonic() - started > 1:
+			with open(path+".log", "ab") as log:
+				# a session of its own, it outlives this gedit
+				subprocess.Popen([sys.executable, os.path.abspath(__file__), "--socket", path, "--idle-timeout", str(idle_timeout), "--"] + list(command), stdin=subprocess.DEVNULL, stdout=log, stderr=log, start_new_session=True)
+			started = time.monotonic()
+		time.sleep(0.05)
+
+def get_index(line, character, encoding):
+	"""
+	Returns the index in the str line of an LSP character offset counted in
+	the units of encoding.
+	"""
+	if encoding == "utf-32" or line.isascii():
+		return min(character, len(line))
+	units = 0
+	for index, char in enumerate(line):
+		if units >= character:
+			return index
+		if encoding == "utf-8":
+			units += len(char.encode("utf-8"))
+		else:
+			units += 2 if ord(char) > 0xFFFF else 1
+	return len(line)
+
+def apply_change(text, change, encoding="utf-16"):
+	"""
+	Applies one TextDocumentContentChangeEvent to text, positions count in
+	the positionEncoding the server agreed to.
+	"""
+	if "range" not in change:
+		return change["text"]
+	def offset(position):
+		index = 0
+		for i in range(position["line"]):
+			index = text.find("\n", index) + 1
+			if index == 0:
+				return len(text)
+		end = text.find("\n", index)
+		if end == -1:
+			end = len(text)
+		return index + get_index(text[index:end], position["character"], encoding)
+	start = offset(change["range"]["start"])
+	end = offset(change["range"]["end"])
+	return text[:start] + change["text"] + text[end:]
+
+class Outbox(threading.Thread):
+	"""
+	Writes the queued messages to stream in a thread of its own. Routing
+	only queues, a full pipe or a stopped editor never blocks the others.
+	"""
+	def __init__(self, stream, on_error=None):
+		super().__init__(daemon=True)
+		self.stream = stream
+		self.on_error = on_error
+		self.queue = queue.SimpleQueue()
+		self.closed = False
+
+	def put(self, message):
+		if not self.closed:
+			self.queue.put(message)
+
+	def close(self):
+		self.closed = True
+		self.queue.put(None)
+
+	def run(self):
+		while True:
+			message = self.queue.get()
+			if message is None:
+				return
+			try:
+				write_message(self.stream, message)
+			except (OSError, ValueError):
+				self.closed = True
+				if self.on_error is not None:
+					self.on_error()
+				return
+
+class Client:
+	def __init__(self, daemon, sock, number):
+		self.daemon = daemon
+		self.sock = sock
+		self.reader = sock.makefile("rb")
+		# a failed write ends the reader too, which removes the client
+		self.outbox = Outbox(sock.makefile("wb"), self.shutdown)
+		self.outbox.start()
+		# put in front of the progress tokens of this client
+		self.prefix = "c"+str(number)+":"
+		# request id of this client -> id sent to the server
+		self.ids = {}
+		# uri -> WorkspaceFolder this client works on
+		self.folders = {}
+
+	def send(self, message):
+		self.outbox.put(message)
+
+	def shutdown(self):
+		try:
+			self.sock.shutdown(socket.SHUT_RDWR)
+		except OSError:
+			pass
+
+	def close(self):
+		self.outbox.close()
+		self.shutdown()
+		self.sock.close()
+
+class SharedDocument:
+	"""
+	A document opened by one or more clients. The server has the text of
+	owner, the incremental changes of owner are passed on as they are, a
+	change by another client sends its whole text.
+	"""
+	def __init__(self, uri, language_id):
+		self.uri = uri
+		self.language_id = language_id
+		# Client -> text
+		self.texts = {}
+		self.owner = None
+		self.version = 0
+
+class Daemon:
+	def __init__(self, command, idle_timeout):
+		self.command = command
+		self.idle_timeout = idle_timeout
+		# guards the routing below, held while queueing but never while writing
+		self.lock = threading.RLock()
+		self.clients = []
+		self.client_count = 0
+		self.process = None
+		self.server_outbox = None
+		self.next_id = 0
+		# id sent to the server -> (Client, id of the client)
+		self.pending = {}
+		self.initialize_result = None
+		# of the positions in the changes of the clients
+		self.position_encoding = "utf-16"
+		self.initialize_error = None
+		# clients waiting for the first initialize, [(Client, id)]
+		self.initialize_waiters = []
+		self.initialize_id = None
+		self.initialized_sent = False
+		# uri -> WorkspaceFolder the server knows, the folders of all clients
+		self.folders = {}
+		self.documents = {}
+		self.idle_since = time.monotonic()
+
+	def start_server(self):
+		self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+		self.server_outbox = Outbox(self.process.stdin)
+		self.server_outbox.start()
+		threading.Thread(target=self.read_server, daemon=True).start()
+
+	def send_server(self, message):
+		self.server_outbox.put(message)
+
+	def new_id(self):
+		self.next_id += 1
+		return self.next_id
+
+	def serve(self, path):
+		listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		if os.path.exists(path):
+			# left behind by a daemon that did not clean up, the lock is ours
+			os.unlink(path)
+		listener.bind(path)
+		os.chmod(path, 0o600)
+		listener.listen(16)
+		listener.settimeout(1)
+		try:
+			while self.process.poll() is None:
+				try:
+					sock, address = listener.accept()
+				except socket.timeout:
+					with self.lock:
+						idle = not self.clients and time.monotonic() - self.idle_since > self.idle_timeout
+					if idle:
+						print("No clients for", self.idle_timeout, "s, stopping")
+						break
+					continue
+				with self.lock:
+					self.client_count += 1
+					client = Client(self, sock, self.client_count)
+					self.clients.append(client)
+				threading.Thread(target=self.read_client, args=(client,), daemon=True).start()
+		finally:
+			listener.close()
+			os.unlink(path)
+			self.stop_server()
+
+	def stop_server(self):
+		if self.process.poll() is not None:
+			return
+		try:
+			with self.lock:
+				self.send_server({"jsonrpc":"2.0", "id":self.new_id(), "method":"shutdown"})
+				self.send_server({"jsonrpc":"2.0", "method":"exit"})
+			self.process.wait(5)
+		except (OSError, subprocess.TimeoutExpired):
+			self.process.kill()
+
+	def read_client(self, client):
+		try:
+			while True:
+				message = read_message(client.reader)
+				if message is None:
+					break
+				if message.get("method") == "exit":
+					break
+				with self.lock:
+					self.from_client(client, message)
+		except (OSError, ValueError) as e:
+			print("Client", client.prefix, "failed:", e)
+		with self.lock:
+			self.remove_client(client)
+		client.close()
+
+	def from_client(self, client, message):
+		method = message.get("method")
+		params = message.get("params")
+		if "id" in message and method is None:
+			# the answer to a request of the server, they are all answered by the daemon
+			return
+		if "id" not in message:
+			self.client_notification(client, method, params)
+			return
+		if method == "initialize":
+			self.initialize(client, message)
+		elif method == "shutdown":
+			# the server keeps running for the others
+			client.send({"jsonrpc":"2.0", "id":message["id"], "result":None})
+		else:
+			if isinstance(params, dict):
+				for key in ("workDoneToken", "partialResultToken"):
+					if key in params:
+						params[key] = client.prefix + str(params[key])
+			server_id = self.new_id()
+			self.pending[server_id] = (client, message["id"])
+			client.ids[message["id"]] = server_id
+			self.send_server(dict(message, id=server_id))
+
+	def initialize(self, client, message):
+		params = dict(message.get("params") or {})
+		client.folders = dict((folder["uri"], folder) for folder in params.get("workspaceFolders") or [])
+		if self.initialize_result is not None:
+			client.send({"jsonrpc":"2.0", "id":message["id"], "result":self.initialize_result})
+			self.update_folders()
+			return
+		self.initialize_waiters.append((client, message["id"]))
+		if self.initialize_id is not None:
+			# the first client is initializing it
+			return
+		# the server watches this process, not the editor
+		params["processId"] = os.getpid()
+		self.folders = dict(client.folders)
+		self.initialize_id = self.new_id()
+		self.send_server({"jsonrpc":"2.0", "id":self.initialize_id, "method":"initialize", "params":params})
+
+	def client_notification(self, client, method, params):
+		if method == "initialized":
+			if not self.initialized_sent:
+				self.initialized_sent = True
+				self.send_server({"jsonrpc":"2.0", "method":"initialized", "params":params or {}})
+				# of the clients that came while it was initializing
+				self.update_folders()
+		elif method == "$/cancelRequest":
+			server_id = client.ids.pop(params.get("id"), None)
+			if server_id is not None:
+				self.send_server({"jsonrpc":"2.0", "method":"$/cancelRequest", "params":{"id":server_id}})
+		elif method == "textDocument/didOpen":
+			self.did_open(client, params["textDocument"])
+		elif method == "textDocument/didChange":
+			self.did_change(client, params["textDocument"]["uri"], params["contentChanges"])
+		elif method == "textDocument/didClose":
+			self.did_close(client, params["textDocument"]["uri"])
+		elif method == "workspace/didChangeWorkspaceFolders":
+			# the others keep theirs
+			event = params["event"]
+			for folder in event.get("removed") or []:
+				client.folders.pop(folder["uri"], None)
+			for folder in event.get("added") or []:
+				client.folders[folder["uri"]] = folder
+			self.update_folders()
+		else:
+			self.send_server({"jsonrpc":"2.0", "method":method, "params":params})
+
+	def update_folders(self):
+		"""
+		Tells the server about the folders that the clients added or all of
+		them removed since, if it takes changes.
+		"""
+		if not self.initialized_sent:
+			return
+		capabilities = (self.initialize_result or {}).get("capabilities") or {}
+		if not ((capabilities.get("workspace") or {}).get("workspaceFolders") or {}).get("changeNotifications"):
+			return
+		folders = {}
+		for client in self.clients:
+			folders.update(client.folders)
+		added = [folder for uri, folder in folders.items() if uri not in self.folders]
+		removed = [folder for uri, folder in self.folders.items() if uri not in folders]
+		if not added and not removed:
+			return
+		self.folders = folders
+		self.send_server({"jsonrpc":"2.0", "method":"workspace/didChangeWorkspaceFolders", "params":{"event":{"added":added, "removed":removed}}})
+
+	def send_text(self, document, client):
+		# the server gets the whole text of client
+		document.owner = client
+		document.version += 1
+		self.send_server({"jsonrpc":"2.0", "method":"textDocument/didChange", "params":{"textDocument":{"uri":document.uri, "version":document.version}, "contentChanges":[{"text":document.texts[client]}]}})
+
+	def did_open(self, client, text_document):
+		uri = text_document["uri"]
+		document = self.documents.get(uri)
+		if document is None:
+			document = self.documents[uri] = SharedDocument(uri, text_document.get("languageId"))
+			document.texts[client] = text_document["text"]
+			document.owner = client
+			document.version = 1
+			self.send_server({"jsonrpc":"2.0", "method":"textDocument/didOpen", "params":{"textDocument":dict(text_document, version=document.version)}})
+			return
+		document.texts[client] = text_document["text"]
+		if document.owner is None or document.texts[document.owner] != text_document["text"]:
+			self.send_text(document, client)
+
+	def did_change(self, client, uri, changes):
+		document = self.documents.get(uri)
+		if document is None or client not in document.texts:
+			return
+		text = document.texts[client]
+		for change in changes:
+			text = apply_change(text, change, self.position_encoding)
+		document.texts[client] = text
+		if document.owner is not client:
+			self.send_text(document, client)
+			return
+		document.version += 1
+		self.send_server({"jsonrpc":"2.0", "method":"textDocument/didChange", "params":{"textDocument":{"uri":uri, "version":document.version}, "contentChanges":changes}})
+
+	def did_close(self, client, uri):
+		document = self.documents.get(uri)
+		if document is None or document.texts.pop(client, None) is None:
+			return
+		if not document.texts:
+			del self.documents[uri]
+			self.send_server({"jsonrpc":"2.0", "method":"textDocument/didClose", "params":{"textDocument":{"uri":uri}}})
+		elif document.owner is client:
+			self.send_text(document, next(iter(document.texts)))
+
+	def remove_client(self, client):
+		if client not in self.clients:
+			return
+		self.clients.remove(client)
+		for server_id, (owner, client_id) in list(self.pending.items()):
+			if owner is client:
+				del self.pending[server_id]
+				self.send_server({"jsonrpc":"2.0", "method":"$/cancelRequest", "params":{"id":server_id}})
+		for uri in [uri for uri, document in self.documents.items() if client in document.texts]:
+			self.did_close(client, uri)
+		self.initialize_waiters = [waiter for waiter in self.initialize_waiters if waiter[0] is not client]
+		if self.clients:
+			self.update_folders()
+		else:
+			self.idle_since = time.monotonic()
+
+	def read_server(self):
+		reader = self.process.stdout
+		while True:
+			message = read_message(reader)
+			if message is None:
+				break
+			with self.lock:
+				self.from_server(message)
+		print("The language server quit")
+		with self.lock:
+			clients = list(self.clients)
+		# they reconnect and start a new daemon
+		for client in clients:
+			client.close()
+
+	def from_server(self, message):
+		method = message.get("method")
+		if method is not None and "id" in message:
+			self.server_request(message)
+			return
+		if method is not None:
+			self.server_notification(message)
+			return
+		server_id = message.get("id")
+		if server_id == self.initialize_id:
+			self.initialized(message)
+			return
+		pending = self.pending.pop(server_id, None)
+		if pending is None:
+			return
+		client, client_id = pending
+		client.ids.pop(client_id, None)
+		client.send(dict(message, id=client_id))
+
+	def server_request(self, message):
+		"""
+		Answers a request of the server, the clients do not share one
+		answer so the daemon gives the default ones.
+		"""
+		method = message["method"]
+		if method == "workspace/configuration":
+			# no settings for any of the items
+			items = (message.get("params") or {}).get("items") or []
+			self.send_server({"jsonrpc":"2.0", "id":message["id"], "result":[None] * len(items)})
+		elif method == "workspace/workspaceFolders":
+			self.send_server({"jsonrpc":"2.0", "id":message["id"], "result":list(self.folders.values()) or None})
+		elif method in ("window/workDoneProgress/create", "client/registerCapability", "client/unregisterCapability"):
+			self.send_server({"jsonrpc":"2.0", "id":message["id"], "result":None})
+		else:
+			self.send_server({"jsonrpc":"2.0", "id":message["id"], "error":{"code":METHOD_NOT_FOUND, "message":"Method not found: "+method}})
+
+	def initialized(self, message):
+		waiters = self.initialize_waiters
+		self.initialize_waiters = []
+		if "error" in message:
+			# the next client tries again
+			self.initialize_id = None
+		else:
+			self.initialize_result = message.get("result")
+			capabilities = (self.initialize_result or {}).get("capabilities") or {}
+			self.position_encoding = capabilities.get("positionEncoding", "utf-16")
+		for client, client_id in waiters:
+			client.send(dict(message, id=client_id))
+
+	def server_notification(self, message):
+		params = message.get("params") or {}
+		token = params.get("token") if message["method"] == "$/progress" else None
+		if isinstance(token, str):
+			for client in self.clients:
+				if token.startswith(client.prefix):
+					# asked for by this client
+					client.send(dict(message, params=dict(params, token=token[len(client.prefix):])))
+					return
+		for client in list(self.clients):
+			client.send(message)
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Language server shared by several editors over a Unix socket")
+	parser.add_argument("--socket", required=True)
+	parser.add_argument("--idle-timeout", type=float, default=600, help="seconds without clients before stopping")
+	parser.add_argument("command", nargs="+")
+	args = parser.parse_args(argv)
+
+	make_runtime_dir(os.path.dirname(args.socket))
+	lock = open(args.socket+".lock", "w")
+	try:
+		fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+	except OSError:
+		# another daemon serves this socket
+		return
+	daemon = Daemon(args.command, args.idle_timeout)
+	daemon.start_server()
+	daemon.serve(args.socket)
+
+if __name__ == "__main__":
+	main()
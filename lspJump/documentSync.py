@@ -0,0 +1,284 @@
+#	lspJump - a gedit plugin to browse code using the LSP protocol
+#	Copyright (C) 2020  Florian Evaldsson
+
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import enum
+import hashlib
+import threading
+import urllib.parse
+
+from lspJump import settings
+
+class TextDocumentSyncKind(enum.Enum):
+	NoSync = 0
+	Full = 1
+	Incremental = 2
+
+def uri_to_path(uri):
+	urlp = urllib.parse.urlparse(uri)
+	return urllib.parse.unquote(os.path.abspath(os.path.join(urlp.netloc, urlp.path)))
+
+def run_on_main_loop(function):
+	"""
+	Returns function(), run on the GTK thread. Replaced by the plugin, without
+	gedit there is no main loop and it is called right away.
+	"""
+	return function()
+
+def get_document_path(doc):
+	gfile = doc.get_file()
+	if gfile is None:
+		return None
+	location = gfile.get_location()
+	if location is None:
+		return None
+	return location.get_path()
+
+def get_document_text(doc):
+	return doc.get_text(doc.get_start_iter(), doc.get_end_iter(), True)
+
+def get_character(text_iter, encoding):
+	"""
+	Returns the offset of text_iter in its line in the units of the
+	positionEncoding of the server, gedit counts code points.
+	"""
+	if encoding == "utf-8":
+		return text_iter.get_line_index()
+	offset = text_iter.get_line_offset()
+	if encoding == "utf-32" or text_iter.get_line_index() == offset:
+		# or ASCII up to text_iter, counted the same by all
+		return offset
+	line_start = text_iter.copy()
+	line_start.set_line_offset(0)
+	return len(line_start.get_slice(text_iter).encode("utf-16-le")) // 2
+
+def iter_to_position(text_iter, encoding="utf-16"):
+	return {"line":text_iter.get_line(), "character":get_character(text_iter, encoding)}
+
+class OpenDocument:
+	def __init__(self, doc, path, language_id):
+		self.doc = doc
+		self.path = path
+		self.uri = "file://" + path
+		self.language_id = language_id
+		self.version = 1
+		# changes made since the last didChange, applied in order by the server
+		self.pending_changes = []
+		self.handler_ids = []
+		# (version, hash) of the content, see DocumentSync.get_content_hash
+		self.content_hash = None
+
+class DocumentSync:
+	"""
+	Keeps track of the documents the server knows about.
+
+	Each document is opened once with textDocument/didOpen, buffer edits are
+	collected as incremental content changes and sent as one
+	textDocument/didChange right before the next request (flush).
+	"""
+	def __init__(self, lsp_endpoint):
+		self.lsp_endpoint = lsp_endpoint
+		self.sync_kind = TextDocumentSyncKind.Incremental
+		self.position_encoding = "utf-16"
+		self.send_open_close = True
+		self.send_save = False
+		self.save_include_text = False
+		self.documents = {}
+		self.lock = threading.RLock()
+		# called as listener(open_document) whenever the version of a document changes
+		self.change_listeners = []
+		# called as listener(open_document) whenever a document is saved
+		self.save_listeners = []
+		# called as listener(open_document) after a document has been opened
+		self.open_listeners = []
+
+	def set_capabilities(self, capabilities):
+		if capabilities:
+			self.position_encoding = capabilities.get("positionEncoding", "utf-16")
+		sync = capabilities.get("textDocumentSync") if capabilities else None
+		if sync is None:
+			return
+		if isinstance(sync, int):
+			self.sync_kind = TextDocumentSyncKind(sync)
+			return
+		self.send_open_close = bool(sync.get("openClose", False))
+		self.sync_kind = TextDocumentSyncKind(sync.get("change", 0))
+		save = sync.get("save")
+		if save:
+			self.send_save = True
+			if isinstance(save, dict):
+				self.save_include_text = bool(save.get("includeText", False))
+
+	def get_position(self, text_iter):
+		"""
+		Returns (line, character) of text_iter as the server counts them.
+		"""
+		return text_iter.get_line(), get_character(text_iter, self.position_encoding)
+
+	def get(self, doc):
+		with self.lock:
+			return self.documents.get(doc)
+
+	def open(self, doc, language_id):
+		"""
+		Makes sure that the server has the current content of doc, returns
+		the OpenDocument or None if the document has no file.
+		"""
+		with self.lock:
+			open_doc = self.documents.get(doc)
+			if open_doc is not None:
+				if open_doc.path != get_document_path(doc):
+					# saved under a new name
+					self.close(doc)
+				else:
+					self.flush(open_doc)
+					return open_doc
+			path = get_document_path(doc)
+			if path is None:
+				return None
+			open_doc = OpenDocument(doc, path, language_id)
+			open_doc.handler_ids = [
+				doc.connect("insert-text", self.on_insert_text),
+				doc.connect("delete-range", self.on_delete_range),
+				doc.connect("saved", self.on_saved)
+			]
+			self.documents[doc] = open_doc
+			self._send_did_open(open_doc)
+			listeners = list(self.open_listeners)
+		for listener in listeners:
+			listener(open_doc)
+		return open_doc
+
+	@staticmethod
+	def _did_open_params(open_doc):
+		return {"textDocument":{"uri":open_doc.uri, "languageId":open_doc.language_id, "version":open_doc.version, "text":get_document_text(open_doc.doc)}}
+
+	def _send_did_open(self, open_doc):
+		if self.send_open_close:
+			self.lsp_endpoint.send_notification("textDocument/didOpen", **self._did_open_params(open_doc))
+
+	def get_replay_messages(self):
+		"""
+		Returns the didOpen notifications giving a restarted server the
+		current content of every open document. Call on the GTK thread with
+		self.lock held.
+		"""
+		messages = []
+		for open_doc in self.documents.values():
+			# the current text includes them
+			open_doc.pending_changes = []
+			if self.send_open_close:
+				messages.append(("textDocument/didOpen", self._did_open_params(open_doc)))
+		return messages
+
+	def get_text_to_hash(self, open_doc):
+		"""
+		Returns (version, text) for get_content_hash, text is None if the
+		hash of that version is known already. Call on the GTK thread.
+		"""
+		with self.lock:
+			if open_doc.content_hash is not None and open_doc.content_hash[0] == open_doc.version:
+				return open_doc.version, None
+			return open_doc.version, get_document_text(open_doc.doc)
+
+	def get_content_hash(self, open_doc, version, text):
+		"""
+		Returns a hash of the content of open_doc at version, computed once
+		per version. Any thread, text is from get_text_to_hash.
+		"""
+		with self.lock:
+			content_hash = open_doc.content_hash
+		if content_hash is not None and content_hash[0] == version:
+			return content_hash[1]
+		digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+		with self.lock:
+			if open_doc.version == version:
+				open_doc.content_hash = (version, digest)
+		return digest
+
+	def flush(self, open_doc):
+		with self.lock:
+			if not open_doc.pending_changes:
+				return
+			changes = open_doc.pending_changes
+			open_doc.pending_changes = []
+			if self.sync_kind == TextDocumentSyncKind.NoSync:
+				return
+			if self.sync_kind == TextDocumentSyncKind.Full:
+				changes = [{"text":get_document_text(open_doc.doc)}]
+			settings.debugprint("didChange::%s version:%d changes:%d", open_doc.uri, open_doc.version, len(changes))
+			self.lsp_endpoint.send_notification("textDocument/didChange", textDocument={"uri":open_doc.uri, "version":open_doc.version}, contentChanges=changes)
+
+	def _add_change(self, doc, change):
+		with self.lock:
+			open_doc = self.documents.get(doc)
+			if open_doc is None:
+				return
+			open_doc.pending_changes.append(change)
+			open_doc.version += 1
+			listeners = list(self.change_listeners)
+		for listener in listeners:
+			listener(open_doc)
+
+	def on_insert_text(self, doc, location, text, length):
+		position = iter_to_position(location, self.position_encoding)
+		self._add_change(doc, {"range":{"start":position, "end":position}, "text":text})
+
+	def on_delete_range(self, doc, start, end):
+		self._add_change(doc, {"range":{"start":iter_to_position(start, self.position_encoding), "end":iter_to_position(end, self.position_encoding)}, "text":""})
+
+	def on_saved(self, doc, *args):
+		with self.lock:
+			open_doc = self.documents.get(doc)
+			if open_doc is None:
+				return
+			if open_doc.path != get_document_path(doc):
+				# "save as", the server has to know the document under its new uri
+				self.close(doc)
+				open_doc = self.open(doc, open_doc.language_id)
+				if open_doc is None:
+					return
+			self.flush(open_doc)
+			if self.send_save:
+				if self.save_include_text:
+					self.lsp_endpoint.send_notification("textDocument/didSave", textDocument={"uri":open_doc.uri}, text=get_document_text(doc))
+				else:
+					self.lsp_endpoint.send_notification("textDocument/didSave", textDocument={"uri":open_doc.uri})
+			listeners = list(self.save_listeners)
+		for listener in listeners:
+			listener(open_doc)
+
+	def close(self, doc):
+		with self.lock:
+			open_doc = self.documents.pop(doc, None)
+			if open_doc is None:
+				return
+			for handler_id in open_doc.handler_ids:
+				doc.disconnect(handler_id)
+			open_doc.handler_ids = []
+			if self.send_open_close:
+				self.lsp_endpoint.send_notification("textDocument/didClose", textDocument={"uri":open_doc.uri})
+
+	def detach_all(self):
+		"""
+		Disconnects from all buffers without telling the server, used when
+		the server is going away.
+		"""
+		with self.lock:
+			for doc, open_doc in self.documents.items():
+				for handler_id in open_doc.handler_ids:
+					doc.disconnect(handler_id)
+			self.documents = {}
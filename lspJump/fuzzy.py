@@ -0,0 +1,126 @@
+#	lspJump - a gedit plugin to browse code using the LSP protocol
+#	Copyright (C) 2020  Florian Evaldsson
+
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+PREFIX_BONUS = 1000
+SUBSTRING_BONUS = 200
+BOUNDARY_BONUS = 30
+CONSECUTIVE_BONUS = 15
+CASE_BONUS = 1
+GAP_PENALTY = 1
+
+def is_boundary(text, index):
+	if index == 0:
+		return True
+	previous = text[index - 1]
+	if previous == "_" or not previous.isalnum():
+		return True
+	# camelCase
+	return text[index].isupper() and previous.islower()
+
+def fuzzy_score(pattern, text, lower=None):
+	"""
+	Scores how well pattern (lower case) matches text, None if the
+	characters of pattern are not found in order. Prefixes score highest,
+	then substrings, then characters at word boundaries and in runs.
+	"""
+	if not pattern:
+		return 0
+	if lower is None:
+		lower = text.lower()
+	if lower.startswith(pattern):
+		score = PREFIX_BONUS - (len(lower) - len(pattern))
+		if text.startswith(pattern):
+			score += CASE_BONUS
+		return score
+	score = 0
+	substring = lower.find(pattern)
+	if substring >= 0:
+		score += SUBSTRING_BONUS - substring
+		if is_boundary(text, substring):
+			score += BOUNDARY_BONUS
+		return score
+	position = -1
+	for char in pattern:
+		found = lower.find(char, position + 1)
+		if found < 0:
+			return None
+		if found == position + 1:
+			score += CONSECUTIVE_BONUS
+		else:
+			score -= GAP_PENALTY * (found - position - 1)
+		if is_boundary(text, found):
+			score += BOUNDARY_BONUS
+		position = found
+	return score
+
+def get_filter_text(item):
+	return item.get("filterText") or item.get("label", "")
+
+def get_sort_text(item):
+	return item.get("sortText") or item.get("label", "")
+
+class CompletionIndex:
+	"""
+	The items of one completion answer, narrowed locally as the user types.
+	Matching a longer pattern only looks at what matched the shorter one.
+	"""
+	def __init__(self, items, incomplete=False, prefix=""):
+		self.items = items
+		self.incomplete = incomplete
+		# what had been typed when the server answered, it may have filtered by it
+		self.prefix = prefix
+		self.texts = [get_filter_text(item) for item in items]
+		self.lowers = [text.lower() for text in self.texts]
+		# indices of the items matching last_pattern
+		self.last_pattern = None
+		self.last_matches = None
+
+	def match(self, pattern):
+		"""
+		Returns [(score, index)] of the items matching pattern.
+		"""
+		pattern = pattern.lower()
+		if self.last_pattern is not None and pattern.startswith(self.last_pattern):
+			candidates = self.last_matches
+		else:
+			candidates = range(len(self.items))
+		texts = self.texts
+		lowers = self.lowers
+		matches = []
+		for index in candidates:
+			score = fuzzy_score(pattern, texts[index], lowers[index])
+			if score is not None:
+				matches.append((score, index))
+		self.last_pattern = pattern
+		self.last_matches = [index for score, index in matches]
+		return matches
+
+	def covers(self, pattern):
+		"""
+		Whether the items are all there is for pattern.
+		"""
+		return not self.incomplete and pattern.startswith(self.prefix)
+
+	def filter(self, pattern, limit=None):
+		"""
+		Returns the items matching pattern, best first.
+		"""
+		items = self.items
+		matches = self.match(pattern)
+		matches.sort(key=lambda match: (-match[0], get_sort_text(items[match[1]]), self.texts[match[1]]))
+		if limit is not None:
+			matches = matches[:limit]
+		return [items[index] for score, index in matches]
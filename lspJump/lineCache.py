@@ -0,0 +1,91 @@
+#	lspJump - a gedit plugin to browse code using the LSP protocol
+#	Copyright (C) 2020  Florian Evaldsson
+
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import mmap
+import array
+import concurrent.futures
+
+from lspJump.cache import LruCache
+
+# characters of a line shown in a preview
+PREVIEW_LENGTH = 200
+
+def build_line_index(data):
+	"""
+	Returns the offset of the start of every line in data.
+	"""
+	offsets = array.array("Q", [0])
+	find = data.find
+	position = find(b"\n")
+	while position >= 0:
+		offsets.append(position + 1)
+		position = find(b"\n", position + 1)
+	return offsets
+
+class LineIndex:
+	def __init__(self, mtime, size, offsets):
+		self.mtime = mtime
+		self.size = size
+		self.offsets = offsets
+
+class LineCache:
+	"""
+	Source lines of files on disk. The newline offsets of a file are kept
+	until its mtime or size changes, the lines are sliced out of a mmap of
+	the file, all lines of one file with one open.
+	"""
+	def __init__(self, maxfiles=512):
+		self.indexes = LruCache(maxfiles)
+
+	def get_lines(self, path, lines):
+		"""
+		Returns {line: text} for the 1-based line numbers in lines that exist
+		in the file at path, the text is stripped and shortened.
+		"""
+		stat = os.stat(path)
+		if stat.st_size == 0:
+			return {}
+		result = {}
+		with open(path, "rb") as f:
+			with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+				index = self.indexes.get(path)
+				if index is None or index.mtime != stat.st_mtime_ns or index.size != len(data):
+					index = LineIndex(stat.st_mtime_ns, len(data), build_line_index(data))
+					self.indexes.put(path, index)
+				offsets = index.offsets
+				for line in set(lines):
+					if line < 1 or line > len(offsets):
+						continue
+					start = offsets[line - 1]
+					end = offsets[line] if line < len(offsets) else len(data)
+					# no need to decode more than is shown
+					text = data[start:min(end, start + PREVIEW_LENGTH * 4)]
+					result[line] = text.decode("utf-8", "replace").strip()[:PREVIEW_LENGTH]
+		return result
+
+	def invalidate(self, path):
+		self.indexes.pop(path)
+
+LINE_CACHE = LineCache()
+EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="lspJump-lines")
+
+def get_lines_async(path, lines):
+	"""
+	Reads the lines on the thread pool, returns a concurrent.futures.Future
+	of the dict returned by LineCache.get_lines.
+	"""
+	return EXECUTOR.submit(LINE_CACHE.get_lines, path, lines)
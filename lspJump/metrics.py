@@ -0,0 +1,141 @@
+#	lspJump - a gedit plugin to browse code using the LSP protocol
+#	Copyright (C) 2020  Florian Evaldsson
+
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import threading
+import time
+from collections import deque
+
+# latencies kept per method for the percentiles
+LATENCY_SAMPLES = 1024
+
+def percentile(sorted_values, fraction):
+	if not sorted_values:
+		return None
+	index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+	return sorted_values[index]
+
+class MethodMetrics:
+	def __init__(self):
+		self.count = 0
+		self.errors = 0
+		self.cancelled = 0
+		self.timed_out = 0
+		self.in_flight = 0
+		self.bytes_out = 0
+		self.bytes_in = 0
+		# seconds
+		self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+	def to_dict(self):
+		latencies = sorted(self.latencies)
+		def ms(value):
+			if value is None:
+				return None
+			return round(value * 1000.0, 3)
+		return {
+			"count": self.count,
+			"errors": self.errors,
+			"cancelled": self.cancelled,
+			"timed_out": self.timed_out,
+			"in_flight": self.in_flight,
+			"bytes_out": self.bytes_out,
+			"bytes_in": self.bytes_in,
+			"p50_ms": ms(percentile(latencies, 0.50)),
+			"p95_ms": ms(percentile(latencies, 0.95)),
+			"p99_ms": ms(percentile(latencies, 0.99))
+		}
+
+class ProtocolMetrics:
+	"""
+	Counters for the JSON-RPC traffic of one server, updated from both the
+	sending threads and the reader thread.
+	"""
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.methods = {}
+		self.started = time.time()
+
+	def _get(self, method):
+		metrics = self.methods.get(method)
+		if metrics is None:
+			metrics = self.methods[method] = MethodMetrics()
+		return metrics
+
+	def request_sent(self, method):
+		# called before the request is written, the answer may be quicker than the write returns
+		with self.lock:
+			metrics = self._get(method)
+			metrics.count += 1
+			metrics.in_flight += 1
+
+	def bytes_sent(self, method, size):
+		with self.lock:
+			self._get(method).bytes_out += size
+
+	def notification_sent(self, method, size):
+		with self.lock:
+			metrics = self._get(method)
+			metrics.count += 1
+			metrics.bytes_out += size
+
+	def notification_received(self, method, size):
+		with self.lock:
+			metrics = self._get(method)
+			metrics.count += 1
+			metrics.bytes_in += size
+
+	def response_received(self, method, size, latency, error):
+		with self.lock:
+			metrics = self._get(method)
+			metrics.in_flight -= 1
+			metrics.bytes_in += size
+			metrics.latencies.append(latency)
+			if error:
+				metrics.errors += 1
+
+	def request_cancelled(self, method):
+		with self.lock:
+			metrics = self._get(method)
+			metrics.in_flight -= 1
+			metrics.cancelled += 1
+
+	def request_failed(self, method):
+		with self.lock:
+			metrics = self._get(method)
+			metrics.in_flight -= 1
+			metrics.errors += 1
+
+	def request_timed_out(self, method):
+		with self.lock:
+			metrics = self._get(method)
+			metrics.in_flight -= 1
+			metrics.timed_out += 1
+
+	def snapshot(self):
+		with self.lock:
+			methods = {method: metrics.to_dict() for method, metrics in self.methods.items()}
+		return {
+			"started": self.started,
+			"time": time.time(),
+			"in_flight": sum(m["in_flight"] for m in methods.values()),
+			"timed_out": sum(m["timed_out"] for m in methods.values()),
+			"methods": methods
+		}
+
+	def dump(self, path):
+		with open(path, "w") as f:
+			json.dump(self.snapshot(), f, indent=1, sort_keys=True)
@@ -0,0 +1,122 @@
+#	lspJump - a gedit plugin to browse code using the LSP protocol
+#	Copyright (C) 2020  Florian Evaldsson
+
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import array
+import bisect
+
+# SymbolKind Method, Constructor, Function
+FUNCTION_KINDS = frozenset([6, 9, 12])
+
+def position_key(line, character):
+	# one integer per position, compares like (line, character)
+	return (line << 32) | min(character, 0xffffffff)
+
+def key_position(key):
+	return key >> 32, key & 0xffffffff
+
+def _range_keys(symbol_range):
+	start = symbol_range["start"]
+	end = symbol_range["end"]
+	return position_key(start["line"], start["character"]), position_key(end["line"], end["character"])
+
+def _flatten(symbols, entries):
+	for symbol in symbols or []:
+		if "location" in symbol:
+			# SymbolInformation, no selection range
+			start, end = _range_keys(symbol["location"]["range"])
+			entries.append((start, end, start, symbol.get("kind") or 0, symbol["name"]))
+			continue
+		start, end = _range_keys(symbol["range"])
+		selection = _range_keys(symbol.get("selectionRange") or symbol["range"])[0]
+		entries.append((start, end, selection, symbol.get("kind") or 0, symbol["name"]))
+		_flatten(symbol.get("children"), entries)
+
+class Outline:
+	"""
+	The symbols of one document version in flat arrays sorted by start.
+	Symbols nest, so the innermost symbol around a position is the last one
+	starting before it or one of its parents: a binary search and a walk up
+	instead of a walk of the whole tree.
+	"""
+	def __init__(self, symbols):
+		entries = []
+		_flatten(symbols, entries)
+		# outer symbols first where two start at the same position
+		entries.sort(key=lambda entry: (entry[0], -entry[1]))
+		self.starts = array.array("Q")
+		self.ends = array.array("Q")
+		self.selections = array.array("Q")
+		self.kinds = array.array("B")
+		self.parents = array.array("i")
+		self.depths = array.array("H")
+		self.names = []
+		stack = []
+		for start, end, selection, kind, name in entries:
+			# the symbols on the stack that do not contain this one are done
+			while stack and (self.ends[stack[-1]] < end or (self.ends[stack[-1]] <= start < end)):
+				stack.pop()
+			self.parents.append(stack[-1] if stack else -1)
+			self.depths.append(len(stack))
+			stack.append(len(self.names))
+			self.starts.append(start)
+			self.ends.append(end)
+			self.selections.append(selection)
+			self.kinds.append(kind if 0 <= kind < 256 else 0)
+			self.names.append(name)
+
+	def __len__(self):
+		return len(self.names)
+
+	def enclosing(self, line, character, kinds=None):
+		"""
+		Returns the index of the innermost symbol around the position, of
+		one of kinds if given, or -1.
+		"""
+		key = position_key(line, character)
+		index = bisect.bisect_right(self.starts, key) - 1
+		return self.enclosing_from(index, key, kinds)
+
+	def enclosing_from(self, index, key=None, kinds=None):
+		"""
+		Walks up from the symbol at index to the first one containing key
+		(the start of index if None), of one of kinds if given.
+		"""
+		if key is None and index >= 0:
+			key = self.starts[index]
+		while index >= 0:
+			# the end is included, the cursor may be right behind the symbol
+			if self.ends[index] >= key and (kinds is None or self.kinds[index] in kinds):
+				return index
+			index = self.parents[index]
+		return -1
+
+	def get_selection(self, index):
+		"""
+		Returns (line, character) of the name of the symbol at index.
+		"""
+		return key_position(self.selections[index])
+
+	def get_rows(self, uri):
+		"""
+		Rows for the symbols table of lspJump.symbolIndex.
+		"""
+		rows = []
+		for index, name in enumerate(self.names):
+			parent = self.parents[index]
+			line, character = key_position(self.selections[index])
+			end_line, end_character = key_position(self.ends[index])
+			rows.append((name, name.lower(), self.kinds[index], self.names[parent] if parent >= 0 else None, uri, line, character, end_line, end_character))
+		return rows
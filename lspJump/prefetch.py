@@ -0,0 +1,169 @@
+#	lspJump - a gedit plugin to browse code using the LSP protocol
+#	Copyright (C) 2020  Florian Evaldsson
+
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from collections import deque
+
+from gi.repository import GLib
+
+from lspJump import settings
+from lspJump.completion import is_word_char
+
+def get_word_starts(text):
+	"""
+	Offsets of the words in text as is_word_char sees them, where
+	get_word_start of any of their characters ends up. Numbers are left out.
+	"""
+	starts = []
+	in_word = False
+	for offset, char in enumerate(text):
+		if is_word_char(char):
+			if not in_word and not char.isdigit():
+				starts.append(offset)
+			in_word = True
+		else:
+			in_word = False
+	return starts
+
+def get_visible_lines(view):
+	rect = view.get_visible_rect()
+	first = view.get_line_at_y(rect.y)[0].get_line()
+	last = view.get_line_at_y(rect.y + rect.height)[0].get_line()
+	return first, last
+
+def is_code(buffer, text_iter):
+	# GtkSource knows where the comments and strings are
+	if not hasattr(buffer, "iter_has_context_class"):
+		return True
+	return not (buffer.iter_has_context_class(text_iter, "comment") or buffer.iter_has_context_class(text_iter, "string"))
+
+class DefinitionPrefetcher:
+	"""
+	Asks for the definitions of the identifiers on screen once gedit has
+	been idle for a while, so that F3 on them is answered from the result
+	cache. Typing, scrolling and an indexing server stop it, at most
+	settings.prefetchbudget requests are made per screen and
+	settings.prefetchinflight at a time.
+	"""
+	def __init__(self, plugin):
+		self.plugin = plugin
+		self.view = None
+		self.handler_ids = []
+		self.timeout = None
+		# (line, offset) still to ask for
+		self.pending = deque()
+		self.in_flight = set()
+		# bumped on every stop, late answers of older rounds are ignored
+		self.generation = 0
+
+	def set_view(self, view):
+		if view is self.view:
+			return
+		self.stop()
+		for widget, handler_id in self.handler_ids:
+			widget.disconnect(handler_id)
+		self.handler_ids = []
+		self.view = view
+		if view is None:
+			return
+		self.handler_ids = [
+			(view.get_buffer(), view.get_buffer().connect("changed", self.restart)),
+			(view.get_vadjustment(), view.get_vadjustment().connect("value-changed", self.restart))
+		]
+		self.schedule()
+
+	def stop(self):
+		self.generation += 1
+		if self.timeout is not None:
+			GLib.source_remove(self.timeout)
+			self.timeout = None
+		self.pending.clear()
+		for future in self.in_flight:
+			self.plugin.cancel_request(future)
+		self.in_flight = set()
+
+	def restart(self, *args):
+		self.stop()
+		self.schedule()
+
+	def schedule(self):
+		if self.view is not None and self.timeout is None:
+			self.timeout = GLib.timeout_add(settings.prefetchdelay, self._start)
+
+	def _get_navigator(self):
+		navigator = self.plugin.get_navigator(self.view.get_buffer(), False)
+		if navigator is None or not navigator.is_ready():
+			return None
+		return navigator
+
+	def _start(self):
+		self.timeout = None
+		navigator = self._get_navigator()
+		if navigator is None:
+			return False
+		if navigator.status.is_indexing():
+			# look again later
+			self.schedule()
+			return False
+		self.pending = deque(self._collect())
+		settings.debugprint("prefetching %d definitions", len(self.pending))
+		self._next(navigator)
+		return False
+
+	def _collect(self):
+		"""
+		The identifier starts on screen, the lines around the cursor first.
+		"""
+		buffer = self.view.get_buffer()
+		first, last = get_visible_lines(self.view)
+		cursor = buffer.get_iter_at_mark(buffer.get_insert()).get_line()
+		lines = sorted(range(first, last + 1), key=lambda line: abs(line - cursor))
+		positions = []
+		for line in lines:
+			start = buffer.get_iter_at_line(line)
+			end = start.copy()
+			if not end.ends_line():
+				end.forward_to_line_end()
+			for offset in get_word_starts(buffer.get_text(start, end, True)):
+				text_iter = buffer.get_iter_at_line_offset(line, offset)
+				if is_code(buffer, text_iter):
+					positions.append((line, offset))
+					if len(positions) >= settings.prefetchbudget:
+						return positions
+		return positions
+
+	def _next(self, navigator):
+		buffer = self.view.get_buffer()
+		generation = self.generation
+		while self.pending and len(self.in_flight) < settings.prefetchinflight:
+			if navigator.status.is_indexing():
+				self.restart()
+				return
+			line, offset = self.pending.popleft()
+			future = navigator.prefetchDefinitionsAsync(buffer, buffer.get_iter_at_line_offset(line, offset))
+			if future.done():
+				# already known
+				continue
+			self.in_flight.add(future)
+			future.add_done_callback(lambda f: GLib.idle_add(self._done, f, generation))
+
+	def _done(self, future, generation):
+		if generation != self.generation:
+			return False
+		self.in_flight.discard(future)
+		navigator = self._get_navigator()
+		if navigator is not None:
+			self._next(navigator)
+		return False
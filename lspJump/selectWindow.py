@@ -16,39 +16,225 @@
 
 import sys
 import os
-from gi.repository import Gtk, Gdk
-from lspJump import settings
-from lspJump.LspNavigator import LspNavigator
+import bisect
+from gi.repository import Gtk, Gdk, GLib
+from lspJump import settings, lineCache
+from lspJump.serverManager import LspManager
+from lspJump.LspNavigator import SymbolKind
+from lspJump.documentSync import uri_to_path
+
+def get_kind_name(kind):
+	try:
+		return SymbolKind(kind).name
+	except ValueError:
+		return ""
 
 class TreeViewWithColumn(Gtk.TreeView):
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
-		for i, head in enumerate(['File', 'Line', '', '']):
-			col = Gtk.TreeViewColumn(head, Gtk.CellRendererText(), text=i)
+		for i, head in enumerate(['File', 'Line', '']):
+			renderer = Gtk.CellRendererText()
+			col = Gtk.TreeViewColumn(head, renderer, text=i)
+			if i > 0:
+				col.set_cell_data_func(renderer, self._position_data, i)
 			self.append_column(col)
-		col.set_visible(False)
 
+	@staticmethod
+	def _position_data(col, renderer, model, tree_iter, column):
+		# file rows have no position
+		if model.get_value(tree_iter, SelectWindow.COL_LINE) > 0:
+			renderer.set_property("text", str(model.get_value(tree_iter, column)))
+		else:
+			renderer.set_property("text", "")
+
+class ReferenceGroup:
+	def __init__(self, path):
+		self.path = path
+		self.records = []
+		# the records are only put into the model once the row is expanded
+		self.filled = False
+		self.tree_iter = None
+		# line -> source text, read once the row is expanded or filtered
+		self.lines = {}
+		self.lines_requested = False
 
 class SelectWindow(Gtk.Window):
-	def __init__(self, plugin, windowTitle, records, opener):
+	COL_TEXT, COL_LINE, COL_COLUMN, COL_URI, COL_PATH = range(5)
+
+	def __init__(self, plugin, windowTitle, records, opener, on_cancel=None):
+		"""
+		records are [path, line, column, uri], shown grouped by file.
+
+		With on_cancel set the records are still coming in, append them with
+		append_records and call set_complete when done. on_cancel is called
+		if the user stops the search or closes the window before that.
+		"""
 		Gtk.Window.__init__(self)
 		self.plugin = plugin
-		self.treeview = TreeViewWithColumn(
-			model=Gtk.ListStore(str, int, int, str)
-		)  # file, line, line_str
+		self.store = Gtk.TreeStore(str, int, int, str, str)
+		self.groups = {}
+		# paths of the groups in the order of their rows
+		self.group_paths = []
+		self.count = 0
+		self.on_cancel = None
+		self.closed = False
+		# filled before anything watches the store, no signals handled per row
+		self.append_records(records)
+		self.filter_text = ""
+		self.filter = self.store.filter_new()
+		self.filter.set_visible_func(self.__visible)
+		self.treeview = TreeViewWithColumn(model=self.filter)
 		self.treeview.set_rules_hint(True)
+		self.treeview.set_search_column(self.COL_TEXT)
+		self.treeview.connect("test-expand-row", self.__expand)
+		if len(self.groups) == 1:
+			self.treeview.expand_all()
 		self.connect("key-press-event", self.__enter)
 		self.connect("button-press-event", self.__enter)
+		self.connect("destroy", self.__closed)
 		sw = Gtk.ScrolledWindow()
 		sw.add(self.treeview)
-		for rec in records:
-			if rec is not None:
-				self.treeview.get_model().append(rec)
-		self.add(sw)
+		self.on_cancel = on_cancel
+		box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+		self.search = Gtk.SearchEntry()
+		self.search.set_placeholder_text("Filter files and lines")
+		self.search.connect("search-changed", self.__search)
+		box.pack_start(self.search, False, False, 0)
+		box.pack_start(sw, True, True, 0)
+		if on_cancel is not None:
+			status = Gtk.Box()
+			self.status = Gtk.Label()
+			status.pack_start(self.status, True, True, 0)
+			self.stop_button = Gtk.Button(label="Stop")
+			self.stop_button.connect("clicked", self.__stop)
+			status.pack_start(self.stop_button, False, False, 0)
+			box.pack_start(status, False, False, 0)
+			self.status.set_text("Searching... "+str(self.count)+" found")
+			self.connect("destroy", self.__stop)
+		self.add(box)
 		self.opener = opener
 		self.set_title(windowTitle)
 		self.set_size_request(700, 360)
 
+	def _child_row(self, group, rec):
+		return [group.lines.get(rec[1], os.path.basename(rec[0])), rec[1], rec[2], rec[3], rec[0]]
+
+	def append_records(self, records):
+		changed = set()
+		reload = set()
+		for rec in records:
+			if rec is None:
+				continue
+			group = self.groups.get(rec[0])
+			if group is None:
+				group = self.groups[rec[0]] = ReferenceGroup(rec[0])
+				index = bisect.bisect(self.group_paths, rec[0])
+				self.group_paths.insert(index, rec[0])
+				group.tree_iter = self.store.insert(None, index, [rec[0], 0, 0, "", rec[0]])
+				# makes the row expandable
+				self.store.append(group.tree_iter, ["...", 0, 0, "", rec[0]])
+			if group.filled:
+				index = bisect.bisect(group.records, rec)
+				group.records.insert(index, rec)
+				self.store.insert(group.tree_iter, index, self._child_row(group, rec))
+				if rec[1] not in group.lines:
+					reload.add(group)
+			else:
+				group.records.append(rec)
+				if group.lines_requested:
+					# searched by the filter
+					reload.add(group)
+			changed.add(group)
+			self.count += 1
+		for group in changed:
+			self.store.set_value(group.tree_iter, self.COL_TEXT, group.path+" ("+str(len(group.records))+")")
+		for group in reload:
+			self._load_lines(group)
+		if self.on_cancel is not None:
+			self.status.set_text("Searching... "+str(self.count)+" found")
+
+	def _fill(self, group):
+		group.records.sort()
+		placeholder = self.store.iter_children(group.tree_iter)
+		for rec in group.records:
+			self.store.append(group.tree_iter, self._child_row(group, rec))
+		self.store.remove(placeholder)
+		group.filled = True
+		self._load_lines(group)
+
+	def _load_lines(self, group):
+		# read on the pool, all lines of a file at once
+		group.lines_requested = True
+		future = lineCache.get_lines_async(group.path, [rec[1] for rec in group.records])
+		future.add_done_callback(lambda f: GLib.idle_add(self._show_lines, group, f))
+
+	def _show_lines(self, group, future):
+		if self.closed:
+			return False
+		try:
+			group.lines = future.result()
+		except (OSError, ValueError) as e:
+			settings.debugprint("No preview for %s: %s", group.path, e)
+			return False
+		child = self.store.iter_children(group.tree_iter)
+		while child is not None:
+			text = group.lines.get(self.store.get_value(child, self.COL_LINE))
+			if text is not None:
+				self.store.set_value(child, self.COL_TEXT, text)
+			child = self.store.iter_next(child)
+		if self.filter_text:
+			self.filter.refilter()
+		return False
+
+	def __closed(self, w):
+		self.closed = True
+
+	def __expand(self, treeview, tree_iter, path):
+		group = self.groups.get(self.filter.get_value(tree_iter, self.COL_PATH))
+		if group is not None and not group.filled:
+			self._fill(group)
+		return False
+
+	def __visible(self, model, tree_iter, data):
+		if not self.filter_text:
+			return True
+		path = model.get_value(tree_iter, self.COL_PATH)
+		if path is None:
+			return False
+		if self.filter_text in path.lower():
+			return True
+		# or the source line, as far as it has been read
+		if model.get_value(tree_iter, self.COL_LINE) > 0:
+			return self.filter_text in model.get_value(tree_iter, self.COL_TEXT).lower()
+		group = self.groups.get(path)
+		return group is not None and any(self.filter_text in text.lower() for text in group.lines.values())
+
+	def __search(self, entry):
+		self.filter_text = entry.get_text().lower()
+		if self.filter_text:
+			# the lines of collapsed files are searched too, the rows are refiltered as they are read
+			for group in self.groups.values():
+				if not group.lines_requested:
+					self._load_lines(group)
+		self.filter.refilter()
+
+	def set_complete(self):
+		if self.on_cancel is None:
+			return
+		self.on_cancel = None
+		self.status.set_text(str(self.count)+" found")
+		self.stop_button.hide()
+
+	def __stop(self, w):
+		on_cancel = self.on_cancel
+		if on_cancel is None:
+			return
+		self.on_cancel = None
+		if w is self.stop_button:
+			self.status.set_text("Stopped, "+str(self.count)+" found")
+			self.stop_button.hide()
+		on_cancel()
+
 	def __enter(self, w, e):
 		event_type = e.get_event_type()
 		if (
@@ -59,10 +245,427 @@ class SelectWindow(Gtk.Window):
 			)
 		):
 			model, tree_iter = self.treeview.get_selection().get_selected()
-			location = model.get(tree_iter, 0, 1, 2, 3)
+			if tree_iter is None:
+				return
+			if model.get_value(tree_iter, self.COL_LINE) == 0:
+				# a file
+				path = model.get_path(tree_iter)
+				if self.treeview.row_expanded(path):
+					self.treeview.collapse_row(path)
+				else:
+					self.treeview.expand_row(path, False)
+				return
+			location = model.get(tree_iter, self.COL_PATH, self.COL_LINE, self.COL_COLUMN, self.COL_URI)
 			self.destroy()
 			self.opener(location)
 			
+class SymbolSearchWindow(Gtk.Window):
+	COL_NAME, COL_KIND, COL_CONTAINER, COL_PATH, COL_LINE, COL_COLUMN, COL_URI = range(7)
+
+	def __init__(self, plugin, navigator, opener):
+		"""
+		Searches the symbol index of navigator as the user types, the server
+		is asked as well once the typing pauses.
+		"""
+		Gtk.Window.__init__(self)
+		self.plugin = plugin
+		self.navigator = navigator
+		self.opener = opener
+		self.server_future = None
+		self.server_timeout = None
+		self.closed = False
+		self.store = Gtk.ListStore(str, str, str, str, int, int, str)
+		self.treeview = Gtk.TreeView(model=self.store)
+		self.treeview.set_rules_hint(True)
+		for head, column in [("Symbol", self.COL_NAME), ("Kind", self.COL_KIND), ("In", self.COL_CONTAINER), ("File", self.COL_PATH), ("Line", self.COL_LINE)]:
+			self.treeview.append_column(Gtk.TreeViewColumn(head, Gtk.CellRendererText(), text=column))
+		self.connect("key-press-event", self.__enter)
+		self.treeview.connect("button-press-event", self.__enter)
+		self.connect("destroy", self.__closed)
+		box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+		self.search = Gtk.SearchEntry()
+		self.search.set_placeholder_text("Symbol name")
+		self.search.connect("search-changed", self.__search)
+		box.pack_start(self.search, False, False, 0)
+		sw = Gtk.ScrolledWindow()
+		sw.add(self.treeview)
+		box.pack_start(sw, True, True, 0)
+		self.status = Gtk.Label()
+		box.pack_start(self.status, False, False, 0)
+		self.add(box)
+		self.set_title("Go to symbol in workspace")
+		self.set_size_request(800, 400)
+		self._show(self.navigator.searchSymbols("", settings.symbolsearchmax))
+
+	def _show(self, rows):
+		# no signals handled per row while filling
+		self.treeview.set_model(None)
+		self.store.clear()
+		for name, kind, container, uri, line, character in rows:
+			self.store.append([name, get_kind_name(kind), container or "", uri_to_path(uri), line + 1, character + 1, uri])
+		self.treeview.set_model(self.store)
+		if len(self.store):
+			self.treeview.get_selection().select_path(Gtk.TreePath(0))
+		self.status.set_text(str(len(self.store))+" found" + (", asking the server..." if self.server_future is not None or self.server_timeout is not None else ""))
+
+	def _cancel_server(self):
+		if self.server_timeout is not None:
+			GLib.source_remove(self.server_timeout)
+			self.server_timeout = None
+		if self.server_future is not None:
+			self.plugin.cancel_request(self.server_future)
+			self.server_future = None
+
+	def __search(self, entry):
+		query = entry.get_text()
+		self._cancel_server()
+		if query.strip() and self.navigator.supportsWorkspaceSymbols():
+			self.server_timeout = GLib.timeout_add(settings.symbolsearchdelay, self._ask_server, query)
+		self._show(self.navigator.searchSymbols(query, settings.symbolsearchmax))
+
+	def _ask_server(self, query):
+		self.server_timeout = None
+		future = self.navigator.getWorkspaceSymbolsAsync(query)
+		self.server_future = future
+		future.add_done_callback(lambda f: GLib.idle_add(self._server_answered, f, query))
+		return False
+
+	def _server_answered(self, future, query):
+		if self.closed or future is not self.server_future:
+			return False
+		self.server_future = None
+		if not future.cancelled() and future.exception() is not None:
+			settings.debugprint("workspace/symbol failed: %s", future.exception())
+		# merged into the index by now
+		self._show(self.navigator.searchSymbols(query, settings.symbolsearchmax))
+		return False
+
+	def __closed(self, w):
+		self.closed = True
+		self._cancel_server()
+
+	def __enter(self, w, e):
+		event_type = e.get_event_type()
+		if event_type == Gdk.EventType.KEY_PRESS and e.keyval in (Gdk.KEY_Up, Gdk.KEY_Down) and self.search.has_focus():
+			# move through the results without leaving the entry
+			self.treeview.grab_focus()
+			return False
+		if not (
+			event_type == Gdk.EventType._2BUTTON_PRESS
+			or (
+				event_type == Gdk.EventType.KEY_PRESS
+				and e.keyval == 65293
+			)
+		):
+			return False
+		model, tree_iter = self.treeview.get_selection().get_selected()
+		if tree_iter is None:
+			return False
+		location = model.get(tree_iter, self.COL_PATH, self.COL_LINE, self.COL_COLUMN, self.COL_URI)
+		self.destroy()
+		self.opener(location)
+		return True
+
+class PeekWindow(Gtk.Window):
+	SECTIONS = [("definition", "Definition"), ("typeDefinition", "Type definition"), ("hover", "Information"), ("references", "References")]
+
+	def __init__(self, plugin, name, opener, on_cancel=None):
+		"""
+		Definition, type definition, hover and references of one position,
+		filled in with set_part as the answers arrive. on_cancel is called if
+		the window is closed before set_complete.
+		"""
+		Gtk.Window.__init__(self)
+		self.plugin = plugin
+		self.opener = opener
+		self.on_cancel = on_cancel
+		self.closed = False
+		# kind -> box of the section
+		self.sections = {}
+		box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
+		for kind, title in self.SECTIONS:
+			frame = Gtk.Frame(label=title)
+			content = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+			content.pack_start(self._label("..."), False, False, 0)
+			frame.add(content)
+			box.pack_start(frame, False, False, 0)
+			self.sections[kind] = content
+		sw = Gtk.ScrolledWindow()
+		sw.add(box)
+		self.add(sw)
+		self.connect("key-press-event", self.__key)
+		self.connect("destroy", self.__closed)
+		self.set_transient_for(plugin.window)
+		self.set_position(Gtk.WindowPosition.CENTER_ON_PARENT)
+		self.set_title("Peek: "+name)
+		self.set_default_size(700, 450)
+
+	@staticmethod
+	def _label(text):
+		label = Gtk.Label(label=text)
+		label.set_xalign(0)
+		label.set_line_wrap(True)
+		label.set_selectable(True)
+		return label
+
+	def _location_button(self, location):
+		button = Gtk.Button(label=location[0]+":"+str(location[1]))
+		button.set_relief(Gtk.ReliefStyle.NONE)
+		button.get_child().set_xalign(0)
+		button.connect("clicked", lambda w: self.__open(location))
+		# the source line, read on the pool
+		future = lineCache.get_lines_async(location[0], [location[1]])
+		future.add_done_callback(lambda f: GLib.idle_add(self._show_line, button, location, f))
+		return button
+
+	def _show_line(self, button, location, future):
+		if self.closed or future.exception() is not None:
+			return False
+		text = future.result().get(location[1])
+		if text:
+			button.set_label(os.path.basename(location[0])+":"+str(location[1])+"  "+text)
+		return False
+
+	def set_part(self, kind, result):
+		if self.closed:
+			return
+		content = self.sections[kind]
+		for child in content.get_children():
+			content.remove(child)
+		if not result:
+			content.pack_start(self._label("Nothing found"), False, False, 0)
+		elif kind == "hover":
+			content.pack_start(self._label(result), False, False, 0)
+		elif kind == "references":
+			content.pack_start(self._label(str(len(result))+" found"), False, False, 0)
+			for location in sorted(result)[:settings.peekreferences]:
+				content.pack_start(self._location_button(location), False, False, 0)
+			if len(result) > settings.peekreferences:
+				button = Gtk.Button(label="Show all")
+				button.connect("clicked", lambda w: self.__show_all(result))
+				content.pack_start(button, False, False, 0)
+		else:
+			for location in result:
+				content.pack_start(self._location_button(location), False, False, 0)
+		content.show_all()
+
+	def set_complete(self):
+		self.on_cancel = None
+		if self.closed:
+			return
+		for content in self.sections.values():
+			children = content.get_children()
+			if len(children) == 1 and isinstance(children[0], Gtk.Label) and children[0].get_text() == "...":
+				# not asked for, the server can not do it
+				children[0].set_text("Not supported")
+
+	def __open(self, location):
+		self.destroy()
+		self.opener(location)
+
+	def __show_all(self, records):
+		window = SelectWindow(self.plugin, "Item selection", records, self.opener)
+		self.destroy()
+		window.show_all()
+
+	def __key(self, w, e):
+		if e.keyval == Gdk.KEY_Escape:
+			self.destroy()
+			return True
+		return False
+
+	def __closed(self, w):
+		self.closed = True
+		on_cancel = self.on_cancel
+		self.on_cancel = None
+		if on_cancel is not None:
+			on_cancel()
+
+class OutlinePanel(Gtk.Box):
+	COL_NAME, COL_KIND, COL_LINE, COL_COLUMN = range(4)
+
+	def __init__(self, plugin):
+		"""
+		The symbols of the active document for the side panel, only asked
+		for while the panel is shown.
+		"""
+		Gtk.Box.__init__(self, orientation=Gtk.Orientation.VERTICAL)
+		self.plugin = plugin
+		self.doc = None
+		self.handler_ids = []
+		self.outline = None
+		# tree iter per symbol of self.outline
+		self.iters = []
+		self.future = None
+		self.timeout = None
+		self.store = Gtk.TreeStore(str, str, int, int)
+		self.treeview = Gtk.TreeView(model=self.store)
+		self.treeview.set_headers_visible(False)
+		self.treeview.set_search_column(self.COL_NAME)
+		for column in [self.COL_NAME, self.COL_KIND]:
+			self.treeview.append_column(Gtk.TreeViewColumn("", Gtk.CellRendererText(), text=column))
+		self.treeview.connect("row-activated", self.__activated)
+		sw = Gtk.ScrolledWindow()
+		sw.add(self.treeview)
+		self.pack_start(sw, True, True, 0)
+		self.connect("map", lambda w: self.refresh())
+
+	def set_document(self, doc):
+		if doc is self.doc:
+			return
+		for handler_id in self.handler_ids:
+			self.doc.disconnect(handler_id)
+		self.handler_ids = []
+		self.doc = doc
+		if doc is not None:
+			self.handler_ids = [
+				doc.connect("changed", self.__changed),
+				doc.connect("cursor-moved", self._follow_cursor)
+			]
+		self.refresh()
+
+	def __changed(self, doc):
+		if self.timeout is not None:
+			GLib.source_remove(self.timeout)
+		self.timeout = GLib.timeout_add(settings.outlinedelay, self.refresh)
+
+	def refresh(self):
+		if self.timeout is not None:
+			GLib.source_remove(self.timeout)
+			self.timeout = None
+		# not cancelled, the symbol index may be waiting for the same answer
+		self.future = None
+		if not self.get_mapped():
+			return False
+		navigator = self.plugin.get_navigator(self.doc) if self.doc is not None else None
+		if navigator is None:
+			self._show(None)
+			return False
+		outline = navigator.lookupOutline(self.doc)
+		if outline is not None:
+			# switching tabs back and forth costs nothing
+			self._show(outline)
+			return False
+		doc = self.doc
+		future = navigator.getOutlineAsync(doc)
+		self.future = future
+		future.add_done_callback(lambda f: GLib.idle_add(self._answered, f, doc))
+		return False
+
+	def _answered(self, future, doc):
+		if future is not self.future or doc is not self.doc:
+			return False
+		self.future = None
+		if future.cancelled():
+			return False
+		if future.exception() is not None:
+			settings.debugprint("documentSymbol failed: %s", future.exception())
+			return False
+		self._show(future.result())
+		return False
+
+	def _show(self, outline):
+		if outline is self.outline:
+			self._follow_cursor()
+			return
+		self.outline = outline
+		self.iters = []
+		# no signals handled per row while filling
+		self.treeview.set_model(None)
+		self.store.clear()
+		if outline is not None:
+			for index, name in enumerate(outline.names):
+				parent = outline.parents[index]
+				line, character = outline.get_selection(index)
+				self.iters.append(self.store.append(self.iters[parent] if parent >= 0 else None, [name, get_kind_name(outline.kinds[index]), line + 1, character + 1]))
+		self.treeview.set_model(self.store)
+		self._follow_cursor()
+
+	def _follow_cursor(self, *args):
+		if self.outline is None or self.doc is None or not self.get_mapped():
+			return
+		cursor = self.doc.get_iter_at_mark(self.doc.get_insert())
+		index = self.outline.enclosing(cursor.get_line(), cursor.get_line_offset())
+		selection = self.treeview.get_selection()
+		if index < 0:
+			selection.unselect_all()
+			return
+		path = self.store.get_path(self.iters[index])
+		self.treeview.expand_to_path(path)
+		selection.select_path(path)
+		self.treeview.scroll_to_cell(path, None, False, 0, 0)
+
+	def __activated(self, treeview, path, column):
+		if self.doc is None or self.doc.get_file().get_location() is None:
+			return
+		line, character = self.store.get(self.store.get_iter(path), self.COL_LINE, self.COL_COLUMN)
+		self.plugin.add_history(self.plugin.backstack)
+		self.plugin.open_location(self.doc.get_file().get_location(), line, character)
+
+class MetricsWindow(Gtk.Window):
+	COLUMNS = [("Method", "method"), ("Count", "count"), ("In flight", "in_flight"), ("p50 ms", "p50_ms"), ("p95 ms", "p95_ms"), ("p99 ms", "p99_ms"), ("Bytes in", "bytes_in"), ("Bytes out", "bytes_out"), ("Errors", "errors"), ("Cancelled", "cancelled"), ("Timed out", "timed_out")]
+
+	def __init__(self, plugin):
+		Gtk.Window.__init__(self)
+		self.plugin = plugin
+		self.set_title("lspJump protocol metrics")
+		self.set_size_request(900, 360)
+
+		box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+		self.summary = Gtk.Label()
+		box.pack_start(self.summary, False, False, 0)
+
+		self.store = Gtk.ListStore(*([str]*len(self.COLUMNS)))
+		treeview = Gtk.TreeView(model=self.store)
+		for i, (head, key) in enumerate(self.COLUMNS):
+			col = Gtk.TreeViewColumn(head, Gtk.CellRendererText(), text=i)
+			treeview.append_column(col)
+		sw = Gtk.ScrolledWindow()
+		sw.add(treeview)
+		box.pack_start(sw, True, True, 0)
+
+		buttons = Gtk.Box()
+		button = Gtk.Button(label="Refresh")
+		button.connect("clicked", self._refresh)
+		buttons.pack_start(button, True, True, 0)
+		button = Gtk.Button(label="Dump to JSON file")
+		button.connect("clicked", self._dump)
+		buttons.pack_start(button, True, True, 0)
+		box.pack_start(buttons, False, False, 0)
+
+		self.add(box)
+		self._refresh(None)
+
+	def _get_snapshots(self):
+		if settings.LSP_MANAGER is None:
+			return {}
+		return settings.LSP_MANAGER.metrics_snapshot()
+
+	def _refresh(self, w):
+		self.store.clear()
+		snapshots = self._get_snapshots()
+		if not snapshots:
+			self.summary.set_text("No language server running")
+			return
+		summary = []
+		for profile_name, snapshot in sorted(snapshots.items()):
+			summary.append(profile_name+": In flight: "+str(snapshot["in_flight"])+" Timed out: "+str(snapshot["timed_out"]))
+			for method, values in sorted(snapshot["methods"].items()):
+				values = dict(values, method=profile_name+": "+method)
+				self.store.append(["" if values[key] is None else str(values[key]) for head, key in self.COLUMNS])
+		self.summary.set_text("\n".join(summary))
+
+	def _dump(self, w):
+		snapshots = self._get_snapshots()
+		if not snapshots:
+			return
+		dialog = Gtk.FileChooserDialog("Save metrics", self, Gtk.FileChooserAction.SAVE, (Gtk.STOCK_CANCEL,Gtk.ResponseType.CANCEL,Gtk.STOCK_SAVE,Gtk.ResponseType.OK))
+		dialog.set_current_name("lspJump-metrics.json")
+		dialog.set_do_overwrite_confirmation(True)
+		if dialog.run() == Gtk.ResponseType.OK:
+			settings.LSP_MANAGER.dump_metrics(dialog.get_filename())
+		dialog.destroy()
+
 class ProjectDir(Gtk.Window):
 	def __init__(self, plugin):
 		Gtk.Window.__init__(self)
@@ -160,6 +763,22 @@ class SettingsWindow(Gtk.Grid):
 		self.attach(button_search_proj, 1, row_num, 1, 1)
 		row_num=row_num+1
 		
+		label=Gtk.Label("Workspace folders:")
+		self.attach(label, 0, row_num, 2, 1)
+		row_num=row_num+1
+		
+		self.workspace_pos=row_num
+		row_num=row_num+1
+		
+		button_add_folder = Gtk.Button(label="Add to workspace")
+		button_add_folder.connect("clicked", self._add_project_path)
+		self.attach(button_add_folder, 0, row_num, 1, 1)
+		
+		button_remove_folder = Gtk.Button(label="Remove from workspace")
+		button_remove_folder.connect("clicked", self._remove_project_path)
+		self.attach(button_remove_folder, 1, row_num, 1, 1)
+		row_num=row_num+1
+		
 		label=Gtk.Label("Profiles")
 		self.attach(label, 0, row_num, 2, 1)
 		row_num=row_num+1
@@ -187,7 +806,17 @@ class SettingsWindow(Gtk.Grid):
 		row_num=row_num+1
 		
 		self._generate_path_history()
+		self._generate_workspace_folders()
 		self._generate_language_combo()
+	def _generate_workspace_folders(self):
+		if hasattr(self,"workspace_cb"):
+			self.workspace_cb.destroy()
+		self.workspace_cb = Gtk.ComboBoxText()
+		for path in settings.get_project_paths():
+			self.workspace_cb.append_text(path)
+		self.workspace_cb.set_active(0)
+		self.attach(self.workspace_cb, 0, self.workspace_pos, 2, 1)
+		self.workspace_cb.show()
 	def _generate_language_combo(self):
 		if hasattr(self,"lang_cb"):
 			self.lang_cb.destroy()
@@ -227,13 +856,34 @@ class SettingsWindow(Gtk.Grid):
 		settings.debugprint("Changed to: "+new_path)
 		settings.addPreviousPath(new_path)
 		self._generate_path_history()
-		
-		if settings.LSP_NAVIGATOR is not None:
-			settings.LSP_NAVIGATOR.lsp_endpoint.shutdown()
-			settings.LSP_NAVIGATOR.lsp_endpoint.send_notification("exit")
-		settings.PROJECT_PATH=new_path
-		settings.LSP_NAVIGATOR=LspNavigator()
-		# settings.LSP_NAVIGATOR._initialize_project_path(settings.PROJECT_PATH)
+		if settings.LSP_MANAGER is not None and [new_path] == settings.get_project_paths():
+			# the same path again, start over with the profiles as they are now
+			settings.LSP_MANAGER.restart(settings.LSP_MANAGER.get_navigators())
+		self._set_project_paths([new_path])
+	def _add_project_path(self, w):
+		new_path=self.path_entry.get_text()
+		settings.debugprint("Added: "+new_path)
+		settings.addPreviousPath(new_path)
+		self._generate_path_history()
+		paths=list(settings.get_project_paths())
+		if new_path not in paths:
+			paths.append(new_path)
+		self._set_project_paths(paths)
+	def _remove_project_path(self, w):
+		old_path=self.workspace_cb.get_active_text()
+		if old_path is not None:
+			settings.debugprint("Removed: "+old_path)
+			self._set_project_paths([path for path in settings.get_project_paths() if path!=old_path])
+	def _set_project_paths(self, paths):
+		if settings.LSP_MANAGER is None:
+			settings.set_project_paths(paths)
+			settings.LSP_MANAGER=LspManager()
+		else:
+			# running servers are kept (and keep their index) if they support workspace folders
+			settings.LSP_MANAGER.set_workspace_folders(paths)
+		# start the servers of the languages in use right away
+		settings.LSP_MANAGER.start_for_documents(self.plugin.window.get_documents())
+		self._generate_workspace_folders()
 	def _new_language(self, w):
 		dialog=LanguageSettings(self,"",False)
 		response=dialog.run()
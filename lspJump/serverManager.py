@@ -0,0 +1,159 @@
+#	lspJump - a gedit plugin to browse code using the LSP protocol
+#	Copyright (C) 2020  Florian Evaldsson
+
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import threading
+
+from lspJump import settings
+from lspJump.LspNavigator import LspNavigator, ServerState
+
+def get_request_endpoint(future):
+	source = future
+	while hasattr(source, "source"):
+		source = source.source
+	return getattr(source, "lsp_endpoint", None)
+
+# called as listener(navigator) from the reader thread when the ServerStatus of any navigator changes
+status_listeners = []
+
+def notify_status(navigator):
+	for listener in list(status_listeners):
+		listener(navigator)
+
+class LspManager:
+	"""
+	One LspNavigator per profile in the settings file. Requests are routed
+	by the language of the document, servers of other languages keep running
+	(and keep their index) while they are not used.
+	"""
+	def __init__(self):
+		self.navigators = {}
+		self.lock = threading.RLock()
+
+	def get_navigators(self):
+		with self.lock:
+			return list(self.navigators.values())
+
+	def start(self, profile):
+		"""
+		Returns the navigator of profile, spawning its server if needed. The
+		server is started in the background, requests made before it is
+		ready are queued.
+		"""
+		stale = None
+		with self.lock:
+			navigator = self.navigators.get(profile.name)
+			if navigator is not None and navigator.profile.get_key() != profile.get_key():
+				# the profile has been edited since its server was started
+				stale = navigator
+				navigator = None
+			if navigator is None:
+				settings.debugprint("Starting server for profile %s", profile.name)
+				navigator = LspNavigator(profile)
+				navigator.status.listeners.append(lambda status, navigator=navigator: notify_status(navigator))
+				self.navigators[profile.name] = navigator
+		if stale is not None:
+			settings.debugprint("Restarting %s, its profile changed", profile.name)
+			stale.shutdown()
+		return navigator
+
+	def restart(self, navigators):
+		"""
+		Stops navigators and starts them again with their profiles as they
+		are in the settings now.
+		"""
+		with self.lock:
+			for navigator in navigators:
+				if self.navigators.get(navigator.profile.name) is navigator:
+					del self.navigators[navigator.profile.name]
+		for navigator in navigators:
+			navigator.shutdown()
+		profiles = [settings.get_profile(navigator.profile.name) for navigator in navigators]
+		self.start_profiles([profile for profile in profiles if profile is not None])
+
+	def start_profiles(self, profiles):
+		# every server starts in a thread of its own
+		for profile in profiles:
+			self.start(profile)
+
+	def start_for_documents(self, docs):
+		profiles = {}
+		for doc in docs:
+			doctype = settings.get_document_programming_language_type(doc)
+			profile = settings.get_profile_for_language(doctype)
+			if profile is not None:
+				profiles[profile.name] = profile
+		self.start_profiles(profiles.values())
+
+	def navigator_for(self, doc, start=True):
+		"""
+		Returns the LspNavigator for the language of doc or None if no
+		profile handles it. The server is started if needed and start is set.
+		"""
+		if doc is None:
+			return None
+		doctype = settings.get_document_programming_language_type(doc)
+		profile = settings.get_profile_for_language(doctype)
+		if profile is None:
+			return None
+		with self.lock:
+			navigator = self.navigators.get(profile.name)
+		if navigator is not None and navigator.profile.get_key() == profile.get_key():
+			return navigator
+		return self.start(profile) if start else None
+
+	def set_workspace_folders(self, paths):
+		"""
+		Changes the project folders of all running servers. Servers without
+		workspace folder support, failed ones and those of edited profiles
+		are restarted.
+		"""
+		settings.set_project_paths(paths)
+		restart = []
+		for navigator in self.get_navigators():
+			profile = settings.get_profile(navigator.profile.name)
+			if navigator.state == ServerState.Failed or profile is None or profile.get_key() != navigator.profile.get_key():
+				restart.append(navigator)
+			elif not navigator.setWorkspaceFolders(settings.get_project_paths()):
+				restart.append(navigator)
+		for navigator in restart:
+			settings.debugprint("Restarting %s", navigator.profile.name)
+		self.restart(restart)
+
+	def cancelRequest(self, future):
+		lsp_endpoint = get_request_endpoint(future)
+		if lsp_endpoint is not None:
+			lsp_endpoint.cancel_request(future)
+		else:
+			future.cancel()
+
+	def closeDocument(self, doc):
+		for navigator in self.get_navigators():
+			navigator.closeDocument(doc)
+
+	def metrics_snapshot(self):
+		return {name: navigator.lsp_endpoint.metrics.snapshot() for name, navigator in list(self.navigators.items())}
+
+	def dump_metrics(self, path):
+		with open(path, "w") as f:
+			json.dump(self.metrics_snapshot(), f, indent=1, sort_keys=True)
+
+	def shutdown(self):
+		with self.lock:
+			navigators = list(self.navigators.values())
+			self.navigators = {}
+		for navigator in navigators:
+			navigator.shutdown()
@@ -0,0 +1,120 @@
+#	lspJump - a gedit plugin to browse code using the LSP protocol
+#	Copyright (C) 2020  Florian Evaldsson
+
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import time
+import threading
+
+from lspJump import settings
+
+class ProgressTask:
+	def __init__(self, title):
+		self.title = title
+		self.message = None
+		self.percentage = None
+
+class ServerStatus:
+	"""
+	The work done progress the server reports on its own, such as indexing.
+	Tokens the client asked for are handled by their requests and never
+	get here. While any task runs, background requests are throttled.
+	"""
+	def __init__(self):
+		self.lock = threading.Lock()
+		# token -> ProgressTask
+		self.tasks = {}
+		# called as listener(status) from the reader thread on every change
+		self.listeners = []
+		self.last_admitted = 0
+
+	def on_create(self, params):
+		# window/workDoneProgress/create, the begin follows as $/progress
+		return None
+
+	def on_progress(self, params):
+		value = params.get("value") if params else None
+		if not isinstance(value, dict):
+			return
+		token = params.get("token")
+		kind = value.get("kind")
+		with self.lock:
+			if kind == "begin":
+				self.tasks[token] = ProgressTask(value.get("title", ""))
+			task = self.tasks.get(token)
+			if kind == "end":
+				self.tasks.pop(token, None)
+			elif task is not None:
+				if "message" in value:
+					task.message = value["message"]
+				if "percentage" in value:
+					task.percentage = value["percentage"]
+		self._notify()
+
+	def clear(self):
+		with self.lock:
+			if not self.tasks:
+				return
+			self.tasks = {}
+		self._notify()
+
+	def _notify(self):
+		for listener in list(self.listeners):
+			listener(self)
+
+	def is_indexing(self):
+		return bool(self.tasks)
+
+	def get_percentage(self):
+		"""
+		The least advanced of the running tasks reporting one, or None.
+		"""
+		with self.lock:
+			percentages = [task.percentage for task in self.tasks.values() if task.percentage is not None]
+		return min(percentages) if percentages else None
+
+	def describe(self):
+		"""
+		One line for the statusbar, empty while idle.
+		"""
+		with self.lock:
+			tasks = list(self.tasks.values())
+		if not tasks:
+			return ""
+		task = tasks[0]
+		text = task.title or "Working"
+		if task.message:
+			text += ": "+task.message
+		percentage = self.get_percentage()
+		if percentage is not None:
+			text += " ("+str(percentage)+"%)"
+		if len(tasks) > 1:
+			text += " and "+str(len(tasks) - 1)+" more"
+		return text
+
+	def admit_background(self):
+		"""
+		Whether a request nobody explicitly asked for (hover, prefetch) may
+		be sent now. While indexing one is let through every
+		settings.indexingthrottle seconds, the others would only slow the
+		indexer down.
+		"""
+		if not self.tasks:
+			return True
+		with self.lock:
+			now = time.monotonic()
+			if now - self.last_admitted < settings.indexingthrottle:
+				return False
+			self.last_admitted = now
+			return True
@@ -14,7 +14,6 @@
 #	You should have received a copy of the GNU General Public License
 #	along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from lspJump.LspNavigator import LspNavigator
 import xml.etree.ElementTree as ET
 import os
 
@@ -34,7 +33,7 @@ LSP_SETTINGS = """{
 	"textDocument": {"codeAction": {"dynamicRegistration": true},
 	"codeLens": {"dynamicRegistration": true},
 	"colorProvider": {"dynamicRegistration": true},
-	"completion": {"completionItem": {"commitCharactersSupport": true,"documentationFormat": ["markdown", "plaintext"],"snippetSupport": true},
+	"completion": {"completionItem": {"commitCharactersSupport": true,"documentationFormat": ["markdown", "plaintext"],"snippetSupport": true,"resolveSupport": {"properties": ["documentation", "detail", "additionalTextEdits"]}},
 	"completionItemKind": {"valueSet": [1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,21,22,23,24,25]},
 	"contextSupport": true,
 	"dynamicRegistration": true},
@@ -42,6 +41,7 @@ LSP_SETTINGS = """{
 	"documentHighlight": {"dynamicRegistration": true},
 	"documentLink": {"dynamicRegistration": true},
 	"documentSymbol": {"dynamicRegistration": true,
+	"hierarchicalDocumentSymbolSupport": true,
 	"symbolKind": {"valueSet": [1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,21,22,23,24,25,26]}},
 	"formatting": {"dynamicRegistration": true},
 	"hover": {"contentFormat": ["markdown", "plaintext"],
@@ -59,6 +59,8 @@ LSP_SETTINGS = """{
 	"willSave": true,
 	"willSaveWaitUntil": true},
 	"typeDefinition": {"dynamicRegistration": true}},
+	"general": {"positionEncodings": ["utf-32", "utf-16"]},
+	"window": {"workDoneProgress": true},
 	"workspace": {"applyEdit": true,
 	"configuration": true,
 	"didChangeConfiguration": {"dynamicRegistration": true},
@@ -70,6 +72,8 @@ LSP_SETTINGS = """{
 }"""
 
 PROJECT_PATH = ''
+# all workspace folders, PROJECT_PATH is the first one
+PROJECT_PATHS = []
 MAX_SAVE_PATH = 20
 
 keyJumpDef = "F3"
@@ -78,13 +82,53 @@ keyJumpBack = "<Alt>B"
 keyJumpNext = "<Shift>B"
 # tabSuggestion = "<Ctrl>e"
 keyProjDir = "F5"
+keyMetrics = "<Shift>F5"
+keySymbolSearch = "<Ctrl>F3"
+keyJumpEnclosing = "<Alt>F3"
+keyPeek = "<Shift>F3"
 
 historymax = 100
+# milliseconds the pointer has to rest before a hover request is sent
+hoverdelay = 300
+# seconds a request may take, a streamed one since its last batch
+requesttimeout = 30
+# seconds the server may take to answer initialize before it is restarted
+initializetimeout = 60
+# completion proposals shown at most
+completionmax = 500
+# references listed at most in the peek window
+peekreferences = 20
+# milliseconds of no typing before the outline is asked for again
+outlinedelay = 500
+# symbols shown at most in the symbol search
+symbolsearchmax = 200
+# milliseconds of no typing before the symbol search asks the server too
+symbolsearchdelay = 200
+# ask for the definitions of the identifiers on screen while idle
+prefetch = os.getenv("LSPJUMP_PREFETCH", "").lower() in ["true", "1"]
+# milliseconds of idling before, requests per screen and at a time
+prefetchdelay = 1000
+prefetchbudget = 200
+prefetchinflight = 2
+# while the server is indexing, seconds between background requests (hover)
+indexingthrottle = 2
+# seconds before a crashed server is restarted, doubled for every failed attempt up to restartdelaymax
+restartdelay = 1
+restartdelaymax = 60
 
-LSP_NAVIGATOR=None
+# lspJump.serverManager.LspManager, created when a project path is chosen
+LSP_MANAGER=None
 
 DEBUG = os.getenv("DEBUG", "").lower() in ["true", "1"]
 DEVELOP_FEATURES = os.getenv("DEVELOP_FEATURES", "").lower() in ["true", "1"]
+# restart a server using more than this many MiB of memory, 0 turns it off
+servermaxrss = int(os.getenv("LSPJUMP_MAX_RSS_MB", "0") or 0)
+# seconds between memory checks
+rsscheckinterval = 10
+# share one server per project with the other gedits through lspJump.daemon
+daemon = os.getenv("LSPJUMP_DAEMON", "").lower() in ["true", "1"]
+# seconds the daemon keeps the server after the last gedit left
+daemonidletimeout = 600
 
 #########
 
@@ -106,10 +150,14 @@ def get_window_programming_language_type(window):
 		return get_document_programming_language_type(doc)
 	return None
 
-def get_if_supported_language_type(doctype,print_on_fail):
+def get_if_supported_language_type(doctype,print_on_fail,languages=None):
 	global LSP_LANGUAGES
+	if languages is None:
+		languages=LSP_LANGUAGES
+	if doctype is None:
+		return False
 	doctype_lower=doctype.lower()
-	supported_languages=LSP_LANGUAGES.lower().split(',')
+	supported_languages=languages.lower().split(',')
 	
 	if doctype_lower in supported_languages:
 		return True
@@ -117,6 +165,22 @@ def get_if_supported_language_type(doctype,print_on_fail):
 		print("DOCTYPE=\""+doctype+"\" SUPPORTED LANGUAGES="+str(supported_languages))
 	return False
 
+def get_project_paths():
+	if PROJECT_PATHS:
+		return PROJECT_PATHS
+	if PROJECT_PATH:
+		return [PROJECT_PATH]
+	return []
+
+def set_project_paths(paths):
+	global PROJECT_PATH
+	global PROJECT_PATHS
+	PROJECT_PATHS = list(paths)
+	if PROJECT_PATHS:
+		PROJECT_PATH = PROJECT_PATHS[0]
+	else:
+		PROJECT_PATH = ''
+
 def getValueFromSettings(obj,attr,def_val):
 	lsp_searchs = obj.findall(attr)
 	if lsp_searchs is not None and len(lsp_searchs)>0:
@@ -124,6 +188,92 @@ def getValueFromSettings(obj,attr,def_val):
 			return lsp_searchs[0].text
 	return def_val
 
+class LspProfile:
+	def __init__(self, name, languages, lsp_bin, bin_args, search_path, lsp_settings):
+		self.name = name
+		self.languages = languages
+		self.bin = lsp_bin
+		self.bin_args = bin_args
+		self.search_path = search_path
+		self.settings = lsp_settings
+
+	def supports(self, doctype, print_on_fail=False):
+		return get_if_supported_language_type(doctype, print_on_fail, self.languages)
+
+	def get_key(self):
+		# a server started with a different key runs an outdated profile
+		return (self.name, self.languages, self.bin, self.bin_args, self.search_path, self.settings)
+
+def get_profile_from_settings(language_setting):
+	return LspProfile(language_setting.get("name"),
+		getValueFromSettings(language_setting,"lsp_language",""),
+		getValueFromSettings(language_setting,"lsp_bin",""),
+		getValueFromSettings(language_setting,"lsp_bin_args",""),
+		getValueFromSettings(language_setting,"lsp_search",""),
+		getValueFromSettings(language_setting,"lsp_settings","{}"))
+
+# parsed from SETTINGS_DATA once, see forget_profiles
+PROFILES = None
+CURRENT_PROFILE = None
+# doctype -> profile or None
+PROFILE_FOR_LANGUAGE = {}
+
+def forget_profiles():
+	"""
+	Called whenever the settings are loaded or saved.
+	"""
+	global PROFILES
+	global CURRENT_PROFILE
+	PROFILES = None
+	CURRENT_PROFILE = None
+	PROFILE_FOR_LANGUAGE.clear()
+
+def get_current_profile():
+	global CURRENT_PROFILE
+	if CURRENT_PROFILE is None:
+		name = "default"
+		if SETTINGS_LANGUAGE is not None and SETTINGS_LANGUAGE.get("name") is not None:
+			name = SETTINGS_LANGUAGE.get("name")
+		CURRENT_PROFILE = LspProfile(name, LSP_LANGUAGES, LSP_BIN, LSP_BIN_ARGS, LSP_SEARCH_PATH, LSP_SETTINGS)
+	return CURRENT_PROFILE
+
+def get_profiles():
+	global PROFILES
+	if SETTINGS_DATA is None:
+		return [get_current_profile()]
+	if PROFILES is None:
+		PROFILES = [get_profile_from_settings(language_setting) for language_setting in SETTINGS_DATA.findall("language") if language_setting.get("name") is not None]
+	return list(PROFILES)
+
+def get_profile(name):
+	"""
+	The profile called name as it is in the settings now, or None.
+	"""
+	for profile in get_profiles():
+		if profile.name == name:
+			return profile
+	current = get_current_profile()
+	return current if current.name == name else None
+
+def get_profile_for_language(doctype):
+	"""
+	The profile selected in the settings wins for its languages, other
+	languages go to the first profile in the settings file handling them.
+	"""
+	if doctype in PROFILE_FOR_LANGUAGE:
+		return PROFILE_FOR_LANGUAGE[doctype]
+	found = None
+	current = get_current_profile()
+	if current.supports(doctype):
+		found = current
+	else:
+		for profile in get_profiles():
+			if profile.supports(doctype):
+				found = profile
+				break
+	PROFILE_FOR_LANGUAGE[doctype] = found
+	return found
+
 def getSettings(profilename):
 	global LSP_BIN
 	global LSP_BIN_ARGS
@@ -150,6 +300,7 @@ def getSettings(profilename):
 					LSP_SEARCH_PATH = getValueFromSettings(SETTINGS_LANGUAGE,"lsp_search","")
 					LSP_LANGUAGES = getValueFromSettings(SETTINGS_LANGUAGE,"lsp_language","")
 					LSP_SETTINGS = getValueFromSettings(SETTINGS_LANGUAGE,"lsp_settings","{}")
+	forget_profiles()
 
 def setLspConfiguration(name,language,path,args,search_file,settings,overwrite=True):
 	global LSP_BIN
@@ -244,6 +395,7 @@ def setLspConfiguration(name,language,path,args,search_file,settings,overwrite=T
 	write_settings_data()
 
 def write_settings_data():
+	forget_profiles()
 	if SETTINGS_DATA is not None:
 		mydata = ET.tostring(SETTINGS_DATA)
 		myfile = open(SETTINGS_FILE, "wb")
@@ -275,8 +427,14 @@ def removeLanguage(languagename):
 			SETTINGS_DATA.remove(languages[0])
 	write_settings_data()
 
-def debugprint(msg):
+def debugprint(msg, *args):
+	"""
+	Formatting with args is only done when DEBUG is on, use
+	debugprint("a %s", b) instead of debugprint("a "+str(b)) on hot paths.
+	"""
 	if DEBUG:
+		if args:
+			msg = msg % args
 		print(msg)
 
 getSettings(None)
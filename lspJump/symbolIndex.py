@@ -0,0 +1,188 @@
+#	lspJump - a gedit plugin to browse code using the LSP protocol
+#	Copyright (C) 2020  Florian Evaldsson
+
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import sqlite3
+import threading
+import concurrent.futures
+
+from lspJump.fuzzy import fuzzy_score
+from lspJump.cache import get_cache_path
+from lspJump.documentSync import uri_to_path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+	uri TEXT PRIMARY KEY,
+	mtime INTEGER
+);
+CREATE TABLE IF NOT EXISTS symbols (
+	name TEXT NOT NULL,
+	lower TEXT NOT NULL,
+	kind INTEGER,
+	container TEXT,
+	uri TEXT NOT NULL,
+	line INTEGER,
+	character INTEGER,
+	end_line INTEGER,
+	end_character INTEGER,
+	UNIQUE (uri, line, character, name)
+);
+CREATE INDEX IF NOT EXISTS symbols_uri ON symbols (uri);
+CREATE INDEX IF NOT EXISTS symbols_lower ON symbols (lower COLLATE NOCASE);
+"""
+SELECT_ROWS = "SELECT rowid, name, kind, container, uri, line, character FROM symbols "
+
+# writes go through one thread, the reader thread never waits for the disk
+INDEX_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="lspJump-symbols")
+
+def is_under(uri, roots):
+	path = uri_to_path(uri)
+	for root in roots:
+		root = root.rstrip(os.sep)
+		if path == root or path.startswith(root + os.sep):
+			return True
+	return False
+
+def get_mtime(uri):
+	try:
+		return os.stat(uri_to_path(uri)).st_mtime_ns
+	except OSError:
+		return None
+
+def symbol_information_row(symbol):
+	location = symbol["location"]
+	# WorkspaceSymbol may leave out the range
+	symbol_range = location.get("range") or {"start":{"line":0, "character":0}, "end":{"line":0, "character":0}}
+	start = symbol_range["start"]
+	end = symbol_range["end"]
+	return (symbol["name"], symbol["name"].lower(), symbol.get("kind"), symbol.get("containerName"), location["uri"], start["line"], start["character"], end["line"], end["character"])
+
+def like_escape(char):
+	return "\\"+char if char in "\\%_" else char
+
+def like_pattern(query):
+	# the characters of query in order, anything in between
+	return "%" + "%".join(like_escape(char) for char in query.lower()) + "%"
+
+class SymbolIndex:
+	"""
+	Symbols of one profile and set of project folders in a SQLite file, so
+	that searching works right away the next time and while the server is
+	busy.
+	"""
+	def __init__(self, path):
+		self.path = path
+		if path != ":memory:":
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+		self.lock = threading.Lock()
+		self.connection = sqlite3.connect(path, check_same_thread=False)
+		self.connection.executescript(SCHEMA)
+		# search runs on the GTK thread and must not wait for the writes of
+		# INDEX_EXECUTOR, with WAL a second connection reads the last commit
+		self.reader = self.connection
+		self.reader_lock = self.lock
+		if path != ":memory:" and self.connection.execute("PRAGMA journal_mode=WAL").fetchone()[0] == "wal":
+			self.reader = sqlite3.connect(path, check_same_thread=False)
+			self.reader_lock = threading.Lock()
+
+	def replace_file(self, uri, rows):
+		"""
+		Replaces all symbols of uri, for a documentSymbol answer.
+		"""
+		with self.lock, self.connection:
+			self.connection.execute("DELETE FROM symbols WHERE uri = ?", (uri,))
+			self.connection.executemany("INSERT OR REPLACE INTO symbols VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+			self.connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?)", (uri, get_mtime(uri)))
+
+	def add_symbols(self, rows):
+		"""
+		Merges symbols from a workspace/symbol answer.
+		"""
+		with self.lock, self.connection:
+			self.connection.executemany("INSERT OR REPLACE INTO symbols VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+			for uri in set(row[4] for row in rows):
+				self.connection.execute("INSERT OR IGNORE INTO files VALUES (?, ?)", (uri, get_mtime(uri)))
+
+	def remove_file(self, uri):
+		with self.lock, self.connection:
+			self.connection.execute("DELETE FROM symbols WHERE uri = ?", (uri,))
+			self.connection.execute("DELETE FROM files WHERE uri = ?", (uri,))
+
+	def get_changed_files(self, roots):
+		"""
+		Returns the uris of indexed files under roots that changed on disk
+		since, files that are gone are removed right away. Files elsewhere
+		(system headers found by workspace/symbol) are left alone.
+		"""
+		with self.lock:
+			files = self.connection.execute("SELECT uri, mtime FROM files").fetchall()
+		changed = []
+		for uri, mtime in files:
+			if not is_under(uri, roots):
+				continue
+			current = get_mtime(uri)
+			if current is None:
+				self.remove_file(uri)
+			elif current != mtime:
+				changed.append(uri)
+		return changed
+
+	def search(self, query, limit=200):
+		"""
+		Returns up to limit rows (name, kind, container, uri, line,
+		character), best fuzzy matches first.
+		"""
+		query = query.strip()
+		with self.reader_lock:
+			if not query:
+				return [row[1:] for row in self.reader.execute(SELECT_ROWS+"ORDER BY lower COLLATE NOCASE LIMIT ?", (limit,))]
+			# the LIKEs narrow down to candidates, prefixes through the index
+			candidates = {}
+			prefix = "".join(like_escape(char) for char in query.lower()) + "%"
+			# the shortest prefix matches score best
+			for row in self.reader.execute(SELECT_ROWS+"WHERE lower LIKE ? ESCAPE '\\' ORDER BY length(lower) LIMIT ?", (prefix, limit)):
+				candidates[row[0]] = row[1:]
+			# nothing else could rank above them
+			if len(candidates) >= limit:
+				return sorted(candidates.values(), key=lambda row: len(row[0]))
+			for row in self.reader.execute(SELECT_ROWS+"WHERE lower LIKE ? ESCAPE '\\' LIMIT ?", (like_pattern(query), limit * 20)):
+				candidates[row[0]] = row[1:]
+		pattern = query.lower()
+		scored = []
+		for row in candidates.values():
+			score = fuzzy_score(pattern, row[0])
+			if score is not None:
+				scored.append((-score, len(row[0]), row))
+		scored.sort(key=lambda entry: entry[:2])
+		return [row for score, length, row in scored[:limit]]
+
+	def count(self):
+		with self.reader_lock:
+			return self.reader.execute("SELECT COUNT(*) FROM symbols").fetchone()[0]
+
+	def close(self):
+		with self.reader_lock:
+			if self.reader is not self.connection:
+				self.reader.close()
+		with self.lock:
+			self.connection.close()
+
+def open_index(profile_name, roots):
+	try:
+		return SymbolIndex(get_cache_path("symbols", profile_name, roots))
+	except (OSError, sqlite3.Error) as e:
+		print("Could not open the symbol index, keeping it in memory:", e)
+		return SymbolIndex(":memory:")
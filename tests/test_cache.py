@@ -0,0 +1,139 @@
+#	lspJump - a gedit plugin to browse code using the LSP protocol
+#	Copyright (C) 2020  Florian Evaldsson
+
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import concurrent.futures
+
+from lspJump.cache import LruCache, HoverCache, ResultCache, PersistentResultCache
+
+def hover_range(start, end):
+	return {"contents":"doc", "range":{"start":{"line":start[0], "character":start[1]}, "end":{"line":end[0], "character":end[1]}}}
+
+def test_lru_evicts_least_recently_used():
+	evicted = []
+	cache = LruCache(2, lambda key, value: evicted.append(key))
+	cache.put("a", 1)
+	cache.put("b", 2)
+	assert cache.get("a") == 1
+	cache.put("c", 3)
+	assert evicted == ["b"]
+	assert cache.get("b") is None
+	assert cache.get("a") == 1 and cache.get("c") == 3
+	assert len(cache) == 2
+
+def test_hover_hits_inside_the_answered_range():
+	cache = HoverCache()
+	cache.store("file:///a.c", 1, (3, 5), hover_range((3, 4), (3, 9)))
+	assert cache.lookup("file:///a.c", 1, (3, 8)).result["contents"] == "doc"
+	# the end is not part of the word
+	assert cache.lookup("file:///a.c", 1, (3, 9)) is None
+	# another version of the document
+	assert cache.lookup("file:///a.c", 2, (3, 5)) is None
+
+def test_hover_without_range_covers_its_position():
+	cache = HoverCache()
+	cache.store("file:///a.c", 1, (3, 5), {"contents":"doc"})
+	assert cache.lookup("file:///a.c", 1, (3, 5)) is not None
+	assert cache.lookup("file:///a.c", 1, (3, 6)) is None
+
+def test_hover_ignores_a_range_not_around_the_position():
+	cache = HoverCache()
+	cache.store("file:///a.c", 1, (3, 5), hover_range((7, 0), (7, 4)))
+	assert cache.lookup("file:///a.c", 1, (7, 1)) is None
+	assert cache.lookup("file:///a.c", 1, (3, 5)) is not None
+
+def test_hover_invalidate_and_evict():
+	cache = HoverCache(maxsize=1)
+	cache.store("file:///a.c", 1, (0, 0), None)
+	cache.store("file:///b.c", 1, (0, 0), None)
+	assert cache.lookup("file:///a.c", 1, (0, 0)) is None
+	assert ("file:///a.c", 1) not in cache.by_document
+	cache.invalidate("file:///b.c")
+	assert cache.lookup("file:///b.c", 1, (0, 0)) is None
+
+def key(uri="file:///a.c", position=(1, 2)):
+	return ("textDocument/definition", uri, 1, position)
+
+def test_result_cache_joins_a_request_on_its_way():
+	cache = ResultCache()
+	requests = []
+	def make_request():
+		requests.append(concurrent.futures.Future())
+		return requests[-1]
+	first = cache.request(key(), make_request)
+	second = cache.request(key(), make_request)
+	assert len(requests) == 1
+	assert first is not second
+	requests[0].set_result(["location"])
+	assert first.result(0) == ["location"] and second.result(0) == ["location"]
+	# stored, no request any more
+	assert cache.request(key(), make_request).result(0) == ["location"]
+	assert len(requests) == 1
+
+def test_result_cache_release_counts_the_callers():
+	cache = ResultCache()
+	source = concurrent.futures.Future()
+	first = cache.request(key(), lambda: source)
+	second = cache.request(key(), lambda: source)
+	assert first.source is source
+	assert not first.release()
+	# released once only
+	assert not first.release()
+	assert second.release()
+	# a new caller makes a new request
+	replacement = concurrent.futures.Future()
+	assert cache.request(key(), lambda: replacement).source is replacement
+
+def test_result_cache_does_not_store_errors():
+	cache = ResultCache()
+	source = concurrent.futures.Future()
+	future = cache.request(key(), lambda: source)
+	source.set_exception(TimeoutError("no answer"))
+	assert isinstance(future.exception(0), TimeoutError)
+	assert cache.get(key()) is None
+
+def test_result_cache_drops_answers_of_invalidated_uris():
+	cache = ResultCache()
+	stale = concurrent.futures.Future()
+	other = concurrent.futures.Future()
+	cache.request(key(), lambda: stale)
+	cache.request(key("file:///b.c"), lambda: other)
+	cache.invalidate("file:///a.c")
+	stale.set_result(["old"])
+	other.set_result(["kept"])
+	assert cache.get(key()) is None
+	assert cache.get(key("file:///b.c")) == ["kept"]
+
+def test_result_cache_clear_drops_answers_on_their_way():
+	cache = ResultCache()
+	stale = concurrent.futures.Future()
+	cache.request(key(), lambda: stale)
+	cache.clear()
+	stale.set_result(["old"])
+	assert cache.get(key()) is None
+
+def test_persistent_cache_keeps_the_current_content_only(tmp_path):
+	path = str(tmp_path / "results.sqlite")
+	cache = PersistentResultCache(path)
+	cache.store("textDocument/definition", "file:///a.c", "hash1", (1, 2), [{"uri":"file:///b.c"}])
+	assert cache.get("textDocument/definition", "file:///a.c", "hash1", (1, 2)) == [{"uri":"file:///b.c"}]
+	assert cache.get("textDocument/definition", "file:///a.c", "hash1", (1, 3)) is None
+	cache.store("textDocument/references", "file:///a.c", "hash2", (1, 2), [])
+	assert cache.get("textDocument/definition", "file:///a.c", "hash1", (1, 2)) is None
+	cache.close()
+	# kept between sessions
+	cache = PersistentResultCache(path)
+	assert cache.get("textDocument/references", "file:///a.c", "hash2", (1, 2)) == []
+	cache.close()
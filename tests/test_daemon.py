@@ -0,0 +1,186 @@
+#	lspJump - a gedit plugin to browse code using the LSP protocol
+#	Copyright (C) 2020  Florian Evaldsson
+
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import sys
+import time
+import socket
+import threading
+
+import pytest
+
+from lspJump.daemon import Daemon, Client, apply_change, read_message, write_message
+
+MOCK_SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "mockServer.py")
+
+def change(start, end, text):
+	return {"range":{"start":{"line":start[0], "character":start[1]}, "end":{"line":end[0], "character":end[1]}}, "text":text}
+
+def test_apply_change():
+	text = "int a;\nint b;\n"
+	assert apply_change(text, change((1, 4), (1, 5), "c")) == "int a;\nint c;\n"
+	assert apply_change(text, change((0, 6), (1, 0), "")) == "int a;int b;\n"
+	assert apply_change(text, change((2, 0), (2, 0), "int d;\n")) == text + "int d;\n"
+	assert apply_change(text, {"text":"new"}) == "new"
+
+def test_apply_change_clamps_to_the_line():
+	assert apply_change("ab\ncd\n", change((0, 10), (0, 10), "x")) == "abx\ncd\n"
+	assert apply_change("ab\ncd\n", change((5, 0), (5, 0), "x")) == "ab\ncd\nx"
+
+def test_apply_change_encodings():
+	text = "s = \"😀é\"\n"
+	# after the é
+	assert apply_change(text, change((0, 8), (0, 8), "x")) == "s = \"😀éx\"\n"
+	assert apply_change(text, change((0, 7), (0, 7), "x"), "utf-32") == "s = \"😀éx\"\n"
+	assert apply_change(text, change((0, 11), (0, 11), "x"), "utf-8") == "s = \"😀éx\"\n"
+
+class LspClient:
+	def __init__(self, path):
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.sock.settimeout(10)
+		self.sock.connect(path)
+		self.reader = self.sock.makefile("rb")
+		self.writer = self.sock.makefile("wb")
+
+	def notify(self, method, params):
+		write_message(self.writer, {"jsonrpc":"2.0", "method":method, "params":params})
+
+	def send(self, request_id, method, params):
+		write_message(self.writer, {"jsonrpc":"2.0", "id":request_id, "method":method, "params":params})
+
+	def receive(self, request_id):
+		while True:
+			message = read_message(self.reader)
+			assert message is not None
+			if message.get("id") == request_id and "method" not in message:
+				return message
+
+	def request(self, request_id, method, params):
+		self.send(request_id, method, params)
+		return self.receive(request_id)
+
+	def initialize(self, folders=()):
+		answer = self.request(1, "initialize", {"processId":None, "rootUri":None, "capabilities":{}, "workspaceFolders":[{"uri":"file://"+folder, "name":folder} for folder in folders]})
+		self.notify("initialized", {})
+		return answer
+
+	def close(self):
+		self.sock.close()
+
+@pytest.fixture
+def shared(tmp_path):
+	daemon = Daemon([sys.executable, MOCK_SERVER], 60)
+	daemon.start_server()
+	path = str(tmp_path / "daemon.sock")
+	thread = threading.Thread(target=daemon.serve, args=(path,), daemon=True)
+	thread.start()
+	deadline = time.monotonic() + 10
+	while not os.path.exists(path) and time.monotonic() < deadline:
+		time.sleep(0.01)
+	yield daemon, path
+	daemon.process.kill()
+	thread.join(5)
+
+def test_every_client_gets_its_own_ids(shared):
+	daemon, path = shared
+	first = LspClient(path)
+	second = LspClient(path)
+	assert "capabilities" in first.initialize()["result"]
+	assert second.initialize()["result"] == first.initialize()["result"]
+	params = {"textDocument":{"uri":"file:///src/a.c"}, "position":{"line":0, "character":0}}
+	first.send(7, "textDocument/definition", params)
+	second.send(7, "textDocument/definition", params)
+	for client in (first, second):
+		answer = client.receive(7)
+		assert answer["result"][0]["uri"].startswith("file://")
+	with daemon.lock:
+		assert daemon.pending == {}
+	first.close()
+	second.close()
+
+def test_a_document_is_opened_once(shared):
+	daemon, path = shared
+	uri = "file:///src/a.c"
+	first = LspClient(path)
+	second = LspClient(path)
+	first.initialize()
+	second.initialize()
+	text = "s = \"😀é\"\n"
+	for client in (first, second):
+		client.notify("textDocument/didOpen", {"textDocument":{"uri":uri, "languageId":"c", "version":1, "text":text}})
+	# answered once the daemon has read the notifications before it
+	second.request(2, "mock/opened", None)
+	assert first.request(2, "mock/opened", None)["result"] == 1
+	first.notify("textDocument/didChange", {"textDocument":{"uri":uri, "version":2}, "contentChanges":[change((0, 8), (0, 8), "x")]})
+	first.request(3, "mock/opened", None)
+	with daemon.lock:
+		document = daemon.documents[uri]
+		owner = document.owner
+		assert [document.texts[client] for client in daemon.clients] == ["s = \"😀éx\"\n", text]
+		version = document.version
+	# the other client changes it, the server gets its whole text
+	second.notify("textDocument/didChange", {"textDocument":{"uri":uri, "version":2}, "contentChanges":[{"text":"int a;\n"}]})
+	second.request(3, "mock/opened", None)
+	with daemon.lock:
+		assert document.owner is not owner
+		assert document.version == version + 1
+	first.close()
+	second.close()
+
+def make_client(daemon, number):
+	sock, other = socket.socketpair()
+	client = Client(daemon, sock, number)
+	daemon.clients.append(client)
+	return client
+
+def folder(path):
+	return {"uri":"file://"+path, "name":path}
+
+@pytest.fixture
+def offline():
+	"""
+	A Daemon without a server, what it would send is collected.
+	"""
+	daemon = Daemon(["none"], 60)
+	sent = []
+	daemon.send_server = sent.append
+	return daemon, sent
+
+def test_server_requests_get_valid_answers(offline):
+	daemon, sent = offline
+	daemon.from_server({"jsonrpc":"2.0", "id":"a", "method":"workspace/configuration", "params":{"items":[{"section":"x"}, {"section":"y"}]}})
+	daemon.from_server({"jsonrpc":"2.0", "id":"b", "method":"window/workDoneProgress/create", "params":{"token":"t"}})
+	daemon.from_server({"jsonrpc":"2.0", "id":"c", "method":"window/showMessageRequest", "params":{}})
+	assert sent[0] == {"jsonrpc":"2.0", "id":"a", "result":[None, None]}
+	assert sent[1] == {"jsonrpc":"2.0", "id":"b", "result":None}
+	assert sent[2]["error"]["code"] == -32601
+
+def test_workspace_folders_are_merged(offline):
+	daemon, sent = offline
+	first = make_client(daemon, 1)
+	daemon.from_client(first, {"jsonrpc":"2.0", "id":1, "method":"initialize", "params":{"workspaceFolders":[folder("/a")]}})
+	daemon.from_server({"jsonrpc":"2.0", "id":daemon.initialize_id, "result":{"capabilities":{"workspace":{"workspaceFolders":{"supported":True, "changeNotifications":True}}}}})
+	daemon.from_client(first, {"jsonrpc":"2.0", "method":"initialized", "params":{}})
+	second = make_client(daemon, 2)
+	daemon.from_client(second, {"jsonrpc":"2.0", "id":1, "method":"initialize", "params":{"workspaceFolders":[folder("/a"), folder("/b")]}})
+	assert sent[-1]["params"] == {"event":{"added":[folder("/b")], "removed":[]}}
+	# /a is still used by the second one
+	daemon.from_client(first, {"jsonrpc":"2.0", "method":"workspace/didChangeWorkspaceFolders", "params":{"event":{"added":[folder("/c")], "removed":[folder("/a")]}}})
+	assert sent[-1]["params"] == {"event":{"added":[folder("/c")], "removed":[]}}
+	daemon.remove_client(second)
+	assert sent[-1]["params"] == {"event":{"added":[], "removed":[folder("/a"), folder("/b")]}}
+	for client in (first, second):
+		client.close()
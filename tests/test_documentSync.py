@@ -0,0 +1,202 @@
+#	lspJump - a gedit plugin to browse code using the LSP protocol
+#	Copyright (C) 2020  Florian Evaldsson
+
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from lspJump.documentSync import DocumentSync, TextDocumentSyncKind, get_character
+
+class TextIter:
+	"""
+	Enough of a GtkTextIter, at a code point offset into the text of a
+	Buffer.
+	"""
+	def __init__(self, buffer, offset):
+		self.buffer = buffer
+		self.offset = offset
+
+	def copy(self):
+		return TextIter(self.buffer, self.offset)
+
+	def get_line(self):
+		return self.buffer.text.count("\n", 0, self.offset)
+
+	def _line_start(self):
+		return self.buffer.text.rfind("\n", 0, self.offset) + 1
+
+	def get_line_offset(self):
+		return self.offset - self._line_start()
+
+	def get_line_index(self):
+		return len(self.buffer.text[self._line_start():self.offset].encode("utf-8"))
+
+	def set_line_offset(self, offset):
+		self.offset = self._line_start() + offset
+
+	def get_slice(self, end):
+		return self.buffer.text[self.offset:end.offset]
+
+class Location:
+	def __init__(self, path):
+		self.path = path
+
+	def get_location(self):
+		return self
+
+	def get_path(self):
+		return self.path
+
+class Buffer:
+	"""
+	Enough of a GeditDocument, edits emit insert-text and delete-range
+	before changing the text like GtkTextBuffer does.
+	"""
+	def __init__(self, path, text):
+		self.file = Location(path)
+		self.text = text
+		self.handlers = {}
+
+	def get_file(self):
+		return self.file
+
+	def get_start_iter(self):
+		return TextIter(self, 0)
+
+	def get_end_iter(self):
+		return TextIter(self, len(self.text))
+
+	def get_text(self, start, end, include_hidden_chars):
+		return self.text[start.offset:end.offset]
+
+	def connect(self, signal, handler):
+		handler_id = len(self.handlers) + 1
+		self.handlers[handler_id] = (signal, handler)
+		return handler_id
+
+	def disconnect(self, handler_id):
+		del self.handlers[handler_id]
+
+	def emit(self, signal, *args):
+		for name, handler in list(self.handlers.values()):
+			if name == signal:
+				handler(self, *args)
+
+	def insert(self, offset, text):
+		self.emit("insert-text", TextIter(self, offset), text, len(text.encode("utf-8")))
+		self.text = self.text[:offset] + text + self.text[offset:]
+
+	def delete(self, start, end):
+		self.emit("delete-range", TextIter(self, start), TextIter(self, end))
+		self.text = self.text[:start] + self.text[end:]
+
+class Endpoint:
+	def __init__(self):
+		self.notifications = []
+
+	def send_notification(self, method, **params):
+		self.notifications.append((method, params))
+
+def open_document(text, capabilities=None):
+	endpoint = Endpoint()
+	documents = DocumentSync(endpoint)
+	documents.set_capabilities(capabilities or {"textDocumentSync":2})
+	buffer = Buffer("/src/a.c", text)
+	open_doc = documents.open(buffer, "c")
+	return endpoint, documents, buffer, open_doc
+
+def position(line, character):
+	return {"line":line, "character":character}
+
+def test_open_sends_the_text():
+	endpoint, documents, buffer, open_doc = open_document("int a;\n")
+	assert endpoint.notifications == [("textDocument/didOpen", {"textDocument":{"uri":"file:///src/a.c", "languageId":"c", "version":1, "text":"int a;\n"}})]
+	assert documents.open(buffer, "c") is open_doc
+	assert len(endpoint.notifications) == 1
+
+def test_edits_are_sent_as_one_did_change():
+	endpoint, documents, buffer, open_doc = open_document("int a;\nint b;\n")
+	buffer.insert(11, "c")
+	buffer.delete(0, 4)
+	assert open_doc.version == 3
+	assert len(endpoint.notifications) == 1
+	documents.open(buffer, "c")
+	method, params = endpoint.notifications[-1]
+	assert method == "textDocument/didChange"
+	assert params["textDocument"] == {"uri":"file:///src/a.c", "version":3}
+	assert params["contentChanges"] == [
+		{"range":{"start":position(1, 4), "end":position(1, 4)}, "text":"c"},
+		{"range":{"start":position(0, 0), "end":position(0, 4)}, "text":""}
+	]
+	# nothing new, nothing sent
+	documents.open(buffer, "c")
+	assert len(endpoint.notifications) == 2
+
+def test_positions_count_utf16_code_units():
+	endpoint, documents, buffer, open_doc = open_document("s = \"😀é\"\n")
+	buffer.insert(8, "x")
+	documents.flush(open_doc)
+	changes = endpoint.notifications[-1][1]["contentChanges"]
+	# the emoji is two code units
+	assert changes == [{"range":{"start":position(0, 9), "end":position(0, 9)}, "text":"x"}]
+
+def test_positions_count_code_points_with_utf32():
+	endpoint, documents, buffer, open_doc = open_document("s = \"😀é\"\n", {"textDocumentSync":2, "positionEncoding":"utf-32"})
+	buffer.insert(8, "x")
+	documents.flush(open_doc)
+	assert endpoint.notifications[-1][1]["contentChanges"][0]["range"]["start"] == position(0, 8)
+
+def test_get_character():
+	buffer = Buffer("/src/a.c", "ab\n😀é=1")
+	text_iter = TextIter(buffer, 6)
+	assert get_character(text_iter, "utf-32") == 3
+	assert get_character(text_iter, "utf-16") == 4
+	assert get_character(text_iter, "utf-8") == 7
+
+def test_full_sync_sends_the_text():
+	endpoint, documents, buffer, open_doc = open_document("int a;\n", {"textDocumentSync":1})
+	assert documents.sync_kind == TextDocumentSyncKind.Full
+	buffer.insert(0, "// a\n")
+	documents.flush(open_doc)
+	assert endpoint.notifications[-1][1]["contentChanges"] == [{"text":"// a\nint a;\n"}]
+
+def test_no_sync_sends_nothing():
+	endpoint, documents, buffer, open_doc = open_document("int a;\n", {"textDocumentSync":{"openClose":False, "change":0}})
+	buffer.insert(0, "x")
+	documents.flush(open_doc)
+	assert endpoint.notifications == []
+
+def test_replay_replaces_the_pending_changes():
+	endpoint, documents, buffer, open_doc = open_document("int a;\n")
+	buffer.insert(0, "x")
+	with documents.lock:
+		replay = documents.get_replay_messages()
+	assert replay == [("textDocument/didOpen", {"textDocument":{"uri":"file:///src/a.c", "languageId":"c", "version":2, "text":"xint a;\n"}})]
+	documents.flush(open_doc)
+	assert endpoint.notifications[-1][0] == "textDocument/didOpen"
+
+def test_content_hash_per_version():
+	endpoint, documents, buffer, open_doc = open_document("int a;\n")
+	version, text = documents.get_text_to_hash(open_doc)
+	digest = documents.get_content_hash(open_doc, version, text)
+	assert documents.get_text_to_hash(open_doc) == (version, None)
+	buffer.insert(0, "x")
+	version, text = documents.get_text_to_hash(open_doc)
+	assert text == "xint a;\n"
+	assert documents.get_content_hash(open_doc, version, text) != digest
+
+def test_close_disconnects():
+	endpoint, documents, buffer, open_doc = open_document("int a;\n")
+	documents.close(buffer)
+	assert buffer.handlers == {}
+	assert endpoint.notifications[-1] == ("textDocument/didClose", {"textDocument":{"uri":"file:///src/a.c"}})
+	assert documents.get(buffer) is None
@@ -0,0 +1,51 @@
+#	lspJump - a gedit plugin to browse code using the LSP protocol
+#	Copyright (C) 2020  Florian Evaldsson
+
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from lspJump.fuzzy import fuzzy_score, CompletionIndex
+
+def test_no_score_without_the_characters_in_order():
+	assert fuzzy_score("xz", "fooBar") is None
+	assert fuzzy_score("rb", "fooBar") is None
+
+def test_prefix_then_substring_then_scattered():
+	prefix = fuzzy_score("foo", "fooBar")
+	substring = fuzzy_score("bar", "fooBar")
+	scattered = fuzzy_score("fb", "fooBar")
+	assert prefix > substring > scattered
+
+def test_shorter_prefix_match_scores_higher():
+	assert fuzzy_score("get", "getName") > fuzzy_score("get", "getNameOfThing")
+
+def test_word_boundaries_score_higher():
+	assert fuzzy_score("gn", "get_name") > fuzzy_score("gn", "gxxxnxxx")
+	assert fuzzy_score("gn", "getName") > fuzzy_score("gn", "gxxxnxxx")
+
+def test_completion_filter_orders_and_narrows():
+	items = [{"label":"print"}, {"label":"sprintf"}, {"label":"printf", "sortText":"0"}, {"label":"other"}]
+	index = CompletionIndex(items)
+	assert [item["label"] for item in index.filter("print")] == ["print", "printf", "sprintf"]
+	# only the matches of "print" are looked at again
+	assert index.filter("printf", limit=1) == [{"label":"printf", "sortText":"0"}]
+	assert index.last_matches == [1, 2]
+
+def test_completion_filter_text():
+	index = CompletionIndex([{"label":"size()", "filterText":"size"}])
+	assert index.filter("size") == [{"label":"size()", "filterText":"size"}]
+
+def test_covers():
+	assert CompletionIndex([], prefix="pr").covers("pri")
+	assert not CompletionIndex([], prefix="pr").covers("p")
+	assert not CompletionIndex([], incomplete=True).covers("pri")
@@ -0,0 +1,55 @@
+#	lspJump - a gedit plugin to browse code using the LSP protocol
+#	Copyright (C) 2020  Florian Evaldsson
+
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+
+from lspJump.lineCache import LineCache, build_line_index, get_lines_async, PREVIEW_LENGTH
+
+def test_build_line_index():
+	assert list(build_line_index(b"")) == [0]
+	assert list(build_line_index(b"a\nbc\n\nd")) == [0, 2, 5, 6]
+
+def test_get_lines(tmp_path):
+	path = tmp_path / "a.c"
+	path.write_bytes("int a;\n  \tint b;  \n\nvoid ä(void);".encode("utf-8"))
+	lines = LineCache().get_lines(str(path), [1, 2, 4, 5, 0])
+	assert lines == {1:"int a;", 2:"int b;", 4:"void ä(void);"}
+
+def test_long_lines_are_shortened(tmp_path):
+	path = tmp_path / "long.c"
+	path.write_text("x" * (PREVIEW_LENGTH * 10) + "\n")
+	assert LineCache().get_lines(str(path), [1])[1] == "x" * PREVIEW_LENGTH
+
+def test_empty_file(tmp_path):
+	path = tmp_path / "empty.c"
+	path.write_text("")
+	assert LineCache().get_lines(str(path), [1]) == {}
+
+def test_changed_file_is_indexed_again(tmp_path):
+	path = tmp_path / "a.c"
+	path.write_text("one\ntwo\n")
+	cache = LineCache()
+	assert cache.get_lines(str(path), [2]) == {2:"two"}
+	path.write_text("a longer first line\nsecond\nthird\n")
+	stat = os.stat(str(path))
+	# the same mtime as before is still caught by the size
+	os.utime(str(path), ns=(stat.st_atime_ns, cache.indexes.get(str(path)).mtime))
+	assert cache.get_lines(str(path), [2, 3]) == {2:"second", 3:"third"}
+
+def test_get_lines_async(tmp_path):
+	path = tmp_path / "a.c"
+	path.write_text("one\ntwo\n")
+	assert get_lines_async(str(path), [1]).result(5) == {1:"one"}
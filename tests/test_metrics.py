@@ -0,0 +1,58 @@
+#	lspJump - a gedit plugin to browse code using the LSP protocol
+#	Copyright (C) 2020  Florian Evaldsson
+
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+
+from lspJump.metrics import ProtocolMetrics, percentile
+
+def test_percentile():
+	assert percentile([], 0.5) is None
+	assert percentile([1, 2, 3, 4, 5], 0.5) == 3
+	assert percentile([1, 2, 3, 4, 5], 0.99) == 5
+
+def test_requests_leave_the_flight_whatever_happens():
+	metrics = ProtocolMetrics()
+	for i in range(4):
+		metrics.request_sent("textDocument/definition")
+	metrics.response_received("textDocument/definition", 100, 0.010, False)
+	metrics.response_received("textDocument/definition", 50, 0.030, True)
+	metrics.request_cancelled("textDocument/definition")
+	metrics.request_timed_out("textDocument/definition")
+	snapshot = metrics.snapshot()
+	definition = snapshot["methods"]["textDocument/definition"]
+	assert definition["count"] == 4
+	assert definition["in_flight"] == 0
+	assert definition["errors"] == 1
+	assert definition["cancelled"] == 1
+	assert definition["timed_out"] == 1
+	assert definition["bytes_in"] == 150
+	assert definition["p50_ms"] == 10.0
+	assert snapshot["in_flight"] == 0
+	assert snapshot["timed_out"] == 1
+
+def test_notifications_and_dump(tmp_path):
+	metrics = ProtocolMetrics()
+	metrics.notification_sent("textDocument/didChange", 20)
+	metrics.notification_received("$/progress", 30)
+	metrics.request_sent("shutdown")
+	metrics.bytes_sent("shutdown", 40)
+	path = tmp_path / "metrics.json"
+	metrics.dump(str(path))
+	methods = json.loads(path.read_text())["methods"]
+	assert methods["textDocument/didChange"]["bytes_out"] == 20
+	assert methods["$/progress"]["bytes_in"] == 30
+	assert methods["shutdown"]["in_flight"] == 1
+	assert methods["shutdown"]["bytes_out"] == 40
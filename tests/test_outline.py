@@ -0,0 +1,71 @@
+#	lspJump - a gedit plugin to browse code using the LSP protocol
+#	Copyright (C) 2020  Florian Evaldsson
+
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from lspJump.outline import Outline, FUNCTION_KINDS
+
+def make_range(start_line, start_character, end_line, end_character):
+	return {"start":{"line":start_line, "character":start_character}, "end":{"line":end_line, "character":end_character}}
+
+def make_symbol(name, kind, symbol_range, selection=None, children=None):
+	symbol = {"name":name, "kind":kind, "range":symbol_range, "selectionRange":selection or symbol_range}
+	if children is not None:
+		symbol["children"] = children
+	return symbol
+
+# class Shape { int area() { ... } int width; }  void main() { ... }
+SYMBOLS = [
+	make_symbol("Shape", 5, make_range(0, 0, 10, 1), make_range(0, 6, 0, 11), [
+		make_symbol("area", 6, make_range(1, 1, 4, 2), make_range(1, 5, 1, 9)),
+		make_symbol("width", 8, make_range(5, 1, 5, 11))
+	]),
+	make_symbol("main", 12, make_range(12, 0, 20, 1), make_range(12, 5, 12, 9))
+]
+
+def test_enclosing_finds_the_innermost_symbol():
+	outline = Outline(SYMBOLS)
+	assert len(outline) == 4
+	assert outline.names[outline.enclosing(2, 3)] == "area"
+	assert outline.names[outline.enclosing(5, 4)] == "width"
+	# between the members
+	assert outline.names[outline.enclosing(4, 10)] == "Shape"
+	assert outline.names[outline.enclosing(15, 0)] == "main"
+	assert outline.enclosing(11, 0) == -1
+
+def test_enclosing_includes_the_end():
+	outline = Outline(SYMBOLS)
+	assert outline.names[outline.enclosing(4, 2)] == "area"
+
+def test_enclosing_of_kinds_walks_up():
+	outline = Outline(SYMBOLS)
+	assert outline.names[outline.enclosing(2, 3, FUNCTION_KINDS)] == "area"
+	assert outline.enclosing(5, 4, FUNCTION_KINDS) == -1
+
+def test_parents_and_selection():
+	outline = Outline(SYMBOLS)
+	area = outline.names.index("area")
+	assert outline.names[outline.parents[area]] == "Shape"
+	assert outline.depths[area] == 1
+	assert outline.get_selection(area) == (1, 5)
+
+def test_symbol_information_is_flat():
+	outline = Outline([{"name":"f", "kind":12, "location":{"uri":"file:///a.c", "range":make_range(3, 0, 6, 1)}}])
+	assert outline.names[outline.enclosing(4, 0)] == "f"
+	assert outline.get_selection(0) == (3, 0)
+
+def test_rows_for_the_symbol_index():
+	rows = Outline(SYMBOLS).get_rows("file:///a.cpp")
+	assert ("area", "area", 6, "Shape", "file:///a.cpp", 1, 5, 4, 2) in rows
+	assert ("Shape", "shape", 5, None, "file:///a.cpp", 0, 6, 10, 1) in rows